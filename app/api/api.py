@@ -1,8 +1,11 @@
 from fastapi import APIRouter
 
-from app.api.routes import sessions
+from app.api.routes import admin, sessions
 
 api_router = APIRouter()
 
 api_router.include_router(
     sessions.router, prefix='/sessions', tags=['sessions'])
+
+api_router.include_router(
+    admin.router, prefix='/admin', tags=['admin'])
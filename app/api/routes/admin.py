@@ -0,0 +1,66 @@
+import json
+import secrets
+import typing
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
+
+from app.api.routes.sessions import get_hash_sessions, hash_layout
+from app.constants import STORE_KEY, SCAN_BATCH_SIZE
+from app.settings import settings
+
+from app.store import store
+
+
+def check_token(authorization: str = Header(None)):
+    """With an admin token set, requests must send it as a bearer token"""
+    token = settings.admin.token
+    if token and not secrets.compare_digest(
+        (authorization or '').encode(), f'Bearer {token}'.encode()
+    ):
+        raise HTTPException(status_code=403)
+
+
+router = APIRouter(dependencies=[Depends(check_token)])
+
+
+async def export_sessions_lines() -> typing.AsyncIterator[bytes]:
+    """One chunk of NDJSON lines per batch of scanned keys, so memory usage doesn't
+    depend on the number of sessions
+    """
+    batch = []
+
+    async for key in store.iter_keys(
+        STORE_KEY.format(session_id='*'), count=SCAN_BATCH_SIZE
+    ):
+        batch.append(key)
+        if len(batch) >= SCAN_BATCH_SIZE:
+            yield await export_batch(batch)
+            batch = []
+
+    if batch:
+        yield await export_batch(batch)
+
+
+async def export_batch(keys: typing.List[str]) -> bytes:
+    if hash_layout():
+        sessions = await get_hash_sessions(keys)
+        return b''.join(
+            json.dumps(session).encode() + b'\n' for session in sessions.values())
+
+    raws = await store.get_many_json_raw(keys)
+    # Sessions can expire between the scan and the read
+    lines = [raw.encode() if isinstance(raw, str) else raw for raw in raws if raw]
+
+    return b''.join(line + b'\n' for line in lines)
+
+
+@router.get('/sessions/export')
+async def export_sessions():
+    """Stream all the live sessions as NDJSON (one JSON session per line).
+    Disabled unless `ADMIN_EXPORT_ENABLED` is set
+    """
+    if not settings.admin.export_enabled:
+        raise HTTPException(status_code=404)
+
+    return StreamingResponse(
+        export_sessions_lines(), media_type='application/x-ndjson')
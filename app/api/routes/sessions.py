@@ -1,32 +1,229 @@
+import asyncio
 from datetime import datetime
-from fastapi import APIRouter, HTTPException
+from typing import Any, Dict, List
+from fastapi import APIRouter, HTTPException, Query, Response
+from fastapi.encoders import jsonable_encoder
 from pydantic import UUID4
 
-from app.api.schemas.session import Session, SessionBody
-from app.constants import STORE_KEY, SESSION_MAX_AGE
+from app.api.schemas.session import (
+    Session, SessionBody, SessionPatch, SessionBatch, SessionBatchBody,
+    SessionBatchCreated)
+from app.constants import (
+    STORE_KEY, SESSION_MAX_AGE, BATCH_MAX_SIZE, SESSION_ITEM, SESSION_DATA_ITEM)
+from app.expiration import sliding_expiration
+from app.settings import settings
+from app.util import json_merge_patch
 
 from app.store import store
 
 router = APIRouter()
 
 
+def new_session(body: SessionBody, now: datetime) -> Session:
+    return Session(
+        **body.dict(),
+        created_at=now,
+        expires_at=now + SESSION_MAX_AGE
+    )
+
+
+def hash_layout() -> bool:
+    return settings.app.session_layout == 'hash'
+
+
+def slide_expiry(key: str, session: Dict[str, Any]) -> Dict[str, Any]:
+    """With sliding expiration, extend the expiry of a session being read
+    """
+    if settings.app.sliding_expiration:
+        session['expires_at'] = sliding_expiration.touch(key)
+    return session
+
+
+def session_items(session: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Collection items of a session in the `hash` layout (items are dicts, data
+    values are wrapped)
+    """
+    items = {SESSION_ITEM: {k: v for k, v in session.items() if k != 'data'}}
+    for field, value in session['data'].items():
+        items[SESSION_DATA_ITEM.format(field=field)] = {'value': value}
+    return items
+
+
+def session_from_items(items: Dict[str, Dict[str, Any]]) -> Dict[str, Any] | None:
+    """Session stored in the `hash` layout, `None` if it doesn't exist
+    """
+    if SESSION_ITEM not in items:
+        return None
+
+    prefix = SESSION_DATA_ITEM.format(field='')
+    data = {
+        item[len(prefix):]: value.get('value')
+        for item, value in items.items() if item.startswith(prefix)
+    }
+    return {**items[SESSION_ITEM], 'data': data}
+
+
+async def get_hash_sessions(keys: List[str]) -> Dict[str, Dict[str, Any]]:
+    collections = await store.get_collections_json(keys)
+    sessions = {key: session_from_items(items) for key, items in zip(keys, collections)}
+    return {key: session for key, session in sessions.items() if session is not None}
+
+
+@router.get('', response_model=SessionBatch)
+@router.get('/', response_model=SessionBatch, include_in_schema=False)
+async def get_sessions(ids: List[UUID4] = Query(...)):
+    """Get several sessions at once (`?ids=<id>&ids=<id>...`)
+    """
+    if len(ids) > BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=422, detail=f'At most {BATCH_MAX_SIZE} ids are allowed')
+
+    keys = {STORE_KEY.format(session_id=id): id for id in ids}
+    if hash_layout():
+        found = await get_hash_sessions(list(keys))
+    else:
+        found = await store.get_many_json(list(keys))
+
+    return {
+        'sessions': [slide_expiry(key, session) for key, session in found.items()],
+        'missing': [id for key, id in keys.items() if key not in found]
+    }
+
+
+@router.post('/batch', response_model=SessionBatchCreated)
+async def post_sessions(body: SessionBatchBody):
+    """Create several sessions at once
+
+    Sessions that already exist are not overwritten, their ids are returned as
+    conflicts.
+    """
+    now = datetime.now()
+    sessions = {
+        STORE_KEY.format(session_id=item.id): new_session(item, now)
+        for item in body.sessions
+    }
+
+    until = (now + SESSION_MAX_AGE).timestamp()
+    if hash_layout():
+        created = await asyncio.gather(*(
+            store.create_items_json(
+                key, session_items(jsonable_encoder(session)), until=until)
+            for key, session in sessions.items()
+        ))
+    else:
+        created = await store.create_many_json(
+            {key: jsonable_encoder(session) for key, session in sessions.items()},
+            until=until)
+
+    return {
+        'sessions': [s for s, ok in zip(sessions.values(), created) if ok],
+        'conflicts': [s.id for s, ok in zip(sessions.values(), created) if not ok]
+    }
+
+
 @router.get('/{id}', response_model=Session)
 async def get_session(id: UUID4):
-    if await store.exists(STORE_KEY.format(session_id=id)):
-        return await store.get_json(STORE_KEY.format(session_id=id))
-    else:
+    key = STORE_KEY.format(session_id=id)
+
+    if hash_layout() or settings.app.sliding_expiration:
+        if hash_layout():
+            session = session_from_items(await store.get_collection_json(key))
+        else:
+            session = await store.get_json(key) or None
+
+        if session is None:
+            raise HTTPException(status_code=404)
+        return slide_expiry(key, session)
+
+    raw = await store.get_json_raw(key)
+
+    if not raw:
         raise HTTPException(status_code=404)
 
+    if settings.app.verify_sessions:
+        return Session.parse_raw(raw)
+
+    # Sessions are validated when written, the stored JSON is returned as is
+    return Response(content=raw, media_type='application/json')
+
 
 @router.post('/', response_model=Session)
 async def post_session(body: SessionBody):
-    if await store.exists(STORE_KEY.format(session_id=id)):
-        raise HTTPException(status_code=409)
+    session = new_session(body, datetime.now())
+
+    # Existence check and write happen in a single atomic store command
+    if hash_layout():
+        created = await store.create_items_json(
+            STORE_KEY.format(session_id=body.id),
+            session_items(jsonable_encoder(session)),
+            until=session.expires_at)
     else:
-        timestamps = dict(
-            created_at=datetime.now(),
-            expires_at=datetime.now() + SESSION_MAX_AGE
-        )
-        session = {**body.dict(), **timestamps}
-        await store.set_json(STORE_KEY.format(session_id=body.id), session, until=timestamps['expires_at'].timestamp())
-        return session
+        created = await store.create_json(
+            STORE_KEY.format(session_id=body.id),
+            jsonable_encoder(session),
+            until=session.expires_at)
+
+    if not created:
+        raise HTTPException(status_code=409)
+
+    return session
+
+
+@router.patch('/{id}', response_model=Session)
+async def patch_session(id: UUID4, body: SessionPatch):
+    """Update the session data with a JSON merge patch. The expiry is kept (or
+    extended, with sliding expiration)
+
+    With the `json` layout the whole session is rewritten, concurrent patches can
+    overwrite each other. With the `hash` layout only the patched fields are
+    written (and read, when merging objects).
+    """
+    key = STORE_KEY.format(session_id=id)
+
+    if hash_layout():
+        return await patch_hash_session(key, body.data)
+
+    session = await store.get_json(key)
+    if not session:
+        raise HTTPException(status_code=404)
+
+    session['data'] = json_merge_patch(session.get('data'), body.data)
+    slide_expiry(key, session)
+    await store.set_json(key, session, until=session['expires_at'])
+
+    return session
+
+
+async def patch_hash_session(key: str, patch: Dict[str, Any]) -> Dict[str, Any]:
+    merged = [field for field, value in patch.items() if isinstance(value, dict)]
+    meta, *current = await asyncio.gather(
+        store.get_item_json(key, SESSION_ITEM),
+        *(store.get_item_json(key, SESSION_DATA_ITEM.format(field=field))
+          for field in merged))
+
+    if not meta:
+        raise HTTPException(status_code=404)
+
+    values = {field: value.get('value') for field, value in zip(merged, current)}
+    changed = {
+        SESSION_DATA_ITEM.format(field=field): {
+            'value': json_merge_patch(values.get(field), value)}
+        for field, value in patch.items() if value is not None
+    }
+    deleted = [
+        SESSION_DATA_ITEM.format(field=field)
+        for field, value in patch.items() if value is None
+    ]
+
+    until = slide_expiry(key, meta)['expires_at']
+    if changed:
+        # Setting the expiry again makes sure a session expired meanwhile isn't
+        # recreated without one
+        await store.set_items_json(key, changed, until=until)
+    if deleted:
+        await store.delete_items(key, deleted)
+
+    session = session_from_items(await store.get_collection_json(key))
+    if session is None:
+        raise HTTPException(status_code=404)
+    return {**session, 'expires_at': until}
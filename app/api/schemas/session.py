@@ -1,5 +1,6 @@
-from typing import Annotated, Any, Dict
+from typing import Annotated, Any, Dict, List
 from app.api.schemas.base import Timestamp
+from app.constants import BATCH_MAX_SIZE
 
 from pydantic import UUID4, BaseModel, Field
 
@@ -12,3 +13,25 @@ class SessionBody(BaseModel):
 class Session(SessionBody):
     created_at: Timestamp
     expires_at: Timestamp
+
+
+class SessionPatch(BaseModel):
+    data: Annotated[Dict[str, Any], Field(
+        description='JSON merge patch (RFC 7386) of the session data: objects are '
+        'merged, `null` removes a field and other values replace it')]
+
+
+class SessionBatchBody(BaseModel):
+    sessions: Annotated[List[SessionBody], Field(
+        description='Sessions to create', max_items=BATCH_MAX_SIZE)]
+
+
+class SessionBatch(BaseModel):
+    sessions: Annotated[List[Session], Field(description='Sessions found')]
+    missing: Annotated[List[UUID4], Field(description='Session IDs not found')]
+
+
+class SessionBatchCreated(BaseModel):
+    sessions: Annotated[List[Session], Field(description='Sessions created')]
+    conflicts: Annotated[List[UUID4], Field(
+        description='Session IDs that already existed (left untouched)')]
@@ -1,12 +1,18 @@
-from fastapi import FastAPI
+import asyncio
+import logging
 
-from app import __version__
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from app import __version__, metrics
 from app.api import __version__ as __api_version__
 from app.api.api import api_router
 from app.api.schemas.message import Message
-from app.middleware import RequestLoggingMiddleware
+from app.constants import SCAN_BATCH_SIZE
+from app.expiration import sliding_expiration
+from app.middleware import MetricsMiddleware, RequestLoggingMiddleware
 from app.settings import settings
-from app.store import store
+from app.store import ValueTooLarge, store
 
 
 app = FastAPI(title='Service API', redoc_url=None)
@@ -14,18 +20,71 @@ app = FastAPI(title='Service API', redoc_url=None)
 
 # Middlewares
 
-app.add_middleware(RequestLoggingMiddleware)
+if settings.metrics.enabled:
+    app.add_middleware(MetricsMiddleware)
+
+app.add_middleware(
+    RequestLoggingMiddleware,
+    sample_rate=settings.app.log_sample_rate,
+    slow_ms=settings.app.log_slow_ms)
+
+
+# Errors
+
+@app.exception_handler(ValueTooLarge)
+async def value_too_large(request, error):
+    return JSONResponse(
+        status_code=413, content=Message(message='Session too large').dict())
 
 
 # Lifecycle
 
+async def migrate_keys():
+    try:
+        migrated = await store.migrate_keys(count=SCAN_BATCH_SIZE)
+    except Exception as error:
+        logging.error(f'Store keys migration failed: {error!r}')
+    else:
+        logging.info(f'Store keys migration done, {migrated} keys converted')
+
+
 @app.on_event('startup')
 async def startup():
     await store.connect()
 
+    if settings.metrics.enabled:
+        metrics.instrument_backend(store.backend)
+        metrics.register_store_metrics(store)
+
+    app.state.metrics_writer = None
+    if settings.metrics.enabled and settings.metrics.dir:
+        app.state.metrics_writer = asyncio.create_task(metrics.write_periodically(
+            settings.metrics.dir, settings.metrics.write_interval))
+
+    app.state.expiry_refresher = None
+    if settings.app.sliding_expiration:
+        app.state.expiry_refresher = asyncio.create_task(sliding_expiration.run())
+
+    app.state.key_migrator = None
+    if settings.store.migrate_keys:
+        app.state.key_migrator = asyncio.create_task(migrate_keys())
+
 
 @app.on_event('shutdown')
 async def shutdown():
+    if app.state.metrics_writer is not None:
+        app.state.metrics_writer.cancel()
+        metrics.registry.write(settings.metrics.dir)
+
+    if app.state.expiry_refresher is not None:
+        # The refresher flushes the pending expiries when cancelled
+        app.state.expiry_refresher.cancel()
+        await asyncio.gather(app.state.expiry_refresher, return_exceptions=True)
+
+    if app.state.key_migrator is not None:
+        app.state.key_migrator.cancel()
+        await asyncio.gather(app.state.key_migrator, return_exceptions=True)
+
     await store.disconnect()
 
 
@@ -38,6 +97,31 @@ def show_health_info():
     return Message.Ok()
 
 
+@app.get(
+    '/readyz', tags=['health'], response_model=Message,
+    responses={503: {'model': Message}})
+async def show_readiness():
+    """Readiness route, fails while the store is disconnected or saturated
+    """
+    if not store.is_ready():
+        return JSONResponse(
+            status_code=503, content=Message(message='not ready').dict())
+
+    return Message.Ok()
+
+
+@app.get('/metrics', tags=['health'], response_class=PlainTextResponse)
+async def show_metrics():
+    """Metrics in Prometheus text format
+    """
+    if not settings.metrics.enabled:
+        raise HTTPException(status_code=404)
+
+    return PlainTextResponse(
+        metrics.registry.render(settings.metrics.dir),
+        media_type='text/plain; version=0.0.4')
+
+
 @app.get('/', tags=['entrypoint'])
 def show_version():
     """Entrypoint information
@@ -0,0 +1,323 @@
+import asyncio
+import fnmatch
+import heapq
+import re
+import struct
+import sys
+import time
+import typing
+
+from app import persistence
+from app.keys import session_key, session_uuid
+from app.store import STALE_DEADLINES_MIN, STALE_DEADLINES_RATIO, MemoryBackend
+
+
+# Expiry (0: none) and kind of value, followed by the encoded value
+RECORD = struct.Struct('<dB')
+UNTIL = struct.Struct('<d')
+# Item of a collection: kind of value, name length and value length, followed by the
+# name and the value
+ITEM = struct.Struct('<BHI')
+STRING, BYTES, COLLECTION = (
+    persistence.STRING, persistence.BYTES, persistence.COLLECTION)
+
+Key = typing.Union[bytes, str]
+
+
+def encode_key(key: str) -> Key:
+    """16 bytes of the UUID for session keys, other keys are kept as they are"""
+    return session_uuid(key) or key
+
+
+def decode_key(key: Key) -> str:
+    return session_key(key) if isinstance(key, bytes) else key
+
+
+def pack(value: typing.Any, until: float | None) -> bytes:
+    """
+        >>> unpack(pack({'a': '1', 'b': b'2'}, 10))
+        ({'a': '1', 'b': b'2'}, 10.0)
+        >>> unpack(pack('{}', None))
+        ('{}', None)
+    """
+    if isinstance(value, bytes):
+        kind, raw = BYTES, value
+    elif isinstance(value, dict):
+        kind, raw = COLLECTION, pack_items(value)
+    else:
+        kind, raw = STRING, value.encode()
+    return RECORD.pack(until or 0, kind) + raw
+
+
+def pack_items(items: typing.Dict[str, str | bytes]) -> bytes:
+    chunks = []
+    for name, value in items.items():
+        kind, value = (BYTES, value) if isinstance(value, bytes) else (
+            STRING, value.encode())
+        name = name.encode()
+        chunks += [ITEM.pack(kind, len(name), len(value)), name, value]
+    return b''.join(chunks)
+
+
+def unpack_items(raw: memoryview) -> typing.Dict[str, str | bytes]:
+    items = {}
+    offset = 0
+    while offset < len(raw):
+        kind, name_length, value_length = ITEM.unpack_from(raw, offset)
+        start = offset + ITEM.size + name_length
+        offset = start + value_length
+        value = raw[start:offset]
+        items[str(raw[start - name_length:start], 'utf-8')] = (
+            str(value, 'utf-8') if kind == STRING else bytes(value))
+    return items
+
+
+def unpack(record: bytes) -> typing.Tuple[typing.Any, float | None]:
+    return decode_value(record), expiry(record) or None
+
+
+def decode_value(record: bytes) -> typing.Any:
+    kind = record[UNTIL.size]
+    if kind == STRING:
+        return record[RECORD.size:].decode()
+    elif kind == COLLECTION:
+        return unpack_items(memoryview(record)[RECORD.size:])
+    return record[RECORD.size:]
+
+
+def expiry(record: bytes) -> float:
+    return UNTIL.unpack_from(record)[0]
+
+
+class CompactMemoryBackend(MemoryBackend):
+    """Memory backend using less memory per key, selected with the `compact` option.
+
+    Session keys (`session.id.<uuid>`) are stored as the 16 bytes of their UUID,
+    and values in a single bytes record packing their expiry, kind and encoded
+    value: there are no expiry floats, and keys are kept in a plain dict. Deadlines
+    are kept in one list of keys per second, swept once the second is over (keys
+    read meanwhile are checked against their own expiry).
+
+    Reads decode the value, and there is no recency order: when `max_entries` or
+    `max_bytes` is reached, the key expiring first is evicted (then the oldest key
+    without expiry).
+    """
+
+    def __init__(self, url: str = 'memory://?compact=true'):
+        super().__init__(url)
+        self._dict: typing.Dict[Key, bytes] | None = None
+        # Keys expiring during each second, and a heap of these seconds
+        self._buckets: typing.Dict[int, typing.List[Key]] = {}
+        self._seconds: typing.List[int] = []
+        # Keys in the buckets, including keys overwritten or expiring later since
+        self._scheduled = 0
+
+    async def connect(self) -> None:
+        self._dict = {}
+        self._buckets = {}
+        self._seconds = []
+        self._scheduled = 0
+        self._bytes = 0
+        self._allocated = 0
+        if self.options.persist_dir:
+            self._restore()
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    def memory(self) -> typing.Dict[str, int]:
+        used = (
+            self._allocated + sys.getsizeof(self._dict)
+            + sys.getsizeof(self._buckets) + sys.getsizeof(self._seconds)
+            + sum(sys.getsizeof(bucket) for bucket in self._buckets.values()))
+        return {
+            'entries': len(self._dict),
+            'bytes': self._bytes,
+            'overhead': used - self._bytes,
+        }
+
+    def _load(self, records: typing.Iterator[persistence.Record]) -> None:
+        now = time.time()
+        for key, (value, until) in persistence.replay(records).items():
+            if until is None or until > now:
+                self._store(key, value, until)
+
+    def _entry(self, key: Key) -> persistence.Entry | None:
+        if (record := self._get(key)) is None:
+            return None
+        return (decode_key(key), *unpack(record))
+
+    def _log(
+        self,
+        operation: int,
+        key: Key,
+        value: typing.Any = None,
+        until: float | None = None
+    ) -> None:
+        if self._persistence is not None:
+            self._persistence.append(operation, decode_key(key), value, until)
+
+    def _expire(self) -> None:
+        now = time.time()
+        while self._seconds and self._seconds[0] <= now:
+            bucket = self._buckets.pop(heapq.heappop(self._seconds))
+            self._scheduled -= len(bucket)
+            for key in bucket:
+                record = self._dict.get(key)
+                # Keys overwritten or expiring later are left in the bucket, skip them
+                if record is not None and 0 < expiry(record) <= now:
+                    self._discard(key, log=False)
+
+    def _schedule(self, key: Key, until: float) -> None:
+        second = int(until) + 1
+        bucket = self._buckets.get(second)
+        if bucket is None:
+            bucket = self._buckets[second] = []
+            heapq.heappush(self._seconds, second)
+        bucket.append(key)
+        self._scheduled += 1
+
+        # The key stays in the bucket of its previous expiry until that second is
+        # over: with frequent refreshes, rebuild the buckets before they pile up
+        stale = self._scheduled - len(self._dict)
+        if stale > STALE_DEADLINES_RATIO * len(self._dict) + STALE_DEADLINES_MIN:
+            self._reschedule()
+
+    def _reschedule(self) -> None:
+        self._buckets, self._seconds, self._scheduled = {}, [], 0
+        for key, record in self._dict.items():
+            if until := expiry(record):
+                self._schedule(key, until)
+
+    def _get(self, key: Key) -> bytes | None:
+        """Record of the key, `None` if missing or expired"""
+        record = self._dict.get(key)
+        if record is None:
+            return None
+
+        until = expiry(record)
+        if until and until <= time.time():
+            self._discard(key, log=False)
+            return None
+        return record
+
+    def _discard(self, key: Key, log: bool = True) -> None:
+        record = self._dict.pop(key, None)
+        if record is None:
+            return
+
+        self._bytes -= len(key) + len(record)
+        self._allocated -= sys.getsizeof(key) + sys.getsizeof(record)
+        if log:
+            self._log(persistence.DELETE, key)
+
+    def _remove(self, key: str, log: bool = True) -> None:
+        self._discard(encode_key(key), log)
+
+    def _lookup(self, key: str, default: typing.Any) -> typing.Any:
+        self._expire()
+        record = self._get(encode_key(key))
+        return default if record is None else decode_value(record)
+
+    def _store(self, key: str, value: typing.Any, until: float | None) -> None:
+        key = encode_key(key)
+        self._put(key, pack(value, until), until)
+        self._log(persistence.SET, key, value, until)
+        self._evict()
+
+    def _put(self, key: Key, record: bytes, until: float | None) -> None:
+        # Removed first, so that the dict holds the key object of the last bucket
+        self._discard(key, log=False)
+        self._dict[key] = record
+        self._bytes += len(key) + len(record)
+        self._allocated += sys.getsizeof(key) + sys.getsizeof(record)
+        if until:
+            self._schedule(key, until)
+
+    def _set_until(self, key: Key, until: float) -> None:
+        record = self._get(key)
+        if record is not None:
+            self._put(key, UNTIL.pack(until) + record[UNTIL.size:], until)
+
+    def _victim(self) -> Key:
+        """Key expiring first, or the oldest key without expiry"""
+        while self._seconds:
+            bucket = self._buckets[self._seconds[0]]
+            while bucket:
+                key = bucket.pop()
+                self._scheduled -= 1
+                record = self._dict.get(key)
+                if record is not None and int(expiry(record)) + 1 == self._seconds[0]:
+                    return key
+            del self._buckets[heapq.heappop(self._seconds)]
+        return next(iter(self._dict))
+
+    def _evict(self) -> None:
+        max_entries, max_bytes = self.options.max_entries, self.options.max_bytes
+        while self._dict and (
+            (max_entries and len(self._dict) > max_entries)
+            or (max_bytes and self._bytes > max_bytes)
+        ):
+            self._discard(self._victim())
+
+    def _contains(self, key: str) -> bool:
+        return self._get(encode_key(key)) is not None
+
+    def _until(self, key: str) -> float | None:
+        record = self._get(encode_key(key))
+        return None if record is None else expiry(record) or None
+
+    async def expire_many(self, expiries: typing.Dict[str, int]) -> None:
+        self._expire()
+        for key, until in expiries.items():
+            key = encode_key(key)
+            # Like EXPIREAT, missing keys are ignored
+            if key in self._dict:
+                self._set_until(key, until)
+                self._log(persistence.EXPIRE, key, until=until)
+
+    async def iter_keys(
+        self,
+        pattern: str = '*',
+        *,
+        count: int = 100
+    ) -> typing.AsyncIterator[str]:
+        self._expire()
+        match = re.compile(fnmatch.translate(pattern)).match
+        # Snapshot of the keys, the dict may change while iterating
+        keys = list(self._dict)
+
+        for i in range(0, len(keys), count):
+            for key in keys[i:i + count]:
+                if self._get(key) is not None and match(name := decode_key(key)):
+                    yield name
+            await asyncio.sleep(0)
+
+    async def set_item(self, key: str, item: str, value: str) -> None:
+        collection = self._lookup(key, None)
+        if collection is None:
+            self._store(key, {item: value}, None)
+            return
+
+        # Like HSET, changing an item keeps the expiry of the collection
+        collection[item] = value
+        encoded = encode_key(key)
+        until = self._until(key)
+        self._put(encoded, pack(collection, until), until)
+        self._log(persistence.SET_ITEMS, encoded, {item: value})
+        self._evict()
+
+    async def delete_items(self, key: str, items: typing.List[str]) -> None:
+        collection = self._lookup(key, None)
+        if collection is None:
+            return
+
+        for item in items:
+            collection.pop(item, None)
+
+        # Like redis, empty collections don't exist
+        if not collection:
+            self._remove(key)
+        else:
+            encoded = encode_key(key)
+            until = self._until(key)
+            self._put(encoded, pack(collection, until), until)
+            self._log(persistence.SET, encoded, collection, until)
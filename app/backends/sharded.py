@@ -0,0 +1,363 @@
+import asyncio
+import bisect
+import hashlib
+import typing
+from collections import defaultdict
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+from app.store import Backend, MemoryBackend, RedisBackend
+
+# Expiry timestamp in the past: expiring a key at it deletes the key
+EXPIRED = 1
+
+
+def ring_hash(value: str | bytes) -> int:
+    """Stable 64 bits hash (python's `hash` changes between processes)"""
+    if isinstance(value, str):
+        value = value.encode()
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent hashing ring with virtual nodes.
+
+    Every node is placed `vnodes` times in the ring, a key belongs to the first node
+    found clockwise from its hash. Adding or removing a node only moves the keys of
+    its own ranges: about 1/N of the keys.
+
+        >>> ring = HashRing(['a', 'b', 'c'])
+        >>> ring.node('session.id.1') in ('a', 'b', 'c')
+        True
+    """
+
+    def __init__(self, nodes: typing.Iterable[str], vnodes: int = 160):
+        self.nodes = sorted(set(nodes))
+        points = sorted(
+            (ring_hash(f'{node}#{i}'), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, key: str | bytes) -> str:
+        index = bisect.bisect(self._hashes, ring_hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class ShardedBackend(Backend):
+    """Spreads keys across several backends using consistent hashing.
+
+    Url: `redis+sharded://host1:6379,host2:6379,host3?<redis options>`, each node
+    gets its own connection pool (`memory+sharded://a,b` is also supported, for
+    tests). Multi-key operations run concurrently on every involved node.
+
+    After changing the nodes, set the previous node list in the `previous` option:
+    keys not found in their new node are read from the node that owned them
+    before, removed nodes stay connected until `previous` is unset. Partial writes
+    (collection items) and expiry refreshes first move the key to its new node
+    (copied, then deleted from its previous node), so sessions in use move there;
+    writes of whole values delete the previous copy. The other keys are not moved
+    and expire on their previous node. Keep `previous` for at least the session
+    max age (`SESSION_MAX_AGE`) after the change.
+    """
+
+    BACKENDS = {'redis': RedisBackend, 'memory': MemoryBackend}
+
+    def __init__(self, url: str):
+        parsed_url = urlparse(url)
+        scheme = parsed_url.scheme.removesuffix('+sharded')
+        options = dict(parse_qsl(parsed_url.query))
+        previous = options.pop('previous', None)
+        vnodes = int(options.pop('vnodes', 160))
+        query = urlencode(options)
+
+        if scheme not in self.BACKENDS:
+            raise NameError(f'{parsed_url.scheme} not supported')
+
+        self.nodes: typing.Dict[str, Backend] = {
+            node: self.BACKENDS[scheme](f'{scheme}://{node}?{query}')
+            for node in parsed_url.netloc.split(',')
+        }
+        self.ring = HashRing(self.nodes, vnodes)
+        self.previous_ring = None
+        # Removed nodes, only read (and deleted from) until their keys expire
+        self.previous_nodes: typing.Dict[str, Backend] = {}
+        if previous:
+            self.previous_ring = HashRing(previous.split(','), vnodes)
+            self.previous_nodes = {
+                node: self.BACKENDS[scheme](f'{scheme}://{node}?{query}')
+                for node in self.previous_ring.nodes if node not in self.nodes
+            }
+        self._backends = {**self.nodes, **self.previous_nodes}
+        # Pub/sub messages must reach every process, they all use the same node
+        self._pubsub = self.nodes[self.ring.nodes[0]]
+
+    async def connect(self) -> None:
+        await asyncio.gather(*(node.connect() for node in self._backends.values()))
+
+    async def disconnect(self) -> None:
+        await asyncio.gather(*(node.disconnect() for node in self._backends.values()))
+
+    def is_ready(self) -> bool:
+        return all(node.is_ready() for node in self._backends.values())
+
+    def _node(self, key: str) -> Backend:
+        return self.nodes[self.ring.node(key)]
+
+    def _previous_node(self, key: str) -> Backend | None:
+        """Node that owned the key before the last change of nodes (if different)
+        """
+        if self.previous_ring is None:
+            return None
+
+        name = self.previous_ring.node(key)
+        if name == self.ring.node(key):
+            return None
+        return self._backends[name]
+
+    def _group(self, keys: typing.Iterable[str]) -> typing.Dict[str, typing.List[str]]:
+        groups = defaultdict(list)
+        for key in keys:
+            groups[self.ring.node(key)].append(key)
+        return groups
+
+    async def _move(self, keys: typing.Iterable[str]) -> None:
+        """Move the keys still held by their previous node to their node: copied,
+        then deleted from the previous node (a copy left behind would be read again
+        once the key is deleted from its node)
+        """
+        moves = [
+            (key, previous) for key in keys
+            if (previous := self._previous_node(key)) is not None]
+        if not moves:
+            return
+
+        async def move(key, previous):
+            if not await self._node(key).exists(key) and (
+                    dumped := await previous.dump(key)):
+                await self._node(key).restore(key, *dumped)
+            await previous.expire_many({key: EXPIRED})
+
+        await asyncio.gather(*(move(key, previous) for key, previous in moves))
+
+    async def _delete_previous(self, keys: typing.Iterable[str]) -> None:
+        """Delete the previous copies of keys written again"""
+        groups = defaultdict(dict)
+        for key in keys:
+            if self._previous_node(key) is not None:
+                groups[self.previous_ring.node(key)][key] = EXPIRED
+
+        await asyncio.gather(*(
+            self._backends[node].expire_many(expiries)
+            for node, expiries in groups.items()))
+
+    async def _misplaced(self, node: str, key: str | bytes) -> bool:
+        """Whether a key scanned from a node is a previous copy of a key of another
+        node (listed by that node)
+        """
+        owner = self.ring.node(key)
+        return owner != node and await self.nodes[owner].exists(key)
+
+    async def get(self, key: str) -> str:
+        raw = await self._node(key).get(key)
+        if not raw and (previous := self._previous_node(key)):
+            raw = await previous.get(key)
+        return raw
+
+    async def set(self, key: str, raw: str, *, until: int | None = None) -> None:
+        await self._node(key).set(key, raw, until=until)
+        await self._delete_previous([key])
+
+    async def create(self, key: str, raw: str, *, until: int | None = None) -> bool:
+        previous = self._previous_node(key)
+        if previous and await previous.exists(key):
+            return False
+        return await self._node(key).create(key, raw, until=until)
+
+    async def create_many(
+        self,
+        values: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> typing.List[bool]:
+        # Keys still held by their previous node exist
+        moving = [key for key in values if self._previous_node(key)]
+        existing = {
+            key for key, raw in zip(moving, await self._get_previous(moving)) if raw}
+
+        groups = self._group(key for key in values if key not in existing)
+        results = await asyncio.gather(*(
+            self.nodes[node].create_many(
+                {key: values[key] for key in group}, until=until)
+            for node, group in groups.items()))
+
+        created = {}
+        for group, oks in zip(groups.values(), results):
+            created.update(zip(group, oks))
+        return [created.get(key, False) for key in values]
+
+    async def get_many(self, keys: typing.List[str]) -> typing.List[str]:
+        groups = self._group(keys)
+        results = await asyncio.gather(
+            *(self.nodes[node].get_many(group) for node, group in groups.items()))
+
+        found = {}
+        for group, raws in zip(groups.values(), results):
+            found.update(zip(group, raws))
+
+        missing = [key for key in keys if not found[key] and self._previous_node(key)]
+        if missing:
+            for key, raw in zip(missing, await self._get_previous(missing)):
+                found[key] = raw
+
+        return [found[key] for key in keys]
+
+    async def _get_previous(self, keys: typing.List[str]) -> typing.List[str]:
+        groups = defaultdict(list)
+        for key in keys:
+            groups[self.previous_ring.node(key)].append(key)
+
+        results = await asyncio.gather(
+            *(self._backends[node].get_many(group) for node, group in groups.items()))
+
+        found = {}
+        for group, raws in zip(groups.values(), results):
+            found.update(zip(group, raws))
+        return [found[key] for key in keys]
+
+    async def set_many(
+        self,
+        values: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> None:
+        groups = self._group(values)
+        await asyncio.gather(*(
+            self.nodes[node].set_many({key: values[key] for key in group}, until=until)
+            for node, group in groups.items()
+        ))
+        await self._delete_previous(values)
+
+    async def expire_many(self, expiries: typing.Dict[str, int]) -> None:
+        await self._move(expiries)
+        groups = self._group(expiries)
+        await asyncio.gather(*(
+            self.nodes[node].expire_many({key: expiries[key] for key in group})
+            for node, group in groups.items()
+        ))
+
+    async def keys(self, pattern: str = '*') -> typing.List[str]:
+        return [key async for key in self.iter_keys(pattern)]
+
+    async def iter_keys(
+        self,
+        pattern: str = '*',
+        *,
+        count: int = 100
+    ) -> typing.AsyncIterator[str]:
+        # Nodes are scanned concurrently, the bounded queue keeps memory flat
+        queue = asyncio.Queue(maxsize=count)
+        done = object()
+
+        async def scan(name, node):
+            try:
+                async for key in node.iter_keys(pattern, count=count):
+                    if not await self._misplaced(name, key):
+                        await queue.put(key)
+            finally:
+                await queue.put(done)
+
+        tasks = [
+            asyncio.create_task(scan(name, node))
+            for name, node in self._backends.items()]
+        try:
+            pending = len(tasks)
+            while pending:
+                key = await queue.get()
+                if key is done:
+                    pending -= 1
+                else:
+                    yield key
+
+            # Raise scan errors, if any
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def exists(self, key: str) -> bool:
+        if await self._node(key).exists(key):
+            return True
+        previous = self._previous_node(key)
+        return previous is not None and await previous.exists(key)
+
+    async def get_collection(self, key: str) -> typing.Dict[str, str]:
+        collection = await self._node(key).get_collection(key)
+        if not collection and (previous := self._previous_node(key)):
+            collection = await previous.get_collection(key)
+        return collection
+
+    async def get_collections(
+        self,
+        keys: typing.List[str]
+    ) -> typing.List[typing.Dict[str, str]]:
+        groups = self._group(keys)
+        results = await asyncio.gather(*(
+            self.nodes[node].get_collections(group) for node, group in groups.items()))
+
+        found = {}
+        for group, collections in zip(groups.values(), results):
+            found.update(zip(group, collections))
+
+        previous = defaultdict(list)
+        for key in keys:
+            if not found[key] and self._previous_node(key):
+                previous[self.previous_ring.node(key)].append(key)
+
+        results = await asyncio.gather(*(
+            self._backends[node].get_collections(group)
+            for node, group in previous.items()))
+        for group, collections in zip(previous.values(), results):
+            found.update(zip(group, collections))
+
+        return [found[key] for key in keys]
+
+    async def get_item(self, key: str, item: str) -> str:
+        raw = await self._node(key).get_item(key, item)
+        if not raw and (previous := self._previous_node(key)):
+            raw = await previous.get_item(key, item)
+        return raw
+
+    async def set_item(self, key: str, item: str, value: str) -> None:
+        await self._move([key])
+        await self._node(key).set_item(key, item, value)
+
+    async def set_items(
+        self,
+        key: str,
+        items: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> None:
+        await self._move([key])
+        await self._node(key).set_items(key, items, until=until)
+
+    async def create_items(
+        self,
+        key: str,
+        items: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> bool:
+        previous = self._previous_node(key)
+        if previous and await previous.exists(key):
+            return False
+        return await self._node(key).create_items(key, items, until=until)
+
+    async def delete_items(self, key: str, items: typing.List[str]) -> None:
+        await self._move([key])
+        await self._node(key).delete_items(key, items)
+
+    async def publish(self, channel: str, message: str) -> None:
+        await self._pubsub.publish(channel, message)
+
+    def subscribe(self, channel: str) -> typing.AsyncIterator[str]:
+        return self._pubsub.subscribe(channel)
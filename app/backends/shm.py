@@ -0,0 +1,655 @@
+import asyncio
+import contextlib
+import errno
+import fcntl
+import fnmatch
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import time
+import typing
+import zlib
+from urllib.parse import urlparse, parse_qsl
+
+from pydantic import BaseModel, Field
+
+from app.constants import SESSION_MAX_AGE
+from app.store import Backend, ValueTooLarge
+
+
+MAGIC = b'SESSHM01'
+
+# Slot states
+EMPTY, USED, DELETED = 0, 1, 2
+# Kinds of values
+STRING, BYTES, COLLECTION = 0, 1, 2
+
+# magic, partitions, slots per partition, slot size, messages buffer size
+HEADER = struct.Struct('<8sIIII')
+# Total bytes ever written in the messages buffer
+HEAD = struct.Struct('<Q')
+HEAD_OFFSET = 32
+HEADER_SIZE = 64
+# Write sequence (odd while a write is in progress), used slots, deleted slots and
+# earliest expiry of the partition (0: none)
+PARTITION = struct.Struct('<QIId')
+# state, kind, key length, value length, expiry (0: none)
+SLOT = struct.Struct('<BBHId')
+# Length of a message
+RECORD = struct.Struct('<I')
+
+# Share of the slots used by the expected keys, probing gets longer beyond
+LOAD_FACTOR = 0.75
+
+# Lock-free read attempts while writes are in progress, before reading under the lock
+READ_ATTEMPTS = 100
+
+
+class ShmBackend(Backend):
+    """Shared memory backend: keys are visible to every process of the host using
+    the same file, e.g. the workers of the server.
+
+    Url: `shm://<name>?<options>` for a file in `/dev/shm` (or the temporary
+    directory), or `shm:///<path>`. The file is split in `partitions` hash tables of
+    fixed size slots (linear probing), each with its own lock (a `fcntl` lock of a
+    byte of the file) taken by writes. Reads take no lock: they are retried when a
+    write of the partition happened meanwhile (the partition write sequence changed).
+
+    Expired keys are not returned and their slots are reused, they are removed (and
+    partitions with many removed slots compacted) every `sweep_interval` seconds.
+    By default there are slots for the sessions created during the session max age
+    at `session_rate` sessions per second. When all the slots of a partition are
+    used, the key expiring first is evicted: evictions of unexpired keys are
+    counted (`evictions`) and logged.
+    A key and its value must fit in a slot (`slot_size` bytes minus a 16 bytes
+    header), larger values raise `ValueTooLarge`. The file is sparse: a slot only
+    uses the memory pages touched by its header and value (at least one page). The
+    file must fit in its filesystem (`RuntimeError` when connecting otherwise), a
+    process writing pages past a full filesystem would crash (SIGBUS): the defaults
+    (2 KiB slots, 0.2 sessions per second) make a file of about 47 MB, that fits in
+    the 64 MB `/dev/shm` of a container.
+
+    Pub/sub messages are written in a ring buffer of the file, subscribers poll it
+    every `poll_interval` seconds.
+
+    Every process must use the same options: a file created with other options is
+    reset when connecting, unless other processes use it (`RuntimeError`).
+    """
+
+    def __init__(self, url: str = 'shm://sessions'):
+        parsed_url = urlparse(url)
+        options = dict(parse_qsl(parsed_url.query))
+        self.options = ShmBackend.Options(**options)
+
+        directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+        # Absolute paths (`shm:///path`) are kept as they are by `join`
+        self.path = os.path.join(directory, parsed_url.netloc + parsed_url.path)
+
+        self.partitions = self.options.partitions
+        slots = self.options.slots or math.ceil(
+            self.options.session_rate * SESSION_MAX_AGE.total_seconds() / LOAD_FACTOR)
+        self.slots = max(1, math.ceil(slots / self.partitions))
+        self.slot_size = self.options.slot_size
+        self.messages_size = self.options.messages_size
+        self._messages_offset = HEADER_SIZE + self.partitions * PARTITION.size
+        self._slots_offset = self._messages_offset + self.messages_size
+        self.file_size = (
+            self._slots_offset + self.partitions * self.slots * self.slot_size)
+
+        self._fd: int | None = None
+        self._mmap: mmap.mmap | None = None
+        self._sweeper: asyncio.Task | None = None
+        # Unexpired keys evicted by this process
+        self.evictions = 0
+
+    async def connect(self) -> None:
+        stats = os.statvfs(os.path.dirname(self.path))
+        if self.file_size > stats.f_blocks * stats.f_frsize:
+            raise RuntimeError(
+                f'{self.path} would be {self.file_size} bytes, more than its '
+                f'filesystem size ({stats.f_blocks * stats.f_frsize} bytes): lower the '
+                'slots, session_rate or slot_size options')
+
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        header = HEADER.pack(
+            MAGIC, self.partitions, self.slots, self.slot_size, self.messages_size)
+
+        in_use = False
+        with self._lock(0):
+            if os.pread(self._fd, HEADER.size, 0) != header:
+                # Connected processes hold a shared lock of the whole file: the
+                # file is only reset when no other process maps it
+                try:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    in_use = True
+                else:
+                    if os.fstat(self._fd).st_size:
+                        logging.warning(f'{self.path} created with other options, reset')
+                    os.ftruncate(self._fd, 0)
+                    os.ftruncate(self._fd, self.file_size)
+                    os.pwrite(self._fd, header, 0)
+
+            if not in_use:
+                fcntl.flock(self._fd, fcntl.LOCK_SH)
+
+        if in_use:
+            os.close(self._fd)
+            self._fd = None
+            raise RuntimeError(
+                f'{self.path} is used by other processes with other options')
+
+        self._mmap = mmap.mmap(self._fd, self.file_size)
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def disconnect(self) -> None:
+        self._sweeper.cancel()
+        self._sweeper = None
+        self._mmap.close()
+        self._mmap = None
+        os.close(self._fd)
+        self._fd = None
+
+    def is_ready(self) -> bool:
+        return True
+
+    @property
+    def size(self) -> typing.Dict[str, int]:
+        """Number of used slots (including expired keys not removed yet) and of slots
+        """
+        entries = sum(
+            PARTITION.unpack_from(self._mmap, self._partition_offset(partition))[1]
+            for partition in range(self.partitions))
+        return {'entries': entries, 'slots': self.partitions * self.slots}
+
+    def _partition_offset(self, partition: int) -> int:
+        return HEADER_SIZE + partition * PARTITION.size
+
+    def _slot_offset(self, partition: int, index: int) -> int:
+        return self._slots_offset + (partition * self.slots + index) * self.slot_size
+
+    def _locate(self, key: bytes) -> typing.Tuple[int, int]:
+        """Partition of the key and first slot probed"""
+        # Stable between processes, unlike `hash`
+        hashed = zlib.crc32(key)
+        return hashed % self.partitions, (hashed // self.partitions) % self.slots
+
+    @contextlib.contextmanager
+    def _lock(self, offset: int, blocking: bool = True):
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        fcntl.lockf(self._fd, flags, 1, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    @contextlib.contextmanager
+    def _writing(self, partition: int, blocking: bool = True):
+        """Lock the partition and make its write sequence odd while writing"""
+        offset = self._partition_offset(partition)
+        with self._lock(offset, blocking):
+            # An odd sequence was left by a process that died while writing
+            sequence = struct.unpack_from('<Q', self._mmap, offset)[0] | 1
+            struct.pack_into('<Q', self._mmap, offset, sequence)
+            try:
+                yield
+            finally:
+                struct.pack_into('<Q', self._mmap, offset, sequence + 1)
+
+    def _consistent(self, partition: int, read: typing.Callable[[], typing.Any]):
+        """Result of `read()`, not mixed with a write of the partition"""
+        offset = self._partition_offset(partition)
+        for _ in range(READ_ATTEMPTS):
+            sequence = struct.unpack_from('<Q', self._mmap, offset)[0]
+            if sequence & 1:
+                continue
+            result = read()
+            if struct.unpack_from('<Q', self._mmap, offset)[0] == sequence:
+                return result
+
+        with self._writing(partition):
+            return read()
+
+    def _update_partition(
+        self,
+        partition: int,
+        *,
+        used: int = 0,
+        deleted: int = 0,
+        until: float | None = None
+    ) -> None:
+        offset = self._partition_offset(partition)
+        sequence, used_slots, deleted_slots, earliest = PARTITION.unpack_from(
+            self._mmap, offset)
+        if until:
+            earliest = min(earliest or math.inf, until)
+        PARTITION.pack_into(
+            self._mmap, offset, sequence, used_slots + used, deleted_slots + deleted,
+            earliest)
+
+    def _probe(
+        self,
+        partition: int,
+        start: int,
+        key: bytes
+    ) -> typing.Tuple[int | None, int | None]:
+        """Slot of the key (even expired) and first slot that can be reused"""
+        now = time.time()
+        free = None
+
+        for i in range(self.slots):
+            index = (start + i) % self.slots
+            offset = self._slot_offset(partition, index)
+            state, _, key_length, _, until = SLOT.unpack_from(self._mmap, offset)
+
+            if state == EMPTY:
+                return None, index if free is None else free
+            if state == USED and key_length == len(key) and \
+                    self._mmap[offset + SLOT.size:offset + SLOT.size + key_length] == key:
+                return index, free
+            if free is None and (state == DELETED or 0 < until <= now):
+                free = index
+
+        return None, free
+
+    def _entry(
+        self,
+        partition: int,
+        index: int | None
+    ) -> typing.Tuple[int, bytes, float] | None:
+        """Kind, value and expiry of the slot, None if empty or expired"""
+        if index is None:
+            return None
+
+        offset = self._slot_offset(partition, index)
+        state, kind, key_length, value_length, until = SLOT.unpack_from(
+            self._mmap, offset)
+        if state != USED or 0 < until <= time.time():
+            return None
+
+        start = offset + SLOT.size + key_length
+        # Lengths read during a write can be wrong, the read is retried anyway
+        end = min(start + value_length, offset + self.slot_size)
+        return kind, self._mmap[start:end], until
+
+    def _read(self, key: str) -> typing.Tuple[int, bytes, float] | None:
+        key = key.encode()
+        partition, start = self._locate(key)
+        return self._consistent(
+            partition,
+            lambda: self._entry(partition, self._probe(partition, start, key)[0]))
+
+    def _write(
+        self,
+        partition: int,
+        index: int | None,
+        free: int | None,
+        key: bytes,
+        kind: int,
+        value: bytes,
+        until: float | None
+    ) -> None:
+        if SLOT.size + len(key) + len(value) > self.slot_size:
+            raise ValueTooLarge(
+                f'{key.decode()} is too large for the shared memory slots '
+                f'({len(key) + len(value)} bytes, max {self.slot_size - SLOT.size})')
+
+        if index is None and free is None:
+            index = self._victim(partition)
+            expiry = SLOT.unpack_from(self._mmap, self._slot_offset(partition, index))[4]
+            if not 0 < expiry <= time.time():
+                self.evictions += 1
+        elif index is None:
+            index = free
+
+        offset = self._slot_offset(partition, index)
+        state = self._mmap[offset]
+        self._update_partition(
+            partition, used=int(state != USED), deleted=-int(state == DELETED),
+            until=until)
+
+        SLOT.pack_into(self._mmap, offset, USED, kind, len(key), len(value), until or 0)
+        start = offset + SLOT.size
+        self._mmap[start:start + len(key) + len(value)] = key + value
+
+    def _delete(self, partition: int, index: int) -> None:
+        self._mmap[self._slot_offset(partition, index)] = DELETED
+        self._update_partition(partition, used=-1, deleted=1)
+
+    def _victim(self, partition: int) -> int:
+        """Slot of the key expiring first (keys without expiry last)"""
+        return min(
+            range(self.slots),
+            key=lambda index:
+                SLOT.unpack_from(self._mmap, self._slot_offset(partition, index))[4]
+                or math.inf)
+
+    @contextlib.contextmanager
+    def _modifying(self, key: str):
+        """Lock the partition of the key, yields a function writing the key and its
+        current entry
+        """
+        key = key.encode()
+        partition, start = self._locate(key)
+
+        with self._writing(partition):
+            index, free = self._probe(partition, start, key)
+
+            def write(kind: int, value: bytes, until: float | None) -> None:
+                self._write(partition, index, free, key, kind, value, until)
+
+            yield write, self._entry(partition, index)
+
+    @staticmethod
+    def _encode(raw: str | bytes) -> typing.Tuple[int, bytes]:
+        if isinstance(raw, bytes):
+            return BYTES, raw
+        return STRING, raw.encode()
+
+    @staticmethod
+    def _decode(entry: typing.Tuple[int, bytes, float] | None) -> typing.Any:
+        if entry is None:
+            return None
+
+        kind, value, _ = entry
+        if kind == BYTES:
+            return value
+        if kind == COLLECTION:
+            return json.loads(value)
+        return value.decode()
+
+    async def _sweep(self) -> None:
+        evictions = self.evictions
+        while True:
+            await asyncio.sleep(self.options.sweep_interval)
+            if self.evictions > evictions:
+                logging.warning(
+                    f'{self.evictions - evictions} unexpired keys evicted from '
+                    f'{self.path}, its partitions are full: raise the slots or '
+                    'session_rate options')
+                evictions = self.evictions
+            for partition in range(self.partitions):
+                try:
+                    self._sweep_partition(partition)
+                except OSError as error:
+                    # Locked by another process (EAGAIN or EACCES, depending on the
+                    # system), swept next time
+                    if error.errno not in (errno.EAGAIN, errno.EACCES):
+                        logging.error(f'Sweep of {self.path} failed: {error!r}')
+                await asyncio.sleep(0)
+
+    def _sweep_partition(self, partition: int) -> None:
+        """Remove the expired keys and compact the partition when a quarter of its
+        slots are deleted
+        """
+        _, _, deleted, earliest = PARTITION.unpack_from(
+            self._mmap, self._partition_offset(partition))
+        now = time.time()
+        if not 0 < earliest <= now and deleted <= self.slots // 4:
+            return
+
+        with self._writing(partition, blocking=False):
+            earliest = math.inf
+            for index in range(self.slots):
+                state, _, _, _, until = SLOT.unpack_from(
+                    self._mmap, self._slot_offset(partition, index))
+                if state == USED and until:
+                    if until <= now:
+                        self._delete(partition, index)
+                    else:
+                        earliest = min(earliest, until)
+
+            offset = self._partition_offset(partition)
+            sequence, used, deleted, _ = PARTITION.unpack_from(self._mmap, offset)
+            earliest = 0 if earliest == math.inf else earliest
+            PARTITION.pack_into(self._mmap, offset, sequence, used, deleted, earliest)
+
+            if deleted > self.slots // 4:
+                self._compact(partition)
+
+    def _compact(self, partition: int) -> None:
+        """Rewrite the keys of the partition without the deleted slots, that make
+        the probing longer
+        """
+        entries = []
+        written = []
+        for index in range(self.slots):
+            offset = self._slot_offset(partition, index)
+            state, kind, key_length, value_length, until = SLOT.unpack_from(
+                self._mmap, offset)
+            if state != EMPTY:
+                written.append(index)
+            if state == USED:
+                start = offset + SLOT.size
+                key = self._mmap[start:start + key_length]
+                value = self._mmap[start + key_length:start + key_length + value_length]
+                entries.append((key, kind, value, until))
+
+        # Writing a slot allocates its first page: the slots never written are left
+        # as they are
+        for index in written:
+            self._mmap[self._slot_offset(partition, index)] = EMPTY
+        offset = self._partition_offset(partition)
+        sequence, _, _, earliest = PARTITION.unpack_from(self._mmap, offset)
+        PARTITION.pack_into(self._mmap, offset, sequence, 0, 0, earliest)
+
+        for key, kind, value, until in entries:
+            index, free = self._probe(partition, self._locate(key)[1], key)
+            self._write(partition, index, free, key, kind, value, until)
+
+    async def get(self, key: str) -> str:
+        return self._decode(self._read(key)) or ''
+
+    async def set(self, key: str, raw: str, *, until: int | None = None) -> None:
+        with self._modifying(key) as (write, _):
+            write(*self._encode(raw), until)
+
+    async def create(self, key: str, raw: str, *, until: int | None = None) -> bool:
+        with self._modifying(key) as (write, entry):
+            if entry is not None:
+                return False
+            write(*self._encode(raw), until)
+            return True
+
+    async def create_many(
+        self,
+        values: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> typing.List[bool]:
+        return [await self.create(key, raw, until=until) for key, raw in values.items()]
+
+    async def get_many(self, keys: typing.List[str]) -> typing.List[str]:
+        return [self._decode(self._read(key)) or '' for key in keys]
+
+    async def set_many(
+        self,
+        values: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> None:
+        for key, raw in values.items():
+            await self.set(key, raw, until=until)
+
+    async def expire_many(self, expiries: typing.Dict[str, int]) -> None:
+        for key, until in expiries.items():
+            with self._modifying(key) as (write, entry):
+                # Like EXPIREAT, missing keys are ignored
+                if entry is not None:
+                    write(*entry[:2], until)
+
+    def _partition_keys(self, partition: int) -> typing.List[str]:
+        keys = []
+        now = time.time()
+        for index in range(self.slots):
+            offset = self._slot_offset(partition, index)
+            state, _, key_length, _, until = SLOT.unpack_from(self._mmap, offset)
+            if state == USED and not 0 < until <= now:
+                start = offset + SLOT.size
+                keys.append(self._mmap[start:start + key_length])
+        return keys
+
+    async def keys(self, pattern: str = '*') -> typing.List[str]:
+        return [key async for key in self.iter_keys(pattern)]
+
+    async def iter_keys(
+        self,
+        pattern: str = '*',
+        *,
+        count: int = 100
+    ) -> typing.AsyncIterator[str]:
+        match = re.compile(fnmatch.translate(pattern)).match
+        scanned = 0
+
+        for partition in range(self.partitions):
+            keys = self._consistent(partition, lambda: self._partition_keys(partition))
+            for key in keys:
+                key = key.decode()
+                if match(key):
+                    yield key
+
+            scanned += self.slots
+            if scanned >= count:
+                scanned = 0
+                await asyncio.sleep(0)
+
+    async def exists(self, key: str) -> bool:
+        return self._read(key) is not None
+
+    async def get_collection(self, key: str) -> typing.Dict[str, str]:
+        entry = self._read(key)
+        return self._decode(entry) if entry and entry[0] == COLLECTION else {}
+
+    async def get_collections(
+        self,
+        keys: typing.List[str]
+    ) -> typing.List[typing.Dict[str, str]]:
+        return [await self.get_collection(key) for key in keys]
+
+    async def get_item(self, key: str, item: str) -> str:
+        return (await self.get_collection(key)).get(item, None)
+
+    def _write_collection(self, write, collection: dict, until: float | None) -> None:
+        write(COLLECTION, json.dumps(collection).encode(), until)
+
+    async def set_item(self, key: str, item: str, value: str) -> None:
+        await self.set_items(key, {item: value})
+
+    async def set_items(
+        self,
+        key: str,
+        items: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> None:
+        with self._modifying(key) as (write, entry):
+            collection = self._decode(entry) if entry and entry[0] == COLLECTION else {}
+            # Like HSET, changing items keeps the expiry of the collection
+            self._write_collection(
+                write, {**collection, **items}, until or (entry and entry[2]))
+
+    async def create_items(
+        self,
+        key: str,
+        items: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> bool:
+        with self._modifying(key) as (write, entry):
+            if entry is not None:
+                return False
+            self._write_collection(write, dict(items), until)
+            return True
+
+    async def delete_items(self, key: str, items: typing.List[str]) -> None:
+        encoded = key.encode()
+        partition, start = self._locate(encoded)
+
+        with self._writing(partition):
+            index, free = self._probe(partition, start, encoded)
+            entry = self._entry(partition, index)
+            if entry is None or entry[0] != COLLECTION:
+                return
+
+            collection = self._decode(entry)
+            for item in items:
+                collection.pop(item, None)
+
+            # Like redis, empty collections don't exist
+            if collection:
+                self._write(
+                    partition, index, free, encoded, COLLECTION,
+                    json.dumps(collection).encode(), entry[2])
+            else:
+                self._delete(partition, index)
+
+    def _head(self) -> int:
+        return HEAD.unpack_from(self._mmap, HEAD_OFFSET)[0]
+
+    def _ring_read(self, position: int, length: int) -> bytes:
+        start = position % self.messages_size
+        end = start + length
+        data = self._mmap[self._messages_offset + start:self._messages_offset + min(
+            end, self.messages_size)]
+        if end > self.messages_size:
+            data += self._mmap[
+                self._messages_offset:self._messages_offset + end - self.messages_size]
+        return data
+
+    def _ring_write(self, position: int, data: bytes) -> None:
+        start = position % self.messages_size
+        first = min(len(data), self.messages_size - start)
+        offset = self._messages_offset + start
+        self._mmap[offset:offset + first] = data[:first]
+        self._mmap[self._messages_offset:self._messages_offset + len(data) - first] = \
+            data[first:]
+
+    async def publish(self, channel: str, message: str) -> None:
+        record = f'{channel}\n{message}'.encode()
+        data = RECORD.pack(len(record)) + record
+        if len(data) > self.messages_size:
+            raise ValueError(
+                f'Message too large for the shared memory buffer ({len(data)} bytes)')
+
+        with self._lock(HEAD_OFFSET):
+            head = self._head()
+            self._ring_write(head, data)
+            HEAD.pack_into(self._mmap, HEAD_OFFSET, head + len(data))
+
+    async def subscribe(self, channel: str) -> typing.AsyncIterator[str]:
+        position = self._head()
+
+        while True:
+            await asyncio.sleep(self.options.poll_interval)
+            if self._mmap is None:
+                return
+
+            head = self._head()
+            while self._mmap is not None and position < head:
+                length = RECORD.unpack(self._ring_read(position, RECORD.size))[0]
+                record = self._ring_read(position + RECORD.size, length)
+
+                # Overwritten while reading (or before): skip the missed messages
+                if self._head() - position > self.messages_size:
+                    logging.warning(f'Messages of {channel} missed')
+                    position = head = self._head()
+                    break
+
+                position += RECORD.size + length
+                name, _, message = record.decode().partition('\n')
+                if name == channel:
+                    yield message
+
+    class Options(BaseModel):
+        slots: typing.Optional[int] = Field(None, ge=1)
+        session_rate: float = Field(0.2, gt=0)
+        partitions: int = Field(64, ge=1)
+        slot_size: int = Field(2048, gt=SLOT.size)
+        messages_size: int = Field(65536, gt=RECORD.size)
+        sweep_interval: float = 1
+        poll_interval: float = 0.05
@@ -0,0 +1,489 @@
+import asyncio
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qsl
+
+from pydantic import BaseModel, Field
+
+from app.store import Backend
+
+
+# Kinds of values
+STRING, BYTES, COLLECTION = 0, 1, 2
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS keys (
+    key TEXT PRIMARY KEY,
+    kind INTEGER NOT NULL,
+    value BLOB NOT NULL,
+    expires_at REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS keys_expires_at ON keys (expires_at)
+    WHERE expires_at IS NOT NULL;
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    message TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+'''
+
+# Constant statements, prepared once per connection (sqlite3 statements cache)
+LIVE = '(expires_at IS NULL OR expires_at > :now)'
+GET = f'SELECT kind, value, expires_at FROM keys WHERE key = :key AND {LIVE}'
+GET_MANY = f'''
+    SELECT key, kind, value FROM keys
+    WHERE key IN (SELECT value FROM json_each(:keys)) AND {LIVE}'''
+EXISTS = f'SELECT 1 FROM keys WHERE key = :key AND {LIVE}'
+KEYS = f'''
+    SELECT key FROM keys WHERE key > :after AND key GLOB :pattern AND {LIVE}
+    ORDER BY key LIMIT :count'''
+SET = '''
+    INSERT OR REPLACE INTO keys (key, kind, value, expires_at)
+    VALUES (:key, :kind, :value, :until)'''
+# Only replaces expired keys
+CREATE = f'''
+    INSERT INTO keys (key, kind, value, expires_at)
+    VALUES (:key, :kind, :value, :until)
+    ON CONFLICT (key) DO UPDATE SET
+        kind = excluded.kind, value = excluded.value, expires_at = excluded.expires_at
+    WHERE NOT {LIVE.replace('expires_at', 'keys.expires_at')}'''
+EXPIRE = f'UPDATE keys SET expires_at = :until WHERE key = :key AND {LIVE}'
+DELETE = 'DELETE FROM keys WHERE key = :key'
+SWEEP = '''
+    DELETE FROM keys WHERE key IN (
+        SELECT key FROM keys WHERE expires_at <= :now LIMIT :count)'''
+PUBLISH = '''
+    INSERT INTO messages (channel, message, created_at)
+    VALUES (:channel, :message, :now)'''
+MESSAGES = '''
+    SELECT id, message FROM messages WHERE id > :after AND channel = :channel
+    ORDER BY id'''
+LAST_MESSAGE = 'SELECT COALESCE(MAX(id), 0) FROM messages'
+SWEEP_MESSAGES = 'DELETE FROM messages WHERE created_at <= :before'
+
+
+def encode(raw: str | bytes) -> typing.Tuple[int, str | bytes]:
+    return (BYTES if isinstance(raw, bytes) else STRING), raw
+
+
+def decode(kind: int, value: str | bytes) -> typing.Any:
+    return json.loads(value) if kind == COLLECTION else value
+
+
+def _settle(future: asyncio.Future, result: typing.Any) -> None:
+    if future.done():
+        return
+    if isinstance(result, BaseException):
+        future.set_exception(result)
+    else:
+        future.set_result(result)
+
+
+class SqliteBackend(Backend):
+    """SQLite backend, durable without a server: `sqlite:///<path>` (or
+    `sqlite://<relative path>`).
+
+    The database uses WAL mode: reads don't wait for writes. Writes are queued to a
+    writer thread that runs every write queued meanwhile (up to `batch_size`) in a
+    single transaction (group commit), each in a savepoint so one failing write
+    doesn't fail the others. Reads run in a pool of `readers` threads, each with its
+    own connection. Statements are constant and prepared once per connection.
+
+    Expired keys are never returned, they are deleted every `sweep_interval`
+    seconds, `sweep_batch` keys per transaction (the expiry column is indexed).
+    Collections are stored as JSON objects.
+
+    Several processes can use the same database: pub/sub messages are stored in a
+    table that subscribers poll every `poll_interval` seconds.
+    """
+
+    def __init__(self, url: str):
+        parsed_url = urlparse(url)
+        options = dict(parse_qsl(parsed_url.query))
+        self.options = SqliteBackend.Options(**options)
+        self.path = parsed_url.netloc + parsed_url.path
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._writes: queue.SimpleQueue = queue.SimpleQueue()
+        self._writer: threading.Thread | None = None
+        self._readers: ThreadPoolExecutor | None = None
+        self._local = threading.local()
+        self._connections: typing.List[sqlite3.Connection] = []
+        self._sweeper: asyncio.Task | None = None
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        # Transactions are explicit (`isolation_level=None`), connections are closed
+        # by `disconnect` from another thread
+        connection = sqlite3.connect(
+            self.path, timeout=self.options.busy_timeout, isolation_level=None,
+            check_same_thread=False, cached_statements=64)
+        connection.execute(f'PRAGMA synchronous = {self.options.synchronous}')
+        return connection
+
+    async def connect(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._closed = False
+
+        connection = self._connect()
+        connection.execute('PRAGMA journal_mode = WAL')
+        connection.executescript(SCHEMA)
+
+        self._writer = threading.Thread(
+            target=self._write_loop, args=(connection,), name='sqlite-writer',
+            daemon=True)
+        self._writer.start()
+        self._readers = ThreadPoolExecutor(
+            self.options.readers, thread_name_prefix='sqlite-reader')
+        self._sweeper = asyncio.create_task(self._sweep())
+
+    async def disconnect(self) -> None:
+        self._closed = True
+        self._sweeper.cancel()
+        self._sweeper = None
+
+        self._writes.put(None)
+        await asyncio.to_thread(self._writer.join)
+        self._readers.shutdown()
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+        self._local = threading.local()
+
+    def is_ready(self) -> bool:
+        return self._writer is not None and self._writer.is_alive()
+
+    def _write_loop(self, connection: sqlite3.Connection) -> None:
+        while True:
+            writes = [self._writes.get()]
+            while len(writes) < self.options.batch_size:
+                try:
+                    writes.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            # `None` stops the writer, after the writes queued before
+            stop = None in writes
+            writes = [write for write in writes if write is not None]
+            if writes:
+                self._commit(connection, writes)
+            if stop:
+                connection.close()
+                return
+
+    def _commit(self, connection: sqlite3.Connection, writes: typing.List[tuple]) -> None:
+        """Run the writes in one transaction, then settle their futures"""
+        results = []
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            for func, args, _ in writes:
+                connection.execute('SAVEPOINT write')
+                try:
+                    results.append(func(connection, *args))
+                except Exception as error:
+                    connection.execute('ROLLBACK TO write')
+                    results.append(error)
+                connection.execute('RELEASE write')
+            connection.execute('COMMIT')
+        except sqlite3.Error as error:
+            logging.error(f'SQLite transaction failed: {error!r}')
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            results = [error] * len(writes)
+
+        for (_, _, future), result in zip(writes, results):
+            self._loop.call_soon_threadsafe(_settle, future, result)
+
+    def _write(self, func: typing.Callable, *args) -> asyncio.Future:
+        """Queue `func(connection, *args)` to the writer thread"""
+        future = self._loop.create_future()
+        self._writes.put((func, args, future))
+        return future
+
+    def _read(self, func: typing.Callable, *args) -> asyncio.Future:
+        """Run `func(connection, *args)` in a reader thread"""
+        return self._loop.run_in_executor(self._readers, self._reading, func, args)
+
+    def _reading(self, func: typing.Callable, args: tuple) -> typing.Any:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+            connection.execute('PRAGMA query_only = 1')
+            self._connections.append(connection)
+        return func(connection, *args)
+
+    async def _sweep(self) -> None:
+        while True:
+            await asyncio.sleep(self.options.sweep_interval)
+            try:
+                # A transaction per batch, other writes run in between
+                while await self._write(
+                        self._sweep_batch, time.time()) == self.options.sweep_batch:
+                    pass
+            except sqlite3.Error as error:
+                logging.warning(f'Expired keys not deleted: {error!r}')
+
+    def _sweep_batch(self, connection: sqlite3.Connection, now: float) -> int:
+        deleted = connection.execute(
+            SWEEP, {'now': now, 'count': self.options.sweep_batch}).rowcount
+        connection.execute(
+            SWEEP_MESSAGES, {'before': now - self.options.messages_ttl})
+        return deleted
+
+    @staticmethod
+    def _get(connection: sqlite3.Connection, key: str, now: float) -> tuple | None:
+        return connection.execute(GET, {'key': key, 'now': now}).fetchone()
+
+    async def get(self, key: str) -> str:
+        row = await self._read(self._get, key, time.time())
+        return decode(*row[:2]) if row else ''
+
+    @staticmethod
+    def _set_many(
+        connection: sqlite3.Connection,
+        values: typing.Dict[str, str | bytes],
+        until: float | None
+    ) -> None:
+        rows = []
+        for key, raw in values.items():
+            kind, value = encode(raw)
+            rows.append({'key': key, 'kind': kind, 'value': value, 'until': until})
+        connection.executemany(SET, rows)
+
+    async def set(self, key: str, raw: str, *, until: int | None = None) -> None:
+        await self._write(self._set_many, {key: raw}, until)
+
+    @staticmethod
+    def _create(
+        connection: sqlite3.Connection,
+        key: str,
+        kind: int,
+        value: str | bytes,
+        until: float | None
+    ) -> bool:
+        parameters = {
+            'key': key, 'kind': kind, 'value': value, 'until': until, 'now': time.time()}
+        return connection.execute(CREATE, parameters).rowcount == 1
+
+    async def create(self, key: str, raw: str, *, until: int | None = None) -> bool:
+        return await self._write(self._create, key, *encode(raw), until)
+
+    @classmethod
+    def _create_many(
+        cls,
+        connection: sqlite3.Connection,
+        values: typing.Dict[str, str | bytes],
+        until: float | None
+    ) -> typing.List[bool]:
+        return [
+            cls._create(connection, key, *encode(raw), until)
+            for key, raw in values.items()]
+
+    async def create_many(
+        self,
+        values: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> typing.List[bool]:
+        return await self._write(self._create_many, values, until)
+
+    @staticmethod
+    def _get_many(
+        connection: sqlite3.Connection,
+        keys: typing.List[str],
+        now: float
+    ) -> typing.Dict[str, typing.Any]:
+        rows = connection.execute(GET_MANY, {'keys': json.dumps(keys), 'now': now})
+        return {key: decode(kind, value) for key, kind, value in rows}
+
+    async def get_many(self, keys: typing.List[str]) -> typing.List[str]:
+        found = await self._read(self._get_many, keys, time.time())
+        return [found.get(key, '') for key in keys]
+
+    async def set_many(
+        self,
+        values: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> None:
+        await self._write(self._set_many, values, until)
+
+    @staticmethod
+    def _expire_many(
+        connection: sqlite3.Connection,
+        expiries: typing.Dict[str, int],
+        now: float
+    ) -> None:
+        # Like EXPIREAT, missing keys are ignored
+        connection.executemany(EXPIRE, [
+            {'key': key, 'until': until, 'now': now} for key, until in expiries.items()])
+
+    async def expire_many(self, expiries: typing.Dict[str, int]) -> None:
+        await self._write(self._expire_many, expiries, time.time())
+
+    async def keys(self, pattern: str = '*') -> typing.List[str]:
+        return [key async for key in self.iter_keys(pattern)]
+
+    @staticmethod
+    def _keys(
+        connection: sqlite3.Connection,
+        pattern: str,
+        after: str,
+        count: int,
+        now: float
+    ) -> typing.List[str]:
+        parameters = {'pattern': pattern, 'after': after, 'count': count, 'now': now}
+        return [key for key, in connection.execute(KEYS, parameters)]
+
+    async def iter_keys(
+        self,
+        pattern: str = '*',
+        *,
+        count: int = 100
+    ) -> typing.AsyncIterator[str]:
+        # Pages ordered by key: keys changed meanwhile are returned at most once
+        after = ''
+        while True:
+            keys = await self._read(self._keys, pattern, after, count, time.time())
+            for key in keys:
+                yield key
+            if len(keys) < count:
+                return
+            after = keys[-1]
+
+    @staticmethod
+    def _exists(connection: sqlite3.Connection, key: str, now: float) -> bool:
+        return connection.execute(EXISTS, {'key': key, 'now': now}).fetchone() is not None
+
+    async def exists(self, key: str) -> bool:
+        return await self._read(self._exists, key, time.time())
+
+    async def get_collection(self, key: str) -> typing.Dict[str, str]:
+        row = await self._read(self._get, key, time.time())
+        return json.loads(row[1]) if row and row[0] == COLLECTION else {}
+
+    async def get_collections(
+        self,
+        keys: typing.List[str]
+    ) -> typing.List[typing.Dict[str, str]]:
+        found = await self._read(self._get_many, keys, time.time())
+        return [
+            value if isinstance(value := found.get(key), dict) else {} for key in keys]
+
+    async def get_item(self, key: str, item: str) -> str:
+        return (await self.get_collection(key)).get(item, None)
+
+    @classmethod
+    def _set_items(
+        cls,
+        connection: sqlite3.Connection,
+        key: str,
+        items: typing.Dict[str, str],
+        until: float | None,
+        create: bool = False
+    ) -> bool:
+        row = cls._get(connection, key, time.time())
+        if create and row is not None:
+            return False
+
+        collection = json.loads(row[1]) if row and row[0] == COLLECTION else {}
+        # Like HSET, changing items keeps the expiry of the collection
+        connection.execute(SET, {
+            'key': key, 'kind': COLLECTION, 'value': json.dumps({**collection, **items}),
+            'until': until or (row and row[2])})
+        return True
+
+    async def set_item(self, key: str, item: str, value: str) -> None:
+        await self._write(self._set_items, key, {item: value}, None)
+
+    async def set_items(
+        self,
+        key: str,
+        items: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> None:
+        await self._write(self._set_items, key, items, until)
+
+    async def create_items(
+        self,
+        key: str,
+        items: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> bool:
+        return await self._write(self._set_items, key, items, until, True)
+
+    @classmethod
+    def _delete_items(
+        cls,
+        connection: sqlite3.Connection,
+        key: str,
+        items: typing.List[str]
+    ) -> None:
+        row = cls._get(connection, key, time.time())
+        if row is None or row[0] != COLLECTION:
+            return
+
+        collection = json.loads(row[1])
+        for item in items:
+            collection.pop(item, None)
+
+        # Like redis, empty collections don't exist
+        if collection:
+            connection.execute(SET, {
+                'key': key, 'kind': COLLECTION, 'value': json.dumps(collection),
+                'until': row[2]})
+        else:
+            connection.execute(DELETE, {'key': key})
+
+    async def delete_items(self, key: str, items: typing.List[str]) -> None:
+        await self._write(self._delete_items, key, items)
+
+    @staticmethod
+    def _publish(connection: sqlite3.Connection, channel: str, message: str) -> None:
+        connection.execute(
+            PUBLISH, {'channel': channel, 'message': message, 'now': time.time()})
+
+    async def publish(self, channel: str, message: str) -> None:
+        await self._write(self._publish, channel, message)
+
+    @staticmethod
+    def _messages(
+        connection: sqlite3.Connection,
+        channel: str,
+        after: int
+    ) -> typing.List[typing.Tuple[int, str]]:
+        parameters = {'channel': channel, 'after': after}
+        return connection.execute(MESSAGES, parameters).fetchall()
+
+    @staticmethod
+    def _last_message(connection: sqlite3.Connection) -> int:
+        return connection.execute(LAST_MESSAGE).fetchone()[0]
+
+    async def subscribe(self, channel: str) -> typing.AsyncIterator[str]:
+        after = await self._read(self._last_message)
+
+        while not self._closed:
+            await asyncio.sleep(self.options.poll_interval)
+            if self._closed:
+                return
+            for after, message in await self._read(self._messages, channel, after):
+                yield message
+
+    class Options(BaseModel):
+        readers: int = Field(4, ge=1)
+        batch_size: int = Field(100, ge=1)
+        synchronous: typing.Literal['OFF', 'NORMAL', 'FULL'] = 'NORMAL'
+        busy_timeout: float = 5
+        sweep_interval: float = 1
+        sweep_batch: int = Field(1000, ge=1)
+        poll_interval: float = 0.05
+        messages_ttl: float = 60
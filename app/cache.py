@@ -0,0 +1,109 @@
+import time
+import typing
+from collections import OrderedDict
+
+
+class LocalCache:
+    """Bounded in-process LRU cache where every entry has its own deadline.
+
+    Entries live at most `ttl` seconds, or until the wall-clock timestamp `until`
+    given when they are stored, whatever happens first. When the cache is full the
+    least recently used entry is evicted.
+
+    A value read from the backend before an invalidation of its key is stale: reads
+    take the `generation` before reading and pass it to `put`, which skips the value
+    when the key was invalidated since.
+
+        >>> cache = LocalCache(maxsize=2, ttl=60)
+        >>> cache.put('a', '1'); cache.put('b', '2'); cache.put('c', '3')
+        >>> cache.get('a') is None, cache.get('c')
+        (True, '3')
+        >>> cache.stats()
+        {'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 1}
+        >>> since = cache.generation; cache.invalidate('a')
+        >>> cache.put('a', '0', since=since); cache.get('a') is None
+        True
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: typing.OrderedDict[str, typing.Tuple[float, typing.Any]] = \
+            OrderedDict()
+        # Generation of the last invalidation of the most recently invalidated keys
+        # (at most `maxsize`). Keys forgotten count as invalidated at `_forgotten`
+        self.generation = 0
+        self._invalidated: typing.OrderedDict[str, int] = OrderedDict()
+        self._forgotten = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str) -> typing.Any:
+        """Get the value or `None` when the key is not cached (or expired)
+        """
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            deadline, value = entry
+            if deadline > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+            del self._entries[key]
+
+        self.misses += 1
+        return None
+
+    def put(
+        self,
+        key: str,
+        value: typing.Any,
+        *,
+        until: float | None = None,
+        since: int | None = None
+    ) -> None:
+        if since is not None and self._invalidated.get(key, self._forgotten) > since:
+            return
+
+        now = time.monotonic()
+        deadline = now + self.ttl
+
+        if until is not None:
+            # `until` is a unix timestamp, the deadline uses the monotonic clock
+            deadline = min(deadline, now + until - time.time())
+            if deadline <= now:
+                return
+
+        self._entries[key] = (deadline, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+        self.generation += 1
+        self._invalidated[key] = self.generation
+        self._invalidated.move_to_end(key)
+        while len(self._invalidated) > self.maxsize:
+            _, self._forgotten = self._invalidated.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+        self.generation += 1
+        self._invalidated.clear()
+        self._forgotten = self.generation
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,331 @@
+import importlib.util
+import typing
+import zlib
+
+from app.util import safe_dict_json_loads, safe_dict_json_dumps
+
+
+# The optional libraries (orjson, msgpack, lz4) are imported by the codecs and
+# compressions using them, when created: only the configured ones are loaded
+def installed(module: str) -> bool:
+    """Whether a module can be imported, without importing it"""
+    return importlib.util.find_spec(module) is not None
+
+
+# Stored values are either JSON text (always starts with `{`) or bytes tagged with a
+# leading marker byte. Marker bytes are control characters, which never start a
+# JSON document, so values written with different codecs can be read side by side.
+MSGPACK_MARKER = b'\x01'
+# Compressed values: marker byte followed by the compressed value, as written by
+# the codec
+ZLIB_MARKER = b'\x02'
+LZ4_MARKER = b'\x03'
+
+
+class Codec:
+    """Strategy to serialize dicts before storing them
+
+    `loads` and `dumps` follow `safe_dict_json_loads` and `safe_dict_json_dumps`:
+    they never raise, invalid data becomes an empty dict.
+    """
+
+    name: str
+    # Empty for codecs that write JSON text
+    marker: bytes = b''
+
+    def dumps(self, data: typing.Dict[str, typing.Any]) -> str | bytes:
+        raise NotImplementedError()
+
+    def loads(self, raw: str | bytes) -> typing.Dict[str, typing.Any]:
+        raise NotImplementedError()
+
+
+class JsonCodec(Codec):
+    """Standard library json
+
+        >>> JsonCodec().dumps({'x': 1})
+        '{"x": 1}'
+    """
+
+    name = 'json'
+
+    def dumps(self, data):
+        return safe_dict_json_dumps(data)
+
+    def loads(self, raw):
+        return safe_dict_json_loads(raw)
+
+
+class OrjsonCodec(Codec):
+    """orjson, a faster JSON implementation. Its output is plain JSON text, readable
+    by `JsonCodec` too
+
+        >>> OrjsonCodec().dumps({'x': 1})
+        '{"x":1}'
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def dumps(self, data):
+        if isinstance(data, dict):
+            try:
+                return self._orjson.dumps(data).decode()
+            except Exception:
+                pass
+
+        return '{}'
+
+    def loads(self, raw):
+        if raw:
+            try:
+                data = self._orjson.loads(raw)
+                if isinstance(data, dict):
+                    return data
+            except Exception:
+                pass
+
+        return {}
+
+
+class MsgpackCodec(Codec):
+    """MessagePack, a compact binary format
+
+        >>> MsgpackCodec().dumps({'x': 1})
+        b'\\x01\\x81\\xa1x\\x01'
+    """
+
+    name = 'msgpack'
+    marker = MSGPACK_MARKER
+
+    def __init__(self):
+        import msgpack
+        self._msgpack = msgpack
+
+    def dumps(self, data):
+        if isinstance(data, dict):
+            try:
+                return self.marker + self._msgpack.packb(data)
+            except Exception:
+                pass
+
+        return self.marker + self._msgpack.packb({})
+
+    def loads(self, raw):
+        if raw:
+            try:
+                if isinstance(raw, str):
+                    raw = raw.encode()
+                data = self._msgpack.unpackb(raw[len(self.marker):])
+                if isinstance(data, dict):
+                    return data
+            except Exception:
+                pass
+
+        return {}
+
+
+CODECS: typing.Dict[str, typing.Callable[[], Codec]] = {
+    'json': JsonCodec,
+    'orjson': OrjsonCodec,
+    'msgpack': MsgpackCodec,
+}
+
+AVAILABLE = {
+    'json': True,
+    'orjson': installed('orjson'),
+    'msgpack': installed('msgpack'),
+}
+
+
+def get_codec(name: str) -> Codec:
+    """Get a codec by name
+
+        >>> get_codec('json').name
+        'json'
+    """
+    if name not in CODECS:
+        raise NameError(f'{name} codec not supported')
+
+    try:
+        return CODECS[name]()
+    except ImportError:
+        raise NameError(f'{name} codec not available, install {name}')
+
+
+class Compression:
+    """Strategy to compress stored values, tagged with a leading marker byte
+
+    `level` is specific to each algorithm, `None` uses its default.
+    """
+
+    name: str
+    marker: bytes
+
+    def __init__(self, level: int | None = None):
+        self.level = level
+
+    def compress(self, raw: str | bytes) -> bytes:
+        if isinstance(raw, str):
+            raw = raw.encode()
+        return self.marker + self._compress(raw)
+
+    def decompress(self, raw: bytes) -> bytes:
+        return self._decompress(raw[len(self.marker):])
+
+    def _compress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+    def _decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+
+class ZlibCompression(Compression):
+    """zlib (standard library), level 1 (fastest) to 9 (smallest)
+
+        >>> compression = ZlibCompression()
+        >>> compression.decompress(compression.compress('{"x": 1}'))
+        b'{"x": 1}'
+    """
+
+    name = 'zlib'
+    marker = ZLIB_MARKER
+
+    def _compress(self, data):
+        level = zlib.Z_DEFAULT_COMPRESSION if self.level is None else self.level
+        return zlib.compress(data, level)
+
+    def _decompress(self, data):
+        return zlib.decompress(data)
+
+
+class Lz4Compression(Compression):
+    """LZ4, much faster than zlib with a lower ratio. A level (1 to 16) enables its
+    high compression mode
+    """
+
+    name = 'lz4'
+    marker = LZ4_MARKER
+
+    def __init__(self, level: int | None = None):
+        super().__init__(level)
+        import lz4.block
+        self._block = lz4.block
+
+    def _compress(self, data):
+        if self.level:
+            return self._block.compress(
+                data, mode='high_compression', compression=self.level)
+        return self._block.compress(data)
+
+    def _decompress(self, data):
+        return self._block.decompress(data)
+
+
+COMPRESSIONS: typing.Dict[str, typing.Callable[..., Compression]] = {
+    'zlib': ZlibCompression,
+    'lz4': Lz4Compression,
+}
+
+AVAILABLE_COMPRESSIONS = {
+    'zlib': True,
+    'lz4': installed('lz4'),
+}
+
+
+def get_compression(name: str, level: int | None = None) -> Compression:
+    """Get a compression algorithm by name
+
+        >>> get_compression('zlib', 1).level
+        1
+    """
+    if name not in COMPRESSIONS:
+        raise NameError(f'{name} compression not supported')
+
+    try:
+        return COMPRESSIONS[name](level)
+    except ImportError:
+        raise NameError(f'{name} compression not available, install {name}')
+
+
+class Compressor:
+    """Compresses the values of at least `threshold` bytes, smaller values are
+    returned untouched
+
+        >>> compressor = Compressor(get_compression('zlib'), threshold=100)
+        >>> compressor.compress('{"x": 1}')
+        '{"x": 1}'
+        >>> compressor.compress('{"x": "%s"}' % ('a' * 100))[:1]
+        b'\\x02'
+    """
+
+    def __init__(self, compression: Compression, threshold: int):
+        self.compression = compression
+        self.threshold = threshold
+
+    def compress(self, raw: str | bytes) -> str | bytes:
+        if len(raw) < self.threshold:
+            return raw
+        return self.compression.compress(raw)
+
+
+class Decoder:
+    """Reads values written by any codec, detecting the format from the marker byte.
+    Compressed values are decompressed first.
+
+    Untagged values are JSON text and are read with `default` when it writes JSON
+    too, so a faster JSON codec also speeds up reads. The codecs and compressions of
+    the other markers are created when a value uses them.
+
+        >>> decoder = Decoder(get_codec('json'))
+        >>> decoder.loads('{"x": 1}')
+        {'x': 1}
+        >>> decoder.loads(MsgpackCodec().dumps({'x': 1}))
+        {'x': 1}
+    """
+
+    def __init__(self, default: Codec):
+        self.json = default if not default.marker else JsonCodec()
+        self.tagged = {
+            codec.marker[0]: codec
+            for name, codec in CODECS.items() if codec.marker and AVAILABLE[name]
+        }
+        self.compressed = {
+            compression.marker[0]: compression
+            for name, compression in COMPRESSIONS.items()
+            if AVAILABLE_COMPRESSIONS[name]
+        }
+        self._instances: typing.Dict[int, Codec | Compression] = {
+            default.marker[0]: default} if default.marker else {}
+
+    def _instance(self, marker: int) -> Codec | Compression:
+        if marker not in self._instances:
+            factory = self.tagged.get(marker) or self.compressed[marker]
+            self._instances[marker] = factory()
+        return self._instances[marker]
+
+    def decompress(self, raw: str | bytes) -> str | bytes:
+        """The value as written by its codec. Values that can't be decompressed are
+        empty
+        """
+        if raw and isinstance(raw, bytes) and raw[0] in self.compressed:
+            try:
+                return self._instance(raw[0]).decompress(raw)
+            except Exception:
+                return b''
+
+        return raw
+
+    def loads(self, raw: str | bytes) -> typing.Dict[str, typing.Any]:
+        raw = self.decompress(raw)
+        if raw and isinstance(raw, bytes) and raw[0] in self.tagged:
+            try:
+                codec = self._instance(raw[0])
+            except ImportError:
+                return {}
+            return codec.loads(raw)
+
+        return self.json.loads(raw)
@@ -4,6 +4,21 @@ from datetime import timedelta
 
 # Store key namespace
 STORE_KEY = 'session.id.{session_id}'
+# Prefix of the binary session keys (followed by the 16 bytes of the UUID), see the
+# store key encodings. 0xff is never valid UTF-8: binary keys can't be confused with
+# text keys
+STORE_KEY_BINARY_PREFIX = b'\xffs'
+
+# Collection items of a session stored with the `hash` layout: the session without
+# its data, and one item per data field
+SESSION_ITEM = 'session'
+SESSION_DATA_ITEM = 'data.{field}'
 
 # Session max age
 SESSION_MAX_AGE = timedelta(hours=24)
+
+# Max number of sessions handled by a batch request
+BATCH_MAX_SIZE = 100
+
+# Number of keys read on each store call when scanning the whole keyspace
+SCAN_BATCH_SIZE = 500
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import time
+import typing
+
+from app.constants import SESSION_MAX_AGE
+from app.settings import settings
+from app.store import store
+
+
+class SlidingExpiration:
+    """Extends the expiry of keys when they are read, in batches.
+
+    `touch` returns the new expiry of a key (`max_age` seconds from now) and queues
+    it, `flush` sends the queued expiries in a single store call. A key is refreshed
+    at most once per `interval`: touching it again meanwhile returns the expiry
+    already queued, so frequent reads don't add writes.
+    """
+
+    def __init__(self, store, *, max_age: float, interval: float):
+        self.store = store
+        self.max_age = max_age
+        self.interval = interval
+        self._pending: typing.Dict[str, int] = {}
+        # Last refresh of each key: (time, expiry)
+        self._refreshed: typing.Dict[str, typing.Tuple[float, int]] = {}
+
+    def touch(self, key: str) -> int:
+        now = time.time()
+        refreshed = self._refreshed.get(key)
+        if refreshed is not None and now - refreshed[0] < self.interval:
+            return refreshed[1]
+
+        until = int(now + self.max_age)
+        self._refreshed[key] = (now, until)
+        self._pending[key] = until
+        return until
+
+    async def flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        if pending:
+            try:
+                await self.store.expire_many(pending)
+            except BaseException:
+                # Sent again with the next flush (with the later expiry of the keys
+                # touched meanwhile)
+                for key, until in pending.items():
+                    self._pending[key] = max(until, self._pending.get(key, until))
+                raise
+
+        # Keys not refreshed during the last interval can be refreshed again
+        limit = time.time() - self.interval
+        self._refreshed = {
+            key: refreshed for key, refreshed in self._refreshed.items()
+            if refreshed[0] > limit
+        }
+
+    async def run(self) -> None:
+        """Flush every `interval` seconds, until cancelled (flushing one last time)
+        """
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.flush()
+                except Exception as error:
+                    logging.warning(
+                        f'Session expiries not refreshed, retried: {error!r}')
+        finally:
+            await self.flush()
+
+
+sliding_expiration = SlidingExpiration(
+    store,
+    max_age=SESSION_MAX_AGE.total_seconds(),
+    interval=settings.app.expiry_refresh_interval)
@@ -0,0 +1,38 @@
+from app.constants import STORE_KEY
+
+
+SESSION_PREFIX = STORE_KEY.format(session_id='')
+SESSION_KEY_LENGTH = len(SESSION_PREFIX) + 36
+
+
+def session_uuid(key: str) -> bytes | None:
+    """16 bytes of the UUID of a session key, `None` for other keys. Only the
+    canonical form of the UUID (lowercase, with dashes) is recognized, so that
+    `session_key` gives back the same key
+
+        >>> session_uuid('session.id.8c1d6b3e-5b7e-4e0b-9a57-2a1c5b7c9e01')
+        b'\\x8c\\x1dk>[~N\\x0b\\x9aW*\\x1c[|\\x9e\\x01'
+        >>> session_uuid('session.id.8C1D6B3E-5B7E-4E0B-9A57-2A1C5B7C9E01') is None
+        True
+        >>> session_key(session_uuid('session.id.8c1d6b3e-5b7e-4e0b-9a57-2a1c5b7c9e01'))
+        'session.id.8c1d6b3e-5b7e-4e0b-9a57-2a1c5b7c9e01'
+    """
+    if len(key) == SESSION_KEY_LENGTH and key.startswith(SESSION_PREFIX) and (
+        key[-28] == key[-23] == key[-18] == key[-13] == '-'
+    ):
+        digits = key[-36:].replace('-', '')
+        if digits.islower() or digits.isdigit():
+            try:
+                raw = bytes.fromhex(digits)
+            except ValueError:
+                return None
+            if len(raw) == 16:
+                return raw
+    return None
+
+
+def session_key(uuid: bytes) -> str:
+    digits = uuid.hex()
+    return (
+        f'{SESSION_PREFIX}{digits[:8]}-{digits[8:12]}-{digits[12:16]}-'
+        f'{digits[16:20]}-{digits[20:]}')
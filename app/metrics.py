@@ -0,0 +1,356 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+import typing
+from collections import defaultdict
+
+
+# Default histogram buckets (seconds)
+HTTP_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+STORE_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .5, 1)
+
+
+class Metric:
+    """Base metric. Values are kept per label values tuple.
+
+    Recording is a plain dict update: everything runs in the event loop thread, so
+    no locks are needed. Counters and gauges can also be computed by `collect` when
+    the metrics are read.
+    """
+
+    type: str
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: typing.Sequence[str] = (),
+        *,
+        collect: typing.Callable[[], typing.Dict[tuple, float]] | None = None
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: typing.Dict[tuple, typing.Any] = defaultdict(float)
+        self._collect = collect
+
+    def samples(self) -> typing.Dict[tuple, typing.Any]:
+        if self._collect is not None:
+            return self._collect()
+        return dict(self._values)
+
+    def describe(self) -> typing.Dict[str, typing.Any]:
+        return {'type': self.type, 'help': self.help, 'labels': self.labelnames}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] += amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] += amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] -= amount
+
+
+class Histogram(Metric):
+    """Histogram. Per label values, keeps the (non cumulative) count of each bucket,
+    the count of values above the last bucket and the sum of all values.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, *args, buckets: typing.Sequence[float] = HTTP_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        self._values = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts = self._values.get(labels)
+        if counts is None:
+            counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        return {labels: list(counts) for labels, counts in self._values.items()}
+
+    def describe(self):
+        return {**super().describe(), 'buckets': self.buckets}
+
+
+class Registry:
+    """Collection of metrics rendered in Prometheus text format.
+
+    When several worker processes serve the app, each one writes a snapshot of its
+    metrics to `directory` and reading the metrics merges all of them: counters and
+    histograms are summed (including exited workers, so they never go backwards),
+    gauges are summed over running workers only.
+    """
+
+    def __init__(self):
+        self._metrics: typing.Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> typing.Dict[str, typing.Any]:
+        return {
+            name: {
+                **metric.describe(),
+                'samples': [[list(k), v] for k, v in metric.samples().items()]
+            }
+            for name, metric in self._metrics.items()
+        }
+
+    def write(self, directory: str) -> None:
+        """Write the snapshot of this process (atomically)
+        """
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def read(self, directory: str | None = None) -> typing.List[typing.Dict]:
+        """Snapshots of this process and, when `directory` is set, of the others
+        """
+        snapshots = [self.snapshot()]
+        if directory is None:
+            return snapshots
+
+        for filename in os.listdir(directory):
+            pid, ext = os.path.splitext(filename)
+            if ext != '.json' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+
+            try:
+                with open(os.path.join(directory, filename)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            if not is_alive(int(pid)):
+                snapshot = {
+                    name: metric for name, metric in snapshot.items()
+                    if metric['type'] != 'gauge'
+                }
+            snapshots.append(snapshot)
+
+        return snapshots
+
+    def render(self, directory: str | None = None) -> str:
+        return render(merge(self.read(directory)))
+
+
+def is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def merge(snapshots: typing.List[typing.Dict]) -> typing.Dict[str, typing.Dict]:
+    merged = {}
+
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, 'samples': {}})
+            samples = target['samples']
+
+            for labels, value in metric['samples']:
+                labels = tuple(labels)
+                if labels not in samples:
+                    samples[labels] = value
+                elif metric['type'] == 'histogram':
+                    samples[labels] = [a + b for a, b in zip(samples[labels], value)]
+                else:
+                    samples[labels] += value
+
+    return merged
+
+
+def format_labels(names: typing.Sequence[str], values: typing.Sequence[str]) -> str:
+    """Prometheus label set
+
+        >>> format_labels(['method', 'path'], ['GET', '/"x"'])
+        '{method="GET",path="/\\\\"x\\\\""}'
+        >>> format_labels([], [])
+        ''
+    """
+    if not names:
+        return ''
+
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}'
+
+
+def render(metrics: typing.Dict[str, typing.Dict]) -> str:
+    lines = []
+
+    for name, metric in metrics.items():
+        lines.append(f'# HELP {name} {metric["help"]}')
+        lines.append(f'# TYPE {name} {metric["type"]}')
+        labelnames = metric['labels']
+
+        for labels, value in metric['samples'].items():
+            if metric['type'] != 'histogram':
+                lines.append(f'{name}{format_labels(labelnames, labels)} {value}')
+                continue
+
+            cumulative = 0
+            bounds = [*metric['buckets'], '+Inf']
+            for bound, count in zip(bounds, value):
+                cumulative += count
+                bucket_labels = format_labels([*labelnames, 'le'], [*labels, bound])
+                lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+
+            lines.append(f'{name}_sum{format_labels(labelnames, labels)} {value[-1]}')
+            lines.append(f'{name}_count{format_labels(labelnames, labels)} {cumulative}')
+
+    return '\n'.join(lines) + '\n'
+
+
+async def write_periodically(directory: str, interval: float) -> None:
+    """Keep the snapshot of this process up to date for the other workers
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    while True:
+        try:
+            registry.write(directory)
+        except OSError as error:
+            logging.warning('Metrics snapshot not written: %s', error)
+        await asyncio.sleep(interval)
+
+
+# App metrics
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'http_requests_total', 'HTTP requests', ['method', 'route', 'status']))
+http_request_duration = registry.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ['method', 'route']))
+http_requests_in_flight = registry.register(Gauge(
+    'http_requests_in_flight', 'HTTP requests being processed'))
+store_operation_duration = registry.register(Histogram(
+    'store_operation_duration_seconds', 'Store backend operation latency',
+    ['operation'], buckets=STORE_BUCKETS))
+store_operation_errors = registry.register(Counter(
+    'store_operation_errors_total', 'Store backend operations that failed',
+    ['operation']))
+
+
+def instrument_backend(backend) -> None:
+    """Record the latency and errors of every coroutine method of a store backend
+    """
+    if getattr(backend, '_instrumented', False):
+        return
+
+    def timed(name, method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            except Exception:
+                store_operation_errors.inc(name)
+                raise
+            finally:
+                store_operation_duration.observe(time.perf_counter() - start, name)
+
+        return wrapper
+
+    methods = inspect.getmembers(type(backend), inspect.iscoroutinefunction)
+    for name, _ in methods:
+        if not name.startswith('_') and name not in ('connect', 'disconnect'):
+            setattr(backend, name, timed(name, getattr(backend, name)))
+
+    backend._instrumented = True
+
+
+def register_store_metrics(store) -> None:
+    """Gauges read from the store when the metrics are collected: redis pool usage,
+    memory store usage, local cache and coalesced reads counters
+    """
+
+    def pool(attribute):
+        def collect():
+            # aioredis client of the redis backend, wrapping its connections pool
+            client = getattr(store.backend, '_connection', None)
+            pool = getattr(client, 'connection', None)
+            if not hasattr(pool, attribute):
+                return {}
+            return {(): getattr(pool, attribute)}
+        return collect
+
+    def cache(counter):
+        def collect():
+            if store.cache is None:
+                return {}
+            return {(): store.cache.stats()[counter]}
+        return collect
+
+    registry.register(Gauge(
+        'redis_pool_size', 'Open redis connections', collect=pool('size')))
+    registry.register(Gauge(
+        'redis_pool_free', 'Idle redis connections', collect=pool('freesize')))
+    registry.register(Gauge(
+        'redis_pool_maxsize', 'Max redis connections', collect=pool('maxsize')))
+    registry.register(Counter(
+        'store_cache_hits_total', 'Local store cache hits', collect=cache('hits')))
+    registry.register(Counter(
+        'store_cache_misses_total', 'Local store cache misses',
+        collect=cache('misses')))
+
+    def memory(field):
+        def collect():
+            # Memory backend only
+            memory = getattr(store.backend, 'memory', None)
+            if memory is None:
+                return {}
+            return {(): memory()[field]}
+        return collect
+
+    registry.register(Gauge(
+        'store_memory_entries', 'Keys of the memory store',
+        collect=memory('entries')))
+    registry.register(Gauge(
+        'store_memory_bytes', 'Bytes of the keys and values of the memory store',
+        collect=memory('bytes')))
+    registry.register(Gauge(
+        'store_memory_overhead_bytes',
+        'Other bytes used by the memory store (objects, containers, expiries)',
+        collect=memory('overhead')))
+    registry.register(Counter(
+        'store_coalesced_total', 'Store reads served by an identical read in flight',
+        collect=lambda: {(): store.coalesced}))
+    registry.register(Counter(
+        'store_evictions_total',
+        'Unexpired keys evicted by the shared memory store, its slots are too few',
+        collect=lambda: (
+            {(): store.backend.evictions} if hasattr(store.backend, 'evictions')
+            else {})))
@@ -1,33 +1,104 @@
 import logging
 import time
 
-from starlette.requests import Request
-from starlette.responses import Response
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from starlette.middleware.cors import CORSMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from app import metrics
 
-class RequestLoggingMiddleware(BaseHTTPMiddleware):
+
+class RequestLoggingMiddleware:
     """Middleware that logs request details and elapsed time
+
+    Pure ASGI middleware (no extra task or stream per request). With `sample_rate`
+    N > 1 only one in N requests is logged, but server errors and requests slower
+    than `slow_ms` are always logged, as warnings.
     """
 
-    async def dispatch(
+    def __init__(
         self,
-        request: Request,
-        call_next: RequestResponseEndpoint
-    ) -> Response:
-        start_time = time.time()
-        url = request.url.path
-        if request.url.query:
-            url = f'{url}?{request.url.query}'
+        app: ASGIApp,
+        *,
+        sample_rate: int = 1,
+        slow_ms: float | None = None
+    ) -> None:
+        self.app = app
+        self.sample_rate = max(sample_rate, 1)
+        self.slow_ms = slow_ms
+        self._requests = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or not logging.root.isEnabledFor(logging.WARNING):
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = (time.perf_counter() - start_time) * 1000
+            self._requests += 1
+
+            if status_code >= 500 or (self.slow_ms and elapsed >= self.slow_ms):
+                level = logging.WARNING
+            elif self._requests % self.sample_rate == 0:
+                level = logging.INFO
+            else:
+                level = None
+
+            if level is not None and logging.root.isEnabledFor(level):
+                url = scope['path']
+                if scope['query_string']:
+                    url = f'{url}?{scope["query_string"].decode("latin-1")}'
+
+                logging.log(
+                    level, '%s %s %d (elapsed %dms)',
+                    scope['method'], url, status_code, round(elapsed))
+
+
+class MetricsMiddleware:
+    """Middleware that records request counts, latencies and in-flight requests
+
+    Requests are labelled with the route template (`/sessions/{id}`), not the raw
+    path, so the number of series stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
 
-        response = await call_next(request)
+        start_time = time.perf_counter()
+        status_code = 500
 
-        elapsed = round(round(time.time() - start_time, 4) * 1000)
-        logging.info(
-            f'{request.method} {url} {response.status_code} (elapsed {elapsed}ms)')
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
 
-        return response
+        metrics.http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics.http_requests_in_flight.dec()
+            # Set by the router on the (shared) scope when a route matches
+            route = scope.get('route')
+            route = getattr(route, 'path', None) or '<unmatched>'
+            metrics.http_requests.inc(scope['method'], route, str(status_code))
+            metrics.http_request_duration.observe(
+                time.perf_counter() - start_time, scope['method'], route)
 
 
 class CORSAllowAnyMiddleware(CORSMiddleware):
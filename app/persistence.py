@@ -0,0 +1,329 @@
+import asyncio
+import fcntl
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Operations logged
+SET, DELETE, SET_ITEMS, EXPIRE = 0, 1, 2, 3
+# Kinds of values
+STRING, BYTES, COLLECTION = 0, 1, 2
+
+# operation, kind of value, expiry (0: none), key length, value length
+RECORD = struct.Struct('<BBdII')
+# magic, number of the first log not included in the snapshot
+SNAPSHOT_HEADER = struct.Struct('<8sQ')
+SNAPSHOT_MAGIC = b'SESSNAP1'
+# Keys written to the snapshot between two event loop iterations
+SNAPSHOT_CHUNK = 1000
+
+LOG_NAME = re.compile(r'^log\.(\d+)$')
+
+Record = typing.Tuple[int, str, typing.Any, float | None]
+# Name, value and expiry of a key
+Entry = typing.Tuple[str, typing.Any, float | None]
+
+
+def encode(
+    operation: int,
+    key: str,
+    value: typing.Any = None,
+    until: float | None = None
+) -> bytes:
+    """
+        >>> raw = encode(SET, 'key', {'a': '1'}, 10)
+        >>> decode(raw, 0) == ((SET, 'key', {'a': '1'}, 10), len(raw))
+        True
+        >>> decode(raw[:-1], 0) is None
+        True
+    """
+    if isinstance(value, bytes):
+        kind, raw = BYTES, value
+    elif isinstance(value, dict):
+        kind, raw = COLLECTION, json.dumps(value).encode()
+    else:
+        kind, raw = STRING, (value or '').encode()
+
+    key = key.encode()
+    return RECORD.pack(operation, kind, until or 0, len(key), len(raw)) + key + raw
+
+
+def decode(buffer, offset: int) -> typing.Tuple[Record, int] | None:
+    """Record at `offset` and the offset of the next one, `None` at the end of the
+    buffer or when the record is incomplete
+    """
+    if offset + RECORD.size > len(buffer):
+        return None
+
+    operation, kind, until, key_length, value_length = RECORD.unpack_from(
+        buffer, offset)
+    start = offset + RECORD.size
+    end = start + key_length + value_length
+    if end > len(buffer):
+        return None
+
+    key = buffer[start:start + key_length].decode()
+    raw = buffer[start + key_length:end]
+    if kind == STRING:
+        value = raw.decode()
+    elif kind == COLLECTION:
+        value = json.loads(raw)
+    else:
+        value = raw
+
+    return (operation, key, value, until or None), end
+
+
+def replay(
+    records: typing.Iterable[Record]
+) -> typing.Dict[str, typing.Tuple[typing.Any, float | None]]:
+    """Value and expiry of each key once all the records are applied. Expired keys
+    are kept (the caller drops them): a later EXPIRE record can extend the expiry
+
+        >>> replay([(SET, 'a', 'x', 1), (EXPIRE, 'a', None, 2), (SET, 'b', 'y', None),
+        ...         (DELETE, 'b', None, None), (SET_ITEMS, 'c', {'i': '1'}, None)])
+        {'a': ('x', 2), 'c': ({'i': '1'}, None)}
+    """
+    entries = {}
+    for operation, key, value, until in records:
+        if operation == SET:
+            entries[key] = (value, until)
+        elif operation == SET_ITEMS:
+            # Like HSET, changing items keeps the expiry of the collection
+            collection, until = entries.get(key, ({}, None))
+            entries[key] = ({**collection, **value}, until)
+        elif operation == EXPIRE:
+            if key in entries:
+                entries[key] = (entries[key][0], until)
+        else:
+            entries.pop(key, None)
+    return entries
+
+
+class Persistence:
+    """Append-only log of the changes of a memory backend, compacted in snapshots.
+
+    Changes are buffered and written (and fsynced) every `fsync_interval` seconds,
+    in a thread: the changes of the last interval are lost on a crash. Every
+    `snapshot_interval` seconds the keys are written in a new snapshot, a chunk at a
+    time, and the logs it includes are removed.
+
+    Logs are numbered: taking a snapshot starts a new log first, and the snapshot
+    records it. The keys changed while the snapshot is written may be saved with
+    their new value, that is fine because the new log has every change since the
+    snapshot started, and replaying a record sets the same value again. Loading
+    reads the snapshot and then the logs it doesn't include, with memory-mapped
+    reads.
+
+    The directory is locked: it can only be used by one process at a time.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        fsync_interval: float,
+        snapshot_interval: float
+    ):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.snapshot_interval = snapshot_interval
+        self._buffer: typing.List[bytes] = []
+        self._log: typing.BinaryIO | None = None
+        self._log_number = 0
+        self._lock_file: typing.BinaryIO | None = None
+        # Log writes run in this order, even when the task waiting for one is
+        # cancelled
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._closed = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _log_numbers(self) -> typing.List[int]:
+        return sorted(
+            int(match.group(1)) for name in os.listdir(self.directory)
+            if (match := LOG_NAME.match(name)))
+
+    def open(self) -> typing.Iterator[Record]:
+        """Lock the directory, yield the records saved, then start a new log"""
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_file = open(self._path('lock'), 'wb')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(f'{self.directory} is used by another process')
+
+        first_log = 0
+        if os.path.exists(self._path('snapshot')):
+            with open(self._path('snapshot'), 'rb') as f:
+                magic, first_log = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+                if magic != SNAPSHOT_MAGIC:
+                    raise ValueError(f'{self._path("snapshot")} is not a snapshot')
+            yield from self._read(self._path('snapshot'), SNAPSHOT_HEADER.size)
+
+        for number in self._log_numbers():
+            if number >= first_log:
+                yield from self._read(self._path(f'log.{number}'), 0, truncate=True)
+            self._log_number = number + 1
+
+        self._log = open(self._path(f'log.{self._log_number}'), 'ab')
+
+    def _read(
+        self,
+        path: str,
+        offset: int,
+        truncate: bool = False
+    ) -> typing.Iterator[Record]:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= offset:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                while (decoded := decode(buffer, offset)) is not None:
+                    record, offset = decoded
+                    yield record
+
+        # The end of a log written during a crash
+        if offset < size:
+            logging.warning(f'{path}: incomplete record at {offset} ignored')
+            if truncate:
+                os.truncate(path, offset)
+
+    def append(
+        self,
+        operation: int,
+        key: str,
+        value: typing.Any = None,
+        until: float | None = None
+    ) -> None:
+        self._buffer.append(encode(operation, key, value, until))
+
+    def _submit(self, func: typing.Callable, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _take_buffer(self) -> bytes:
+        data = b''.join(self._buffer)
+        self._buffer = []
+        return data
+
+    def _write(self, data: bytes, next_log: int | None = None) -> None:
+        """Write and sync `data` to the log, then switch to `next_log` if given"""
+        if data:
+            self._log.write(data)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+        if next_log is not None:
+            self._log.close()
+            self._log = open(self._path(f'log.{next_log}'), 'ab')
+
+    async def flush(self) -> None:
+        if self._buffer:
+            await self._submit(self._write, self._take_buffer())
+
+    async def snapshot(
+        self,
+        keys: typing.Callable[[], typing.List[typing.Any]],
+        entry: typing.Callable[[typing.Any], Entry | None]
+    ) -> None:
+        """Write a snapshot of the keys: `keys()` lists them, `entry(key)` gives the
+        name, current value and expiry of a key (`None` once removed)
+        """
+        start = time.monotonic()
+        self._log_number += 1
+        switched = self._submit(self._write, self._take_buffer(), self._log_number)
+        # Listed when the next log starts: later changes are in that log
+        keys = keys()
+        await switched
+
+        temporary = self._path('snapshot.tmp')
+        with open(temporary, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, self._log_number))
+            for i in range(0, len(keys), SNAPSHOT_CHUNK):
+                chunk = []
+                for key in keys[i:i + SNAPSHOT_CHUNK]:
+                    if (current := entry(key)) is not None:
+                        chunk.append(encode(SET, *current))
+                f.write(b''.join(chunk))
+                await asyncio.sleep(0)
+            f.flush()
+            await asyncio.to_thread(os.fsync, f.fileno())
+
+        os.replace(temporary, self._path('snapshot'))
+        await asyncio.to_thread(self._sync_directory)
+        for number in self._log_numbers():
+            if number < self._log_number:
+                os.remove(self._path(f'log.{number}'))
+
+        logging.info(
+            f'Snapshot of {len(keys)} keys written in {time.monotonic() - start:.2f}s')
+
+    def _sync_directory(self) -> None:
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def start(
+        self,
+        keys: typing.Callable[[], typing.List[typing.Any]],
+        entry: typing.Callable[[typing.Any], Entry | None]
+    ) -> None:
+        """Flush and take snapshots in the background (see `snapshot`), until closed
+        """
+        self._task = asyncio.create_task(self._run(keys, entry))
+
+    async def _run(self, keys, entry) -> None:
+        snapshot = None
+        next_snapshot = time.monotonic() + self.snapshot_interval
+
+        try:
+            while not self._closed.is_set():
+                try:
+                    await asyncio.wait_for(self._closed.wait(), self.fsync_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+                try:
+                    await self.flush()
+                except OSError as error:
+                    logging.error(f'Keys not persisted: {error!r}')
+
+                if time.monotonic() >= next_snapshot and (
+                        snapshot is None or snapshot.done()):
+                    snapshot = asyncio.create_task(self._try_snapshot(keys, entry))
+                    next_snapshot = time.monotonic() + self.snapshot_interval
+        finally:
+            # An interrupted snapshot is discarded, the logs it includes are kept
+            if snapshot is not None and not snapshot.done():
+                snapshot.cancel()
+                await asyncio.gather(snapshot, return_exceptions=True)
+
+    async def _try_snapshot(self, keys, entry) -> None:
+        if self._closed.is_set():
+            return
+        try:
+            await self.snapshot(keys, entry)
+        except OSError as error:
+            logging.error(f'Snapshot failed: {error!r}')
+
+    async def close(self) -> None:
+        self._closed.set()
+        if self._task is not None:
+            await self._task
+
+        await self.flush()
+        await self._submit(self._log.close)
+        self._executor.shutdown()
+        self._lock_file.close()
@@ -0,0 +1,275 @@
+"""Production server: a master process that pre-forks `SERVER_CONCURRENCY` uvicorn
+workers sharing the listening socket.
+
+    python -m app.server
+
+Signals handled by the master:
+
+- `SIGTERM` / `SIGINT`: workers stop accepting connections and finish their
+  requests, they are killed after `SERVER_GRACEFUL_TIMEOUT` seconds
+- `SIGHUP`: rolling restart, one worker at a time: a new worker is started and,
+  once it is ready, the old one is stopped gracefully
+
+Workers that exit unexpectedly are replaced. Workers exiting during their first
+`CRASH_WINDOW` seconds (e.g. a failed startup) are replaced after an exponential
+backoff, the master exits with status 1 after `CRASH_LIMIT` of them in a row.
+"""
+import importlib.util
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import typing
+
+import uvicorn
+
+from app.settings import settings
+from app.util import get_log_level
+
+
+APP = 'app.main:app'
+# Seconds between checks of signals and exited workers
+TICK = 0.2
+# Workers exiting within this many seconds of their start crashed, they are replaced
+# after a delay doubling with each crash in a row, up to `BACKOFF_MAX` seconds
+CRASH_WINDOW = 5
+BACKOFF_MAX = 30
+CRASH_LIMIT = 5
+
+
+def fastest(*modules: str) -> str:
+    """First installed module, or the last one (the pure python fallback)
+
+        >>> fastest('not_installed_module', 'asyncio')
+        'asyncio'
+    """
+    for module in modules[:-1]:
+        if importlib.util.find_spec(module) is not None:
+            return module
+    return modules[-1]
+
+
+class Worker(uvicorn.Server):
+    """Uvicorn server of a worker process, tells the master when it is ready"""
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    def install_signal_handlers(self) -> None:
+        super().install_signal_handlers()
+        # Restarts are handled by the master
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    async def startup(self, sockets: list = None) -> None:
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            os.write(self.ready_fd, b'1')
+        os.close(self.ready_fd)
+
+
+class Master:
+    def __init__(
+        self,
+        config: uvicorn.Config,
+        *,
+        concurrency: int,
+        graceful_timeout: float,
+        ready_timeout: float = 60
+    ):
+        self.config = config
+        self.concurrency = concurrency
+        self.graceful_timeout = graceful_timeout
+        self.ready_timeout = ready_timeout
+        self.socket: socket.socket | None = None
+        # Running workers: pid -> read end of their ready pipe
+        self.workers: typing.Dict[int, int] = {}
+        # Workers being stopped: pid -> kill deadline
+        self.stopping: typing.Dict[int, float] = {}
+        self.signals: typing.List[int] = []
+        # Start time of the running workers
+        self.started: typing.Dict[int, float] = {}
+        # Workers that crashed in a row (until a worker started since outlives the
+        # crash window), times of the workers to start
+        self.crashes = 0
+        self.last_crash = 0.0
+        self.respawns: typing.List[float] = []
+
+    def run(self) -> int:
+        """Run until stopped by a signal (0) or workers crashing in a row (1)"""
+        self.socket = self.config.bind_socket()
+
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, lambda sig, frame: self.signals.append(sig))
+
+        for _ in range(self.concurrency):
+            self.spawn()
+        logging.info(
+            f'Server started: {self.concurrency} workers, '
+            f'loop {self.config.loop}, http {self.config.http}')
+
+        while True:
+            while self.signals:
+                sig = self.signals.pop(0)
+                if sig == signal.SIGHUP:
+                    self.restart()
+                else:
+                    self.stop()
+                    return 0
+
+            self.reap()
+            if self.crashes >= CRASH_LIMIT:
+                logging.error(f'{self.crashes} workers crashed in a row, stopping')
+                self.stop()
+                return 1
+
+            now = time.monotonic()
+            for at in [at for at in self.respawns if at <= now]:
+                self.respawns.remove(at)
+                self.spawn()
+            time.sleep(TICK)
+
+    def spawn(self) -> int:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+
+        if pid == 0:
+            os.close(read_fd)
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(sig, signal.SIG_DFL)
+            try:
+                Worker(self.config, write_fd).run(sockets=[self.socket])
+            except BaseException:
+                logging.exception('Worker failed')
+                os._exit(1)
+            os._exit(0)
+
+        os.close(write_fd)
+        self.workers[pid] = read_fd
+        self.started[pid] = time.monotonic()
+        logging.info(f'Worker {pid} started')
+        return pid
+
+    def wait_ready(self, pid: int) -> bool:
+        """Whether the worker completed its startup (a failed startup closes the
+        pipe without writing)
+        """
+        read_fd = self.workers[pid]
+        readable, _, _ = select.select([read_fd], [], [], self.ready_timeout)
+        return bool(readable) and os.read(read_fd, 1) == b'1'
+
+    def terminate(self, pid: int) -> None:
+        os.close(self.workers.pop(pid))
+        del self.started[pid]
+        self.stopping[pid] = time.monotonic() + self.graceful_timeout
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def restart(self) -> None:
+        logging.info('Rolling restart of the workers')
+
+        for old in list(self.workers):
+            new = self.spawn()
+            if not self.wait_ready(new):
+                logging.error(f'Worker {new} not ready, restart aborted')
+                self.terminate(new)
+                return
+            self.terminate(old)
+
+    def reap(self) -> None:
+        """Collect exited workers, replace the ones that were not stopped (see
+        `CRASH_WINDOW`) and kill the ones stopping for too long
+        """
+        while self.workers or self.stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+
+            if pid in self.stopping:
+                del self.stopping[pid]
+            elif pid in self.workers:
+                code = os.waitstatus_to_exitcode(status)
+                os.close(self.workers.pop(pid))
+                now = time.monotonic()
+                if now - self.started.pop(pid) < CRASH_WINDOW:
+                    self.crashes += 1
+                    self.last_crash = now
+                    delay = min(BACKOFF_MAX, TICK * 2 ** (self.crashes - 1))
+                else:
+                    self.crashes = 0
+                    delay = 0
+                logging.warning(
+                    f'Worker {pid} exited ({code}), replacing it in {delay:g}s')
+                self.respawns.append(now + delay)
+
+        now = time.monotonic()
+        if self.crashes and any(
+                self.last_crash < started < now - CRASH_WINDOW
+                for started in self.started.values()):
+            self.crashes = 0
+
+        for pid, deadline in self.stopping.items():
+            if now > deadline:
+                logging.warning(f'Worker {pid} killed after the graceful timeout')
+                self.stopping[pid] = float('inf')
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def stop(self) -> None:
+        logging.info('Stopping the workers')
+        for pid in list(self.workers):
+            self.terminate(pid)
+
+        while self.stopping:
+            self.reap()
+            time.sleep(TICK)
+
+        self.socket.close()
+        logging.info('Server stopped')
+
+
+def clear_metrics(directory: str) -> None:
+    """Remove the metrics snapshots left by previous runs"""
+    if not os.path.isdir(directory):
+        return
+
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            os.remove(os.path.join(directory, filename))
+
+
+def main() -> int:
+    logging.basicConfig(
+        level=get_log_level(settings.app.log_level),
+        format='%(asctime)s [%(levelname)s] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S')
+
+    if settings.metrics.dir:
+        clear_metrics(settings.metrics.dir)
+
+    config = uvicorn.Config(
+        APP,
+        host='0.0.0.0',
+        port=settings.app.port or 80,
+        loop=fastest('uvloop', 'asyncio'),
+        http=fastest('httptools', 'h11'),
+        log_level=settings.app.log_level)
+
+    return Master(
+        config,
+        concurrency=settings.uvicorn.concurrency or 1,
+        graceful_timeout=settings.uvicorn.graceful_timeout).run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -18,6 +18,26 @@ class AppSettings(BaseSettings):
     log_level: Annotated[str, Field(
         description='Log level',
         valid_options=['debug', 'info', 'warning', 'error'])] = 'info'
+    log_sample_rate: Annotated[int, Field(
+        description='Log one request out of N. Errors and slow requests are '
+        'always logged')] = 1
+    log_slow_ms: Annotated[Optional[int], Field(
+        description='Requests slower than this (milliseconds) are always logged')]
+    verify_sessions: Annotated[bool, Field(
+        description='Validate stored sessions before returning them. Sessions are '
+        'validated when written, this is only useful during data migrations')] = False
+    session_layout: Annotated[str, Field(
+        description='How sessions are stored: `json`, one JSON value per session, '
+        'or `hash`, one collection item per `data` field (updates only write the '
+        'changed fields). Existing sessions are not converted when changed',
+        valid_options=['json', 'hash'])] = 'json'
+    sliding_expiration: Annotated[bool, Field(
+        description='Extend the expiry of a session when it is read (to the session '
+        'max age from now)')] = False
+    expiry_refresh_interval: Annotated[float, Field(
+        description='With sliding expiration, seconds between the batches of expiry '
+        'refreshes. The expiry of a session is refreshed at most once per '
+        'interval')] = 60
 
     class Config:
         env_prefix = 'APP_'
@@ -79,6 +99,22 @@ class RedisSettings(BaseSettings):
     maxsize: Annotated[
         Optional[int], Field(
             description='Maximum size of connection pool', note=2)] = 10
+    health_check_interval: Annotated[
+        float, Field(
+            description='Seconds between pings of the pool connections. '
+            '0 disables the checks')] = 10
+    max_pool_usage: Annotated[
+        float, Field(
+            description='The service reports not ready (`/readyz`) when this ratio '
+            'of the pool connections is in use', note=2)] = 0.9
+    autopipeline: Annotated[
+        bool, Field(
+            description='Send the commands issued concurrently in a single '
+            'pipeline')] = False
+    autopipeline_window: Annotated[
+        float, Field(
+            description='Seconds to wait for more commands before sending a pipeline. '
+            '0 sends the commands issued in the same event loop iteration')] = 0
     flush_on_disconnect: Annotated[
         bool, Field(
             description='Flush db when the connection closes', hidden=True)] = False
@@ -113,8 +149,160 @@ class RedisSettings(BaseSettings):
         }
 
 
+class MemorySettings(BaseSettings):
+    """In-memory store settings, used when redis is disabled.
+
+    <sup>(1) Leave empty for no limit. Least recently used keys are evicted first</sup>
+
+    <sup>(2) The directory can only be used by one process: use a single worker
+    (`SERVER_CONCURRENCY=1`)</sup>
+    """
+
+    max_entries: Annotated[
+        Optional[int], Field(description='Max number of stored keys', note=1)]
+    max_bytes: Annotated[
+        Optional[int], Field(
+            description='Max size of stored keys and values (approximate)', note=1)]
+    persist_dir: Annotated[
+        Optional[str], Field(
+            description='Directory where keys are saved (append-only log and '
+            'snapshots) to be loaded after a restart. Leave empty to keep keys in '
+            'memory only', note=2)]
+    fsync_interval: Annotated[
+        float, Field(
+            description='Seconds between writes of the log to disk, the changes of '
+            'the last interval are lost on a crash')] = 1
+    snapshot_interval: Annotated[
+        float, Field(
+            description='Seconds between snapshots, that compact the log')] = 3600
+    compact: Annotated[
+        bool, Field(
+            description='Store session keys as 16 bytes and values as bytes records '
+            'with their expiry, to use less memory per key (values are decoded on '
+            'each read). The keys expiring first are evicted instead of the least '
+            'recently used')] = False
+
+    @property
+    def url(self):
+        options = self.dict(exclude_none=True)
+        query = '&'.join([f'{k}={v}' for k, v in options.items()])
+
+        return 'memory://' + ('?' + query if query else '')
+
+    class Config:
+        env_prefix = 'MEMORY_'
+
+
+class StoreSettings(BaseSettings):
+    """Store settings
+
+    <sup>(1) Set to 0 to disable the in-process cache</sup>
+
+    <sup>(2) orjson and msgpack must be installed to be used. Values written with
+    any codec can always be read</sup>
+
+    <sup>(3) lz4 must be installed to be used, it is faster than zlib but compresses
+    less. Compressed values are always detected when reading, with any setting</sup>
+
+    <sup>(4) Binary keys need the redis backend. To convert the keys of a running
+    service: deploy every process with `migrate`, enable `STORE_MIGRATE_KEYS` on a
+    single one, then switch to `binary` once the migration is logged as done</sup>
+
+    <sup>(5) After changing the nodes of a sharded store, add the previous nodes in
+    the `previous` option (e.g. `redis+sharded://host1,host2,host3?previous=host1,host2`)
+    and keep it for at least the session max age (24 hours): keys are moved to their
+    new node when written or refreshed, the others expire on their previous node</sup>
+    """
+
+    codec: Annotated[
+        str, Field(
+            description='Format used to write values', note=2,
+            valid_options=['json', 'orjson', 'msgpack'])] = 'json'
+    url: Annotated[Optional[str], Field(
+        description='Store url, overrides the redis and memory settings. '
+        'E.g. `redis+sharded://host1,host2?maxsize=10` to spread keys across several '
+        'redis instances, `shm://sessions` to share keys between the processes of '
+        'the host in shared memory, or `sqlite:///var/lib/sessions.db` to keep them in '
+        'a SQLite database', note=5)]
+    cache_size: Annotated[
+        int, Field(
+            description='Max entries of the in-process read cache', note=1)] = 0
+    cache_ttl: Annotated[
+        float, Field(
+            description='Seconds a value can be served from the in-process cache '
+            'without reading the store')] = 5
+    compress_threshold: Annotated[
+        int, Field(
+            description='Values of at least this many bytes are compressed. '
+            '0 disables compression')] = 0
+    compression: Annotated[
+        str, Field(
+            description='Compression algorithm', note=3,
+            valid_options=['zlib', 'lz4'])] = 'zlib'
+    compression_level: Annotated[
+        Optional[int], Field(
+            description='Compression level: 1 (fastest) to 9 for zlib, 1 to 16 '
+            '(high compression mode) for lz4. Empty for the default')]
+    key_encoding: Annotated[
+        str, Field(
+            description='Format of the session keys in the store: `text` '
+            '(`session.id.<uuid>`, 47 bytes), `binary` (a 2 bytes prefix and the 16 '
+            'bytes of the UUID), or `migrate` (binary, falling back to text keys not '
+            'converted yet)', note=4,
+            valid_options=['text', 'binary', 'migrate'])] = 'text'
+    migrate_keys: Annotated[
+        bool, Field(
+            description='With the `migrate` key encoding, rename the text session keys '
+            'to binary keys in the background (SCAN batches), once', note=4)] = False
+
+    @property
+    def kwargs(self):
+        return self.dict(include={
+            'codec', 'cache_size', 'cache_ttl', 'compress_threshold', 'compression',
+            'compression_level', 'key_encoding'})
+
+    class Config:
+        env_prefix = 'STORE_'
+
+
+class MetricsSettings(BaseSettings):
+    """Metrics settings (`/metrics` route, Prometheus format)
+
+    <sup>(1) Required to aggregate the metrics of all the workers when
+    `SERVER_CONCURRENCY` > 1. Should be emptied when the server starts</sup>
+    """
+
+    enabled: Annotated[bool, Field(description='Record and expose metrics')] = True
+    dir: Annotated[Optional[str], Field(
+        description='Directory where each worker process shares its metrics',
+        note=1)]
+    write_interval: Annotated[float, Field(
+        description='Seconds between updates of the shared metrics of a worker')] = 1
+
+    class Config:
+        env_prefix = 'METRICS_'
+
+
+class AdminSettings(BaseSettings):
+    """Admin routes settings (`/admin`)
+
+    <sup>(1) The export returns the data of every session: only enable it with a
+    token, or on instances that are not publicly reachable</sup>
+    """
+
+    export_enabled: Annotated[bool, Field(
+        description='Enable `GET /admin/sessions/export`, streaming every session',
+        note=1)] = False
+    token: Annotated[Optional[str], Field(
+        description='Token required by the admin routes, in an '
+        '`Authorization: Bearer <token>` header. Empty for none')]
+
+    class Config:
+        env_prefix = 'ADMIN_'
+
+
 class UvicornSettings(BaseSettings):
-    """Postgres settings
+    """Server settings
 
     <sup>(1) **In development only**</sup>
 
@@ -125,6 +313,10 @@ class UvicornSettings(BaseSettings):
         bool, Field(description='Use reloader', note=1)] = False
     concurrency: Annotated[
         Optional[int], Field(description='Worker processes', note=2)] = 1
+    graceful_timeout: Annotated[
+        float, Field(
+            description='Seconds stopping workers have to finish their requests '
+            'before being killed', note=2)] = 30
 
     class Config:
         env_prefix = 'SERVER_'
@@ -137,9 +329,24 @@ class UvicornSettings(BaseSettings):
 class Settings(BaseSettings):
     app: AppSettings = AppSettings()
     redis: RedisSettings = RedisSettings()
+    memory: MemorySettings = MemorySettings()
+    store: StoreSettings = StoreSettings()
+    metrics: MetricsSettings = MetricsSettings()
+    admin: AdminSettings = AdminSettings()
     uvicorn: UvicornSettings = UvicornSettings()
 
     #postgres: PostgresSettings = PostgresSettings()
 
+    @property
+    def store_url(self):
+        """Store url if set, else redis url, or memory url when redis is disabled"""
+        if self.store.url:
+            return self.store.url
+
+        if self.redis.host is None:
+            return self.memory.url
+
+        return self.redis.url
+
 
 settings = Settings()
@@ -1,15 +1,44 @@
+import asyncio
+import fnmatch
+import functools
+import heapq
 import logging
+import re
+import sys
+import time
 import typing
+from collections import OrderedDict
 from urllib.parse import urlparse, parse_qsl
 from pydantic import BaseModel
 
-import aioredis
-
-from app.util import safe_dict_json_loads, safe_dict_json_dumps
+from app import persistence
+from app.cache import LocalCache
+from app.codec import Compressor, Decoder, get_codec, get_compression
+from app.constants import STORE_KEY, STORE_KEY_BINARY_PREFIX
+from app.keys import session_key, session_uuid
 from app.settings import settings
 
 
+# Memory used by an expiry, and by a deadline in the heap of the memory backend
+FLOAT_SIZE = sys.getsizeof(0.0)
+DEADLINE_SIZE = sys.getsizeof((0.0, ''))
+# Superseded deadlines left in the heap before it is rebuilt, per key with an expiry
+# (plus a minimum, so that small heaps are not rebuilt often)
+STALE_DEADLINES_RATIO = 1
+STALE_DEADLINES_MIN = 1024
+
+
+class ValueTooLarge(ValueError):
+    """The value can't be stored by the backend (e.g. it doesn't fit in a shared
+    memory slot)"""
+
+
 class Backend:
+    # Raw values are `str` (JSON text) or `bytes` (written by a binary codec, see
+    # `app.codec`)
+
+    # Whether keys can also be `bytes` (binary key encodings of `Store`)
+    binary_keys = False
 
     async def connect(self) -> None:
         raise NotImplementedError()
@@ -17,76 +46,714 @@ class Backend:
     async def disconnect(self) -> None:
         raise NotImplementedError()
 
+    def is_ready(self) -> bool:
+        raise NotImplementedError()
+
     async def get(self, key: str) -> str:
         raise NotImplementedError()
 
     async def set(self, key: str, raw: str, *, until: int | None = None) -> None:
         raise NotImplementedError()
 
+    async def create(self, key: str, raw: str, *, until: int | None = None) -> bool:
+        raise NotImplementedError()
+
+    async def create_many(
+        self,
+        values: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> typing.List[bool]:
+        """`create` of several keys, whether each key was created"""
+        raise NotImplementedError()
+
+    async def get_many(self, keys: typing.List[str]) -> typing.List[str]:
+        raise NotImplementedError()
+
+    async def set_many(
+        self,
+        values: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> None:
+        raise NotImplementedError()
+
+    async def expire_many(self, expiries: typing.Dict[str, int]) -> None:
+        raise NotImplementedError()
+
     async def keys(self, pattern: str = '*') -> typing.List[str]:
         raise NotImplementedError()
 
+    def iter_keys(
+        self,
+        pattern: str = '*',
+        *,
+        count: int = 100
+    ) -> typing.AsyncIterator[str]:
+        raise NotImplementedError()
+
     async def exists(self, key: str) -> bool:
         raise NotImplementedError()
 
     async def get_collection(self, key: str) -> typing.Dict[str, str]:
         raise NotImplementedError()
 
+    async def get_collections(
+        self,
+        keys: typing.List[str]
+    ) -> typing.List[typing.Dict[str, str]]:
+        raise NotImplementedError()
+
     async def get_item(self, key: str, item: str) -> str:
         raise NotImplementedError()
 
     async def set_item(self, key: str, item: str, value: str) -> None:
         raise NotImplementedError()
 
+    async def set_items(
+        self,
+        key: str,
+        items: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> None:
+        raise NotImplementedError()
+
+    async def create_items(
+        self,
+        key: str,
+        items: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> bool:
+        raise NotImplementedError()
+
+    async def delete_items(self, key: str, items: typing.List[str]) -> None:
+        raise NotImplementedError()
+
+    async def publish(self, channel: str, message: str) -> None:
+        raise NotImplementedError()
+
+    def subscribe(self, channel: str) -> typing.AsyncIterator[str]:
+        raise NotImplementedError()
+
+    async def rename_many(self, renames: typing.Dict[str, str | bytes]) -> int:
+        raise NotImplementedError()
+
+    async def exists_many(self, keys: typing.List[str | bytes]) -> typing.List[bool]:
+        raise NotImplementedError()
+
+    async def dump(self, key: str) -> typing.Tuple[typing.Any, float | None] | None:
+        """Value of the key (in a format of the backend) and its expiry, `None` if
+        missing: to copy keys between nodes of the same kind (see `restore`)
+        """
+        raise NotImplementedError()
+
+    async def restore(self, key: str, value: typing.Any, until: float | None) -> bool:
+        """Write a dumped value, unless the key exists"""
+        raise NotImplementedError()
+
 
 class MemoryBackend(Backend):
+    """In-process backend, keys are only visible to the process that wrote them.
 
-    def __init__(self):
-        self._dict = None
+    Keys with an expiry are removed at their deadline: a heap of deadlines is
+    checked on every operation and swept periodically. Optional `max_entries` and
+    `max_bytes` limits (url query) evict the least recently used keys.
+
+    With `persist_dir`, keys are kept across restarts: changes are logged to that
+    directory and loaded when connecting (see `app.persistence.Persistence`).
+
+    The `compact` option selects a layout using less memory per key (see
+    `app.backends.compact.CompactMemoryBackend`).
+    """
+
+    def __init__(self, url: str = 'memory://'):
+        options = dict(parse_qsl(urlparse(url).query))
+        self.options = MemoryBackend.Options(**options)
+        self._dict: typing.OrderedDict[str, typing.Any] | None = None
+        self._expiry: typing.Dict[str, float] = {}
+        self._deadlines: typing.List[typing.Tuple[float, str]] = []
+        self._bytes = 0
+        # Bytes of the key and value objects
+        self._allocated = 0
+        self._sweeper: asyncio.Task | None = None
+        self._subscribers: typing.Dict[str, typing.List[asyncio.Queue]] = {}
+        # Set once the persisted keys are loaded
+        self._persistence: persistence.Persistence | None = None
 
     async def connect(self) -> None:
-        self._dict = {}
+        self._dict = OrderedDict()
+        self._expiry = {}
+        self._deadlines = []
+        self._bytes = 0
+        self._allocated = 0
+        if self.options.persist_dir:
+            self._restore()
+        self._sweeper = asyncio.create_task(self._sweep())
 
     async def disconnect(self) -> None:
+        self._sweeper.cancel()
+        self._sweeper = None
+        if self._persistence is not None:
+            await self._persistence.close()
+            self._persistence = None
         self._dict = None
+        for queues in self._subscribers.values():
+            for queue in queues:
+                queue.put_nowait(None)
+
+    def is_ready(self) -> bool:
+        return True
+
+    @property
+    def size(self) -> typing.Dict[str, int]:
+        """Number of keys and approximate bytes used by keys and values
+        """
+        return {'entries': len(self._dict), 'bytes': self._bytes}
+
+    def memory(self) -> typing.Dict[str, int]:
+        """Number of keys, bytes of keys and values (see `size`) and overhead: the
+        other bytes used by the backend (objects headers, containers, expiries), as
+        measured by `sys.getsizeof`. Allocator fragmentation is not included
+        """
+        used = (
+            self._allocated + sys.getsizeof(self._dict)
+            + sys.getsizeof(self._expiry) + len(self._expiry) * FLOAT_SIZE
+            + sys.getsizeof(self._deadlines) + len(self._deadlines) * DEADLINE_SIZE)
+        return {
+            'entries': len(self._dict),
+            'bytes': self._bytes,
+            'overhead': used - self._bytes,
+        }
+
+    @staticmethod
+    def _sizeof(key: str, value: typing.Any) -> int:
+        if isinstance(value, dict):
+            return len(key) + sum(len(k) + len(v) for k, v in value.items())
+        return len(key) + len(value)
+
+    @staticmethod
+    def _footprint(key: str, value: typing.Any) -> int:
+        size = sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(value, dict):
+            size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+        return size
+
+    def _restore(self) -> None:
+        """Load the persisted keys, and log the next changes"""
+        log = persistence.Persistence(
+            self.options.persist_dir,
+            fsync_interval=self.options.fsync_interval,
+            snapshot_interval=self.options.snapshot_interval)
+        self._load(log.open())
+        logging.info(f'{len(self._dict)} keys loaded from {self.options.persist_dir}')
+        self._persistence = log
+        log.start(lambda: list(self._dict), self._entry)
+
+    def _load(self, records: typing.Iterator[persistence.Record]) -> None:
+        now = time.time()
+        # Millions of keys can be loaded: `_store` is inlined and the heap of
+        # deadlines built once at the end
+        deadlines = []
+
+        for key, (value, until) in persistence.replay(records).items():
+            if until is None or until > now:
+                self._dict[key] = value
+                self._bytes += self._sizeof(key, value)
+                self._allocated += self._footprint(key, value)
+                if until:
+                    self._expiry[key] = until
+                    deadlines.append((until, key))
+
+        heapq.heapify(deadlines)
+        self._deadlines = deadlines
+        self._evict()
+
+    def _entry(self, key: str) -> persistence.Entry | None:
+        """Name, value and expiry of the key, to take snapshots"""
+        until = self._expiry.get(key)
+        if key not in self._dict or (until and until <= time.time()):
+            return None
+        return key, self._dict[key], until
+
+    def _log(
+        self,
+        operation: int,
+        key: str,
+        value: typing.Any = None,
+        until: float | None = None
+    ) -> None:
+        if self._persistence is not None:
+            self._persistence.append(operation, key, value, until)
+
+    async def _sweep(self) -> None:
+        while True:
+            await asyncio.sleep(self.options.sweep_interval)
+            self._expire()
+
+    def _expire(self) -> None:
+        now = time.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, key = heapq.heappop(self._deadlines)
+            # Deadlines of overwritten keys are left in the heap, skip them
+            if self._expiry.get(key) == deadline:
+                # Expired keys are skipped when loading, no need to log them
+                self._remove(key, log=False)
+
+    def _remove(self, key: str, log: bool = True) -> None:
+        value = self._dict.pop(key)
+        self._bytes -= self._sizeof(key, value)
+        self._allocated -= self._footprint(key, value)
+        self._expiry.pop(key, None)
+        if log:
+            self._log(persistence.DELETE, key)
+
+    def _lookup(self, key: str, default: typing.Any) -> typing.Any:
+        self._expire()
+        if key not in self._dict:
+            return default
+
+        self._dict.move_to_end(key)
+        return self._dict[key]
+
+    def _store(self, key: str, value: typing.Any, until: float | None) -> None:
+        if key in self._dict:
+            self._bytes -= self._sizeof(key, self._dict[key])
+            self._allocated -= self._footprint(key, self._dict[key])
+
+        self._dict[key] = value
+        self._dict.move_to_end(key)
+        self._bytes += self._sizeof(key, value)
+        self._allocated += self._footprint(key, value)
+        self._log(persistence.SET, key, value, until)
+
+        if until:
+            self._schedule(key, until)
+        else:
+            self._expiry.pop(key, None)
+
+        self._evict()
+
+    def _schedule(self, key: str, until: float) -> None:
+        self._expiry[key] = until
+        heapq.heappush(self._deadlines, (until, key))
+
+        # The previous deadline of the key stays in the heap until it is due: with
+        # frequent refreshes, rebuild the heap before they pile up
+        stale = len(self._deadlines) - len(self._expiry)
+        if stale > STALE_DEADLINES_RATIO * len(self._expiry) + STALE_DEADLINES_MIN:
+            self._deadlines = [(until, key) for key, until in self._expiry.items()]
+            heapq.heapify(self._deadlines)
+
+    def _evict(self) -> None:
+        max_entries, max_bytes = self.options.max_entries, self.options.max_bytes
+        while self._dict and (
+            (max_entries and len(self._dict) > max_entries)
+            or (max_bytes and self._bytes > max_bytes)
+        ):
+            self._remove(next(iter(self._dict)))
 
     async def get(self, key: str) -> str:
-        return self._dict.get(key, '')
+        return self._lookup(key, '')
 
     async def set(self, key: str, raw: str, *, until: int | None = None) -> None:
-        self._dict[key] = raw
+        self._expire()
+        self._store(key, raw, until)
+
+    async def create(self, key: str, raw: str, *, until: int | None = None) -> bool:
+        self._expire()
+        if self._contains(key):
+            return False
+
+        self._store(key, raw, until)
+        return True
+
+    async def create_many(
+        self,
+        values: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> typing.List[bool]:
+        return [await self.create(key, raw, until=until) for key, raw in values.items()]
+
+    async def get_many(self, keys: typing.List[str]) -> typing.List[str]:
+        return [self._lookup(key, '') for key in keys]
+
+    async def set_many(
+        self,
+        values: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> None:
+        self._expire()
+        for key, raw in values.items():
+            self._store(key, raw, until)
 
-    # async def keys(self, pattern: str = '*') -> typing.List[str]:
-    #     raise NotImplementedError()
+    async def expire_many(self, expiries: typing.Dict[str, int]) -> None:
+        self._expire()
+        for key, until in expiries.items():
+            # Like EXPIREAT, missing keys are ignored
+            if key in self._dict:
+                self._schedule(key, until)
+                self._log(persistence.EXPIRE, key, until=until)
+
+    async def keys(self, pattern: str = '*') -> typing.List[str]:
+        return [key async for key in self.iter_keys(pattern)]
+
+    async def iter_keys(
+        self,
+        pattern: str = '*',
+        *,
+        count: int = 100
+    ) -> typing.AsyncIterator[str]:
+        self._expire()
+        match = re.compile(fnmatch.translate(pattern)).match
+        # Snapshot of the matching keys, the dict may change while iterating
+        keys = [key for key in self._dict if match(key)]
+
+        for i in range(0, len(keys), count):
+            for key in keys[i:i + count]:
+                if key in self._dict:
+                    yield key
+            await asyncio.sleep(0)
 
     async def exists(self, key: str) -> bool:
+        self._expire()
+        return self._contains(key)
+
+    def _contains(self, key: str) -> bool:
         return key in self._dict
 
+    def _until(self, key: str) -> float | None:
+        return self._expiry.get(key)
+
     async def get_collection(self, key: str) -> typing.Dict[str, str]:
-        return self._dict.get(key, {})
+        return self._lookup(key, {})
+
+    async def get_collections(
+        self,
+        keys: typing.List[str]
+    ) -> typing.List[typing.Dict[str, str]]:
+        return [self._lookup(key, {}) for key in keys]
 
     async def get_item(self, key: str, item: str) -> str:
-        return self._dict.get(key, {}).get(item, None)
+        return self._lookup(key, {}).get(item, None)
 
     async def set_item(self, key: str, item: str, value: str) -> None:
-        self._dict.setdefault(key, {}).update({item: value})
+        collection = self._lookup(key, None)
+        if collection is None:
+            self._store(key, {item: value}, None)
+            return
+
+        # Like HSET, changing an item keeps the expiry of the collection
+        old_size = len(item) + len(collection[item]) if item in collection else 0
+        footprint = self._footprint(key, collection)
+        collection[item] = value
+        self._bytes += len(item) + len(value) - old_size
+        self._allocated += self._footprint(key, collection) - footprint
+        self._log(persistence.SET_ITEMS, key, {item: value})
+        self._evict()
+
+    async def set_items(
+        self,
+        key: str,
+        items: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> None:
+        collection = self._lookup(key, {})
+        self._store(key, {**collection, **items}, until or self._until(key))
+
+    async def create_items(
+        self,
+        key: str,
+        items: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> bool:
+        self._expire()
+        if self._contains(key):
+            return False
+
+        self._store(key, dict(items), until)
+        return True
+
+    async def delete_items(self, key: str, items: typing.List[str]) -> None:
+        collection = self._lookup(key, None)
+        if collection is None:
+            return
+
+        footprint = self._footprint(key, collection)
+        for item in items:
+            if item in collection:
+                self._bytes -= len(item) + len(collection.pop(item))
+        self._allocated += self._footprint(key, collection) - footprint
+
+        # Like redis, empty collections don't exist
+        if not collection:
+            self._remove(key)
+        else:
+            self._log(persistence.SET, key, collection, self._expiry.get(key))
+
+    async def dump(self, key: str) -> typing.Tuple[typing.Any, float | None] | None:
+        value = self._lookup(key, None)
+        if value is None:
+            return None
+        # Collections are changed in place, the copy must not share them
+        return (dict(value) if isinstance(value, dict) else value), self._until(key)
+
+    async def restore(self, key: str, value: typing.Any, until: float | None) -> bool:
+        self._expire()
+        if self._contains(key):
+            return False
+
+        self._store(key, value, until)
+        return True
+
+    async def publish(self, channel: str, message: str) -> None:
+        for queue in self._subscribers.get(channel, []):
+            queue.put_nowait(message)
+
+    async def subscribe(self, channel: str) -> typing.AsyncIterator[str]:
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(channel, []).append(queue)
+        try:
+            while (message := await queue.get()) is not None:
+                yield message
+        finally:
+            self._subscribers[channel].remove(queue)
+
+    class Options(BaseModel):
+        max_entries: typing.Optional[int]
+        max_bytes: typing.Optional[int]
+        sweep_interval: float = 1
+        persist_dir: typing.Optional[str]
+        fsync_interval: float = 1
+        snapshot_interval: float = 3600
+        compact: bool = False
+
+
+def _resolve(waiter: asyncio.Future, result: asyncio.Future) -> None:
+    """Copy the outcome of `result` to `waiter` (unless cancelled meanwhile)"""
+    if waiter.done():
+        return
+    if result.cancelled():
+        waiter.cancel()
+    elif result.exception() is not None:
+        waiter.set_exception(result.exception())
+    else:
+        waiter.set_result(result.result())
+
+
+# Renames KEYS[1] to KEYS[2] (1), or deletes it when KEYS[2] exists (0), atomically
+RENAME_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+elseif redis.call('RENAMENX', KEYS[1], KEYS[2]) == 0 then
+    redis.call('DEL', KEYS[1])
+    return 0
+end
+return 1
+'''
+
+# RENAME_SCRIPT, then the command ARGV[1] on KEYS[2] with the arguments ARGV[2...]
+MIGRATE_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 1
+        and redis.call('RENAMENX', KEYS[1], KEYS[2]) == 0 then
+    redis.call('DEL', KEYS[1])
+end
+return redis.call(ARGV[1], KEYS[2], unpack(ARGV, 2))
+'''
+
+# Restores KEYS[1] (ttl ARGV[1], dumped value ARGV[2]) unless it exists (0)
+RESTORE_SCRIPT = '''
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('RESTORE', KEYS[1], ARGV[1], ARGV[2])
+return 1
+'''
 
 
 class RedisBackend(Backend):
+    """Redis backend, using a pool of connections.
+
+    The `minsize` connections of the pool are opened and pinged when connecting, and
+    checked again every `health_check_interval` seconds (connections that fail are
+    closed and replaced).
+
+    With `autopipeline`, the commands sent in the same event loop iteration
+    (or within `autopipeline_window` seconds) are sent together in one pipeline,
+    which saves syscalls and network writes when many requests run concurrently.
+    """
+
+    # Options used by the backend, the rest are connection pool options
+    BACKEND_OPTIONS = {
+        'health_check_interval', 'max_pool_usage', 'autopipeline', 'autopipeline_window'}
+
+    binary_keys = True
+
     def __init__(self, url):
         parsed_url = urlparse(url)
         options = dict(parse_qsl(parsed_url.query))
-        self.options = RedisBackend.Options(**options).dict(exclude_none=True)
+        backend_options = RedisBackend.Options(**options)
+        self.options = backend_options.dict(
+            exclude_none=True, exclude=RedisBackend.BACKEND_OPTIONS)
         self.options['address'] = f'redis://{parsed_url.netloc}'
+        self.health_check_interval = backend_options.health_check_interval
+        self.max_pool_usage = backend_options.max_pool_usage
+        self.autopipeline = backend_options.autopipeline
+        self.autopipeline_window = backend_options.autopipeline_window
         self._connection = None
+        # Set by the `migrate` key encoding of `Store`: writes of binary session keys
+        # rename their text key first (in the same script or pipeline)
+        self.migrate_text_keys = False
+        self._pipeline: typing.List[tuple] = []
+        self._pipeline_executions: typing.Set[asyncio.Task] = set()
+        self._healthy = False
+        self._health_checker: asyncio.Task | None = None
         self.flush_on_disconnect = options.get(
             'flush_on_disconnect', 'False') == 'True'
 
     async def connect(self) -> None:
+        # Imported here, so that it's only loaded when redis is used
+        import aioredis
+
         self._connection = await aioredis.create_redis_pool(**self.options)
+        await self._check_connections()
+        if self.health_check_interval:
+            self._health_checker = asyncio.create_task(self._check_health())
         logging.info(f'Redis connected, options: {self.options}')
 
+    async def _check_connections(self) -> None:
+        """Ping `minsize` connections, opening them if needed. Connections that fail
+        are closed, so the pool replaces them.
+        """
+        pool = self._connection.connection
+        connections = []
+        try:
+            for _ in range(pool.minsize):
+                connections.append(await pool.acquire())
+
+            results = await asyncio.gather(
+                *(connection.execute('PING') for connection in connections),
+                return_exceptions=True)
+        finally:
+            for connection in connections:
+                pool.release(connection)
+
+        errors = []
+        for connection, result in zip(connections, results):
+            if isinstance(result, Exception):
+                connection.close()
+                errors.append(result)
+
+        self._healthy = not errors
+        if errors:
+            raise errors[0]
+
+    async def _check_health(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await asyncio.wait_for(
+                    self._check_connections(), timeout=self.health_check_interval)
+            except Exception as error:
+                self._healthy = False
+                logging.warning(f'Redis health check failed: {error!r}')
+
+    def _execute(self, command: str, *args, **kwargs) -> asyncio.Future:
+        """Send a command. When auto-pipelining, the command is queued and sent with
+        the others of the current batch
+        """
+        if not self.autopipeline:
+            return self._connection.execute(command, *args, **kwargs)
+
+        if not self._pipeline:
+            loop = asyncio.get_running_loop()
+            if self.autopipeline_window:
+                loop.call_later(self.autopipeline_window, self._flush_pipeline)
+            else:
+                loop.call_soon(self._flush_pipeline)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pipeline.append((future, command, args, kwargs))
+        return future
+
+    def _text_key(self, key: str | bytes) -> str | None:
+        """Text key of a binary session key to rename before writing it"""
+        if self.migrate_text_keys and isinstance(key, bytes) and key.startswith(
+                STORE_KEY_BINARY_PREFIX):
+            return session_key(key[len(STORE_KEY_BINARY_PREFIX):])
+        return None
+
+    def _write_command(self, command: str, key: str | bytes, *args) -> tuple:
+        """Command and arguments of a write, renaming the text key first (see
+        `_text_key`)
+        """
+        if (text_key := self._text_key(key)) is None:
+            return command, (key, *args)
+        return 'EVAL', (MIGRATE_SCRIPT, 2, text_key, key, command, *args)
+
+    def _write(self, command: str, key: str | bytes, *args) -> asyncio.Future:
+        """Send a write command (see `_write_command`)"""
+        command, args = self._write_command(command, key, *args)
+        return self._execute(command, *args)
+
+    def _rename_text_keys(self, pipe, keys: typing.Iterable[str | bytes]) -> None:
+        """Queue the renames of the text keys in a pipeline or transaction"""
+        for key in keys:
+            if (text_key := self._text_key(key)) is not None:
+                pipe.eval(RENAME_SCRIPT, keys=[text_key, key])
+
+    def _flush_pipeline(self) -> None:
+        commands, self._pipeline = self._pipeline, []
+        if not commands:
+            return
+
+        task = asyncio.create_task(self._send_pipeline(commands))
+        self._pipeline_executions.add(task)
+        task.add_done_callback(self._pipeline_executions.discard)
+
+    async def _send_pipeline(self, commands: typing.List[tuple]) -> None:
+        results = []
+        try:
+            async with self._connection.connection.get() as connection:
+                # All the commands are written at once, replies arrive in order
+                with connection._buffered():
+                    for future, command, args, kwargs in commands:
+                        if future.done():
+                            # Cancelled by the caller
+                            continue
+                        result = connection.execute(command, *args, **kwargs)
+                        result.add_done_callback(functools.partial(_resolve, future))
+                        results.append(result)
+
+                await asyncio.gather(*results, return_exceptions=True)
+        except Exception as error:
+            # No connection, every command not sent yet fails
+            for future, *_ in commands:
+                if not future.done():
+                    future.set_exception(error)
+
+    def is_ready(self) -> bool:
+        pool = self._connection.connection
+        in_use = pool.size - pool.freesize
+        return (
+            self._healthy and not pool.closed
+            and in_use < self.max_pool_usage * pool.maxsize
+        )
+
     async def disconnect(self) -> None:
+        if self._health_checker is not None:
+            self._health_checker.cancel()
+            self._health_checker = None
+
+        self._flush_pipeline()
+        if self._pipeline_executions:
+            await asyncio.wait(self._pipeline_executions)
+
         if self.flush_on_disconnect:
             logging.info('Redis db flushed')
             await self._connection.flushdb()
@@ -95,28 +762,240 @@ class RedisBackend(Backend):
         self._connection = None
 
     async def set(self, key: str, raw: str, *, until: int | None = None) -> None:
-        await self._connection.set(key, raw)
+        args = [key, raw]
+        if until:
+            args += ['EXAT', int(until)]
 
+        await self._write('SET', *args)
+
+    async def create(self, key: str, raw: str, *, until: int | None = None) -> bool:
+        # SET NX EXAT (redis >= 6.2) checks, writes and sets the expiry atomically
+        args = [key, raw, 'NX']
         if until:
-            await self._connection.expireat(key, until)
+            args += ['EXAT', int(until)]
+
+        return await self._write('SET', *args) is not None
+
+    async def create_many(
+        self,
+        values: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> typing.List[bool]:
+        expiry = ['EXAT', int(until)] if until else []
+        loop = asyncio.get_running_loop()
+        commands = [
+            (loop.create_future(), *self._write_command('SET', key, raw, 'NX', *expiry),
+             {})
+            for key, raw in values.items()
+        ]
+        # A SET NX per key, all sent in a single round trip
+        await self._send_pipeline(commands)
+        return [await future is not None for future, *_ in commands]
+
+    async def get_many(self, keys: typing.List[str]) -> typing.List[str]:
+        if not keys:
+            return []
+
+        raws = await self._execute('MGET', *keys, encoding=None)
+        return [self._decode(raw) for raw in raws]
+
+    async def set_many(
+        self,
+        values: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> None:
+        if not values:
+            return
+
+        # All the commands are sent in a single round trip
+        pipe = self._connection.pipeline()
+        self._rename_text_keys(pipe, values)
+        for key, raw in values.items():
+            pipe.set(key, raw)
+            if until:
+                pipe.expireat(key, int(until))
+
+        await pipe.execute()
+
+    async def expire_many(self, expiries: typing.Dict[str, int]) -> None:
+        if not expiries:
+            return
+
+        pipe = self._connection.pipeline()
+        self._rename_text_keys(pipe, expiries)
+        for key, until in expiries.items():
+            pipe.expireat(key, int(until))
+
+        await pipe.execute()
 
     async def get(self, key: str) -> str:
-        return await self._connection.get(key) or ''
+        return self._decode(await self._execute('GET', key, encoding=None))
 
     async def keys(self, pattern: str = '*') -> typing.List[str]:
-        return await self._connection.keys(pattern)
+        # KEYS blocks the redis server while it walks the whole keyspace
+        return [key async for key in self.iter_keys(pattern)]
 
-    async def exists(self, key: str) -> bool:
-        return await self._connection.exists(key) == 1
+    async def iter_keys(
+        self,
+        pattern: str | bytes = '*',
+        *,
+        count: int = 100
+    ) -> typing.AsyncIterator[str | bytes]:
+        # Keys are read as bytes: binary keys are not valid UTF-8, they are returned
+        # as they are
+        cursor = 0
+        while True:
+            cursor, keys = await self._execute(
+                'SCAN', cursor, 'MATCH', pattern, 'COUNT', count, encoding=None)
+            for key in keys:
+                try:
+                    yield key.decode()
+                except UnicodeDecodeError:
+                    yield key
+            if int(cursor) == 0:
+                return
+
+    async def exists(self, key: str | bytes, *keys: str | bytes) -> bool:
+        # Whether any of the keys exists, in a single command
+        return await self._execute('EXISTS', key, *keys) > 0
+
+    async def exists_many(self, keys: typing.List[str | bytes]) -> typing.List[bool]:
+        pipe = self._connection.pipeline()
+        for key in keys:
+            pipe.exists(key)
+        return [count == 1 for count in await pipe.execute()]
+
+    def _collection(
+        self,
+        items: typing.Iterable[typing.Tuple[bytes, bytes]]
+    ) -> typing.Dict[str, str]:
+        return {item.decode(): self._decode(raw) for item, raw in items}
 
     async def get_collection(self, key: str) -> typing.Dict[str, str]:
-        return await self._connection.hgetall(key)
+        # HGETALL replies with a flat list of items and values
+        coll = await self._execute('HGETALL', key, encoding=None)
+        return self._collection(zip(coll[::2], coll[1::2]))
+
+    async def get_collections(
+        self,
+        keys: typing.List[str | bytes]
+    ) -> typing.List[typing.Dict[str, str]]:
+        if not keys:
+            return []
+
+        # All the HGETALLs are sent in a single round trip
+        pipe = self._connection.pipeline()
+        for key in keys:
+            pipe.hgetall(key, encoding=None)
+        return [self._collection(coll.items()) for coll in await pipe.execute()]
 
     async def get_item(self, key: str, item: str) -> str:
-        return await self._connection.hget(key, item) or ''
+        return self._decode(await self._execute('HGET', key, item, encoding=None))
 
     async def set_item(self, key: str, item: str, value: str) -> None:
-        await self._connection.hset(key, item, value)
+        await self._write('HSET', key, item, value)
+
+    async def set_items(
+        self,
+        key: str,
+        items: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> None:
+        transaction = self._connection.multi_exec()
+        self._rename_text_keys(transaction, [key])
+        transaction.hmset_dict(key, items)
+        if until:
+            transaction.expireat(key, int(until))
+
+        await transaction.execute()
+
+    async def create_items(
+        self,
+        key: str,
+        items: typing.Dict[str, str],
+        *,
+        until: int | None = None
+    ) -> bool:
+        import aioredis
+
+        # WATCH aborts the transaction if the key is written after the check, it
+        # needs a connection of its own
+        # The text key (see `_text_key`) must not exist either, it is not renamed
+        keys = [key] if (text_key := self._text_key(key)) is None else [key, text_key]
+        async with self._connection.connection.get() as connection:
+            client = aioredis.Redis(connection)
+            await client.watch(*keys)
+            if await client.exists(*keys):
+                await client.unwatch()
+                return False
+
+            transaction = client.multi_exec()
+            transaction.hmset_dict(key, items)
+            if until:
+                transaction.expireat(key, int(until))
+
+            try:
+                await transaction.execute()
+            except aioredis.WatchVariableError:
+                return False
+
+        return True
+
+    async def delete_items(self, key: str, items: typing.List[str]) -> None:
+        if items:
+            await self._write('HDEL', key, *items)
+
+    async def publish(self, channel: str, message: str) -> None:
+        await self._connection.publish(channel, message)
+
+    async def rename_many(self, renames: typing.Dict[str, str | bytes]) -> int:
+        """Rename keys in a single pipeline, unless the new key exists: the old key
+        is then deleted (the new key was written after it). Missing keys are
+        ignored. Returns the number of keys renamed
+        """
+        if not renames:
+            return 0
+
+        pipe = self._connection.pipeline()
+        for key, new_key in renames.items():
+            pipe.eval(RENAME_SCRIPT, keys=[key, new_key])
+
+        return sum(await pipe.execute())
+
+    async def dump(self, key: str) -> typing.Tuple[bytes, float | None] | None:
+        payload, ttl = await asyncio.gather(
+            self._execute('DUMP', key, encoding=None), self._execute('PTTL', key))
+        if payload is None:
+            return None
+        return payload, (time.time() + ttl / 1000 if ttl > 0 else None)
+
+    async def restore(self, key: str, value: bytes, until: float | None) -> bool:
+        # RESTORE takes a ttl in milliseconds, 0 for none
+        ttl = 0 if until is None else max(1, int((until - time.time()) * 1000))
+        return await self._connection.eval(
+            RESTORE_SCRIPT, keys=[key], args=[ttl, value]) == 1
+
+    @staticmethod
+    def _decode(raw: bytes | None) -> str | bytes:
+        # Values are read as bytes: JSON text is decoded, values tagged by a binary
+        # codec (leading control byte) are returned untouched
+        if not raw:
+            return ''
+
+        if raw[0] < 0x20:
+            return raw
+
+        return raw.decode()
+
+    async def subscribe(self, channel: str) -> typing.AsyncIterator[str]:
+        # The pool keeps a dedicated connection for pub/sub, the iteration ends
+        # when the channel is unsubscribed or the pool closed
+        (subscription,) = await self._connection.subscribe(channel)
+        async for message in subscription.iter(encoding='utf-8'):
+            yield message
 
     class Options(BaseModel):
         db: typing.Optional[int]
@@ -125,31 +1004,136 @@ class RedisBackend(Backend):
         encoding: typing.Optional[str]
         minsize: typing.Optional[int] = 1
         maxsize: typing.Optional[int] = 10
+        health_check_interval: float = 10
+        max_pool_usage: float = 0.9
+        autopipeline: bool = False
+        autopipeline_window: float = 0
 
 
 class Store:
-    def __init__(self, url: str):
+    """Stores JSON values in a backend.
+
+    Concurrent `get_json`, `get_json_raw` and `exists` calls for the same key share
+    a single backend call (coalescing): a burst of requests for a popular session
+    sends one read to the backend. `coalesced` counts the calls that were served by
+    a call already in flight.
+
+    With `compress_threshold`, values of at least that many bytes are compressed.
+    Reads detect compressed values, whatever the current settings.
+
+    The backend is created when connecting: creating a store is cheap and doesn't
+    load the backend client libraries.
+
+    `key_encoding` sets how session keys (`session.id.<uuid>`) are written in the
+    backend (the keys used with the store don't change):
+    - `text`: as they are (47 bytes)
+    - `binary`: a short prefix and the 16 bytes of the UUID (18 bytes)
+    - `migrate`: like `binary`, while text keys are still being converted: reads
+      fall back to the text key when the binary key is missing, and writes first
+      rename the text key, in the same round trip (see `migrate_keys`)
+
+    Binary keys are only supported by backends with `binary_keys` (redis).
+    """
+
+    # Pub/sub channel used to tell other processes which keys changed
+    INVALIDATION_CHANNEL = 'store.invalidate'
+    KEY_ENCODINGS = ('text', 'binary', 'migrate')
+
+    def __init__(
+        self,
+        url: str,
+        *,
+        codec: str = 'json',
+        cache_size: int = 0,
+        cache_ttl: float = 5,
+        compression: str = 'zlib',
+        compression_level: int | None = None,
+        compress_threshold: int = 0,
+        key_encoding: str = 'text'
+    ):
+        if key_encoding not in self.KEY_ENCODINGS:
+            raise NameError(f'{key_encoding} key encoding not supported')
+
         self.is_connected = False
-        self.backend: Backend
-        parsed_url = urlparse(url)
+        self.url = url
+        # Created when connecting
+        self.backend: Backend | None = None
+        self.codec = get_codec(codec)
+        self.decoder = Decoder(self.codec)
+        self.compressor: Compressor | None = None
+        self.cache: LocalCache | None = None
+        self._invalidation_task: asyncio.Task | None = None
+        self._in_flight: typing.Dict[tuple, asyncio.Future] = {}
+        self.coalesced = 0
+        self.key_encoding = key_encoding
+        self._backend_class = self.get_backend_class(url)
+
+        if cache_size > 0:
+            self.cache = LocalCache(maxsize=cache_size, ttl=cache_ttl)
 
-        if parsed_url.scheme == 'memory':
-            self.backend = MemoryBackend()
-        elif parsed_url.scheme == 'redis':
-            self.backend = RedisBackend(url)
+        if compress_threshold > 0:
+            self.compressor = Compressor(
+                get_compression(compression, compression_level), compress_threshold)
+
+    @staticmethod
+    def get_backend_class(url: str) -> typing.Type[Backend]:
+        scheme = urlparse(url).scheme
+
+        if scheme == 'memory':
+            if MemoryBackend.Options(**dict(parse_qsl(urlparse(url).query))).compact:
+                from app.backends.compact import CompactMemoryBackend
+                return CompactMemoryBackend
+            return MemoryBackend
+        elif scheme == 'redis':
+            return RedisBackend
+        elif scheme.endswith('+sharded'):
+            from app.backends.sharded import ShardedBackend
+            return ShardedBackend
+        elif scheme == 'shm':
+            from app.backends.shm import ShmBackend
+            return ShmBackend
+        elif scheme == 'sqlite':
+            from app.backends.sqlite import SqliteBackend
+            return SqliteBackend
         else:
-            raise NameError(f'{parsed_url.scheme} not supported')
+            raise NameError(f'{scheme} not supported')
 
     async def connect(self) -> None:
         assert not self.is_connected, 'Already connected'
+        if self.key_encoding != 'text' and not self._backend_class.binary_keys:
+            raise ValueError(
+                f'{self.key_encoding} key encoding not supported by '
+                f'{self._backend_class.__name__}')
+
+        self.backend = self._backend_class(self.url)
+        if self.key_encoding == 'migrate':
+            self.backend.migrate_text_keys = True
         await self.backend.connect()
         self.is_connected = True
 
+        if self.cache is not None:
+            self._invalidation_task = asyncio.create_task(self._listen_invalidations())
+
     async def disconnect(self) -> None:
         assert self.is_connected, 'Not connected'
+
+        if self._invalidation_task is not None:
+            self._invalidation_task.cancel()
+            try:
+                await self._invalidation_task
+            except asyncio.CancelledError:
+                pass
+            self._invalidation_task = None
+            self.cache.clear()
+
         await self.backend.disconnect()
         self.is_connected = False
 
+    def is_ready(self) -> bool:
+        """Whether the store can take traffic: connected and not saturated
+        """
+        return self.is_connected and self.backend.is_ready()
+
     async def __aenter__(self):
         await self.connect()
         return self
@@ -157,6 +1141,136 @@ class Store:
     async def __aexit__(self, *args, **kwargs):
         await self.disconnect()
 
+    async def _listen_invalidations(self) -> None:
+        async for message in self.backend.subscribe(self.INVALIDATION_CHANNEL):
+            for key in message.split('\n'):
+                self.cache.invalidate(key)
+
+    async def _coalesce(
+        self,
+        operation: str,
+        key: str,
+        call: typing.Callable[[], typing.Awaitable]
+    ) -> typing.Any:
+        """Await `call()`, or the same call already in flight for this key.
+
+        The shared call is shielded: a cancelled caller doesn't cancel it for the
+        others. Its errors are raised to every caller.
+        """
+        flight = self._in_flight.get((operation, key))
+
+        if flight is None:
+            flight = asyncio.ensure_future(call())
+            self._in_flight[(operation, key)] = flight
+            flight.add_done_callback(
+                functools.partial(self._land, (operation, key)))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(flight)
+
+    def _land(self, flight_key: tuple, flight: asyncio.Future) -> None:
+        if self._in_flight.get(flight_key) is flight:
+            del self._in_flight[flight_key]
+
+        # Retrieve the error, in case every caller was cancelled
+        if not flight.cancelled():
+            flight.exception()
+
+    def _forget_in_flight(self, *keys: str) -> None:
+        # Calls started before a write may return the previous value, later calls
+        # must not join them
+        for key in keys:
+            self._in_flight.pop(('get', key), None)
+            self._in_flight.pop(('exists', key), None)
+
+    async def _invalidate(self, *keys: str) -> None:
+        """Drop keys from the local cache and from the cache of other processes
+        """
+        self._forget_in_flight(*keys)
+
+        if self.cache is None or not keys:
+            return
+
+        for key in keys:
+            self.cache.invalidate(key)
+
+        await self.backend.publish(self.INVALIDATION_CHANNEL, '\n'.join(keys))
+
+    def _cache_value(
+        self,
+        key: str,
+        raw: str,
+        value: typing.Dict[str, typing.Any],
+        since: int
+    ):
+        # Values with an `expires_at` timestamp (sessions) are never cached past it.
+        # Values read before an invalidation of the key are not cached (`since` is the
+        # cache generation before the read)
+        until = value.get('expires_at')
+        if not isinstance(until, (int, float)):
+            until = None
+
+        self.cache.put(key, raw, until=until, since=since)
+
+    async def _get_since(self, key: str) -> typing.Tuple[int | None, str | bytes]:
+        """The cache generation before the read, and the raw value"""
+        since = self.cache.generation if self.cache is not None else None
+        return since, await self._get(key)
+
+    def _dumps(self, value: typing.Dict[str, typing.Any]) -> str | bytes:
+        raw = self.codec.dumps(value)
+        if self.compressor is not None:
+            return self.compressor.compress(raw)
+        return raw
+
+    def _as_json(self, raw: str | bytes) -> str | bytes:
+        # Values written by a binary codec are converted, JSON is passed through
+        raw = self.decoder.decompress(raw)
+        if isinstance(raw, bytes) and raw and raw[0] in self.decoder.tagged:
+            return self.decoder.json.dumps(self.decoder.loads(raw))
+
+        return raw
+
+    def _key(self, key: str) -> str | bytes:
+        """Key in the backend: binary for session keys, unless the key encoding is
+        `text`
+        """
+        if self.key_encoding == 'text' or (uuid := session_uuid(key)) is None:
+            return key
+        return STORE_KEY_BINARY_PREFIX + uuid
+
+    def _falls_back(self, backend_key: str | bytes) -> bool:
+        """Whether the text key is read when the binary key is missing"""
+        return self.key_encoding == 'migrate' and isinstance(backend_key, bytes)
+
+    async def _get(self, key: str) -> str | bytes:
+        backend_key = self._key(key)
+        if not self._falls_back(backend_key):
+            return await self.backend.get(backend_key)
+
+        # Both keys in a single call
+        raw, text_raw = await self.backend.get_many([backend_key, key])
+        return raw or text_raw
+
+    async def _get_many(self, keys: typing.List[str]) -> typing.List[str | bytes]:
+        backend_keys = [self._key(key) for key in keys]
+        text_keys = [
+            key for key, backend_key in zip(keys, backend_keys)
+            if self._falls_back(backend_key)]
+
+        raws = await self.backend.get_many(backend_keys + text_keys)
+        text_raws = dict(zip(text_keys, raws[len(keys):]))
+        return [raw or text_raws.get(key, '') for key, raw in zip(keys, raws)]
+
+    async def _exists(self, key: str) -> bool:
+        backend_key = self._key(key)
+        if not self._falls_back(backend_key):
+            return await self.backend.exists(backend_key)
+
+        # Both keys in a single call
+        return await self.backend.exists(backend_key, key)
+
     async def set_json(
         self,
         key: str,
@@ -165,32 +1279,265 @@ class Store:
         until: int = None
     ) -> None:
         assert self.is_connected, 'Not connected'
-        raw_value = safe_dict_json_dumps(json_value)
-        await self.backend.set(key, raw_value, until=until)
+        raw_value = self._dumps(json_value)
+        backend_key = self._key(key)
+        await self.backend.set(backend_key, raw_value, until=until)
+        await self._invalidate(key)
+
+    async def create_json(
+        self,
+        key: str,
+        json_value: typing.Dict[str, typing.Any],
+        *,
+        until: int = None
+    ) -> bool:
+        """Set the value only if the key doesn't exist yet.
+
+        Returns `False` (leaving the stored value untouched) when the key already exists.
+        """
+        assert self.is_connected, 'Not connected'
+        raw_value = self._dumps(json_value)
+        backend_key = self._key(key)
+        created = await self.backend.create(backend_key, raw_value, until=until)
+        if created:
+            await self._invalidate(key)
+        return created
+
+    async def create_many_json(
+        self,
+        values: typing.Dict[str, typing.Dict[str, typing.Any]],
+        *,
+        until: int = None
+    ) -> typing.List[bool]:
+        """`create_json` of several keys with a single backend call, whether each key
+        was created
+        """
+        assert self.is_connected, 'Not connected'
+        created = await self.backend.create_many(
+            {self._key(key): self._dumps(value) for key, value in values.items()},
+            until=until)
+        await self._invalidate(*(key for key, ok in zip(values, created) if ok))
+        return created
 
     async def get_json(
         self,
         key: str
     ) -> typing.Dict[str, typing.Any]:
         assert self.is_connected, 'Not connected'
-        raw = await self.backend.get(key)
-        return safe_dict_json_loads(raw)
+
+        if self.cache is not None:
+            raw = self.cache.get(key)
+            if raw is not None:
+                return self.decoder.loads(raw)
+
+        since, raw = await self._coalesce('get', key, lambda: self._get_since(key))
+        value = self.decoder.loads(raw)
+
+        if self.cache is not None and raw:
+            self._cache_value(key, raw, value, since)
+
+        return value
+
+    async def get_json_raw(self, key: str) -> str | bytes:
+        """Get the value as JSON text, passing it through untouched when it was
+        stored as JSON. Values stored by a binary codec are converted.
+
+        Returns `''` when the key doesn't exist.
+        """
+        assert self.is_connected, 'Not connected'
+        raw = self.cache.get(key) if self.cache is not None else None
+
+        if raw is None:
+            since, raw = await self._coalesce('get', key, lambda: self._get_since(key))
+            if self.cache is not None and raw:
+                self._cache_value(key, raw, self.decoder.loads(raw), since)
+
+        return self._as_json(raw)
+
+    async def get_many_json(
+        self,
+        keys: typing.List[str]
+    ) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        """Get several values with a single backend call.
+
+        Keys that don't exist are left out of the result.
+        """
+        assert self.is_connected, 'Not connected'
+        raws = {}
+
+        if self.cache is not None:
+            for key in keys:
+                raw = self.cache.get(key)
+                if raw is not None:
+                    raws[key] = raw
+
+        missing = [key for key in keys if key not in raws]
+        values = {key: self.decoder.loads(raw) for key, raw in raws.items()}
+
+        since = self.cache.generation if self.cache is not None else None
+        for key, raw in zip(missing, await self._get_many(missing)):
+            if raw:
+                values[key] = self.decoder.loads(raw)
+                if self.cache is not None:
+                    self._cache_value(key, raw, values[key], since)
+
+        return {key: values[key] for key in keys if key in values}
+
+    async def set_many_json(
+        self,
+        values: typing.Dict[str, typing.Dict[str, typing.Any]],
+        *,
+        until: int = None
+    ) -> None:
+        assert self.is_connected, 'Not connected'
+        await self.backend.set_many(
+            {self._key(key): self._dumps(value) for key, value in values.items()},
+            until=until)
+        await self._invalidate(*values)
+
+    async def expire_many(self, expiries: typing.Dict[str, int]) -> None:
+        """Change the expiry timestamp of several keys, missing keys are ignored
+        """
+        assert self.is_connected, 'Not connected'
+        await self.backend.expire_many(
+            {self._key(key): until for key, until in expiries.items()})
+
+    async def get_many_json_raw(self, keys: typing.List[str]) -> typing.List[str | bytes]:
+        """Get several values as JSON text (see `get_json_raw`), `''` for missing keys.
+
+        Meant for bulk reads: the local cache is neither used nor filled.
+        """
+        assert self.is_connected, 'Not connected'
+        return [self._as_json(raw) for raw in await self._get_many(keys)]
 
     async def keys(self, pattern: str = '*') -> typing.List[str]:
         assert self.is_connected, 'Not connected'
-        return await self.backend.keys(pattern)
+        if self.key_encoding == 'text':
+            # Binary keys written by other processes are skipped
+            keys = await self.backend.keys(pattern)
+            return [key for key in keys if isinstance(key, str)]
+        return [key async for key in self.iter_keys(pattern)]
+
+    async def iter_keys(
+        self,
+        pattern: str = '*',
+        *,
+        count: int = 100
+    ) -> typing.AsyncIterator[str]:
+        """Iterate over the keys matching a glob pattern, without blocking the backend.
+
+        `count` is a hint of how many keys are fetched on each backend call. Keys
+        changed while iterating may or may not be returned.
+        """
+        assert self.is_connected, 'Not connected'
+        if self.key_encoding == 'text':
+            async for key in self.backend.iter_keys(pattern, count=count):
+                if isinstance(key, str):
+                    yield key
+            return
+
+        match = re.compile(fnmatch.translate(pattern)).match
+        prefix = STORE_KEY_BINARY_PREFIX
+        async for key in self.backend.iter_keys(prefix + b'*', count=count):
+            if len(key) == len(prefix) + 16 and match(
+                    name := session_key(key[len(prefix):])):
+                yield name
+
+        # The other keys, and with the `migrate` key encoding the session keys not
+        # converted yet (unless written again meanwhile): their binary keys are
+        # checked in batches of `count`
+        text_keys = []
+        async for key in self.backend.iter_keys(pattern, count=count):
+            if isinstance(key, bytes):
+                continue
+            if not isinstance(self._key(key), bytes):
+                yield key
+            elif self.key_encoding == 'migrate':
+                text_keys.append(key)
+                if len(text_keys) >= count:
+                    for text_key in await self._not_migrated(text_keys):
+                        yield text_key
+                    text_keys = []
+
+        for text_key in await self._not_migrated(text_keys):
+            yield text_key
+
+    async def _not_migrated(self, keys: typing.List[str]) -> typing.List[str]:
+        """The text session keys without a binary key"""
+        if not keys:
+            return []
+        exists = await self.backend.exists_many([self._key(key) for key in keys])
+        return [key for key, binary in zip(keys, exists) if not binary]
+
+    async def migrate_keys(self, *, count: int = 100) -> int:
+        """Rename the text session keys to binary keys, with the `migrate` key
+        encoding: the keys of each SCAN batch (`count` keys) are renamed in a single
+        pipeline. Returns the number of keys renamed.
+
+        Text keys are no longer written once every process uses the `migrate` key
+        encoding: after a migration, the `binary` key encoding can be used.
+        """
+        assert self.is_connected, 'Not connected'
+        assert self.key_encoding == 'migrate', 'Not using the migrate key encoding'
+        migrated = 0
+        renames = {}
+
+        async for key in self.backend.iter_keys(
+            STORE_KEY.format(session_id='*'), count=count
+        ):
+            if isinstance(key, str) and isinstance(backend_key := self._key(key), bytes):
+                renames[key] = backend_key
+            if len(renames) >= count:
+                migrated += await self.backend.rename_many(renames)
+                renames = {}
+
+        return migrated + await self.backend.rename_many(renames)
 
     async def exists(self, key: str) -> bool:
         assert self.is_connected, 'Not connected'
-        return await self.backend.exists(key)
+
+        if self.cache is not None and self.cache.get(key) is not None:
+            return True
+
+        return await self._coalesce('exists', key, lambda: self._exists(key))
 
     async def get_collection_json(
         self,
         key: str
     ) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
         assert self.is_connected, 'Not connected'
-        coll = await self.backend.get_collection(key)
-        return {item: safe_dict_json_loads(val) for item, val in coll.items()}
+        backend_key = self._key(key)
+        if not self._falls_back(backend_key):
+            coll = await self.backend.get_collection(backend_key)
+        else:
+            coll, text_coll = await asyncio.gather(
+                self.backend.get_collection(backend_key),
+                self.backend.get_collection(key))
+            coll = coll or text_coll
+        return {item: self.decoder.loads(val) for item, val in coll.items()}
+
+    async def get_collections_json(
+        self,
+        keys: typing.List[str]
+    ) -> typing.List[typing.Dict[str, typing.Dict[str, typing.Any]]]:
+        """Get several collections with a single backend call, empty for missing
+        keys
+        """
+        assert self.is_connected, 'Not connected'
+        backend_keys = [self._key(key) for key in keys]
+        text_keys = [
+            key for key, backend_key in zip(keys, backend_keys)
+            if self._falls_back(backend_key)]
+
+        colls = await self.backend.get_collections(backend_keys + text_keys)
+        text_colls = dict(zip(text_keys, colls[len(keys):]))
+        return [
+            {
+                item: self.decoder.loads(val)
+                for item, val in (coll or text_colls.get(key, {})).items()
+            }
+            for key, coll in zip(keys, colls)
+        ]
 
     async def get_item_json(
         self,
@@ -198,8 +1545,11 @@ class Store:
         item: str
     ) -> typing.Dict[str, typing.Any]:
         assert self.is_connected, 'Not connected'
-        raw = await self.backend.get_item(key, item)
-        return safe_dict_json_loads(raw)
+        backend_key = self._key(key)
+        if self._falls_back(backend_key) and not await self.backend.exists(backend_key):
+            backend_key = key
+        raw = await self.backend.get_item(backend_key, item)
+        return self.decoder.loads(raw)
 
     async def set_item_json(
         self,
@@ -208,7 +1558,53 @@ class Store:
         value: typing.Dict[str, typing.Any]
     ) -> None:
         assert self.is_connected, 'Not connected'
-        await self.backend.set_item(key, item, safe_dict_json_dumps(value))
+        backend_key = self._key(key)
+        await self.backend.set_item(backend_key, item, self._dumps(value))
+        await self._invalidate(key)
+
+    async def set_items_json(
+        self,
+        key: str,
+        values: typing.Dict[str, typing.Dict[str, typing.Any]],
+        *,
+        until: int = None
+    ) -> None:
+        """Set several items of a collection at once. The expiry of the collection
+        is kept, unless `until` is set.
+        """
+        assert self.is_connected, 'Not connected'
+        backend_key = self._key(key)
+        await self.backend.set_items(
+            backend_key, {item: self._dumps(value) for item, value in values.items()},
+            until=until)
+        await self._invalidate(key)
+
+    async def create_items_json(
+        self,
+        key: str,
+        values: typing.Dict[str, typing.Dict[str, typing.Any]],
+        *,
+        until: int = None
+    ) -> bool:
+        """Create a collection only if the key doesn't exist yet (atomically).
+
+        Returns `False` (leaving the stored collection untouched) when the key
+        already exists.
+        """
+        assert self.is_connected, 'Not connected'
+        backend_key = self._key(key)
+        created = await self.backend.create_items(
+            backend_key, {item: self._dumps(value) for item, value in values.items()},
+            until=until)
+        if created:
+            await self._invalidate(key)
+        return created
+
+    async def delete_items(self, key: str, items: typing.List[str]) -> None:
+        assert self.is_connected, 'Not connected'
+        backend_key = self._key(key)
+        await self.backend.delete_items(backend_key, items)
+        await self._invalidate(key)
 
 
-store = Store(settings.redis.url)
+store = Store(settings.store_url, **settings.store.kwargs)
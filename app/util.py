@@ -101,3 +101,27 @@ def safe_dict_json_dumps(data):
             pass
 
     return '{}'
+
+
+def json_merge_patch(target, patch):
+    """Apply a JSON merge patch (RFC 7386): objects are merged recursively, `None`
+    removes a key and any other value replaces the target. `target` is not modified
+
+        >>> json_merge_patch({'a': 1, 'b': {'c': 2, 'd': 3}}, {'a': None, 'b': {'c': 4}})
+        {'b': {'c': 4, 'd': 3}}
+        >>> json_merge_patch({'a': [1, 2]}, {'a': [3]})
+        {'a': [3]}
+        >>> json_merge_patch('text', {'a': 1})
+        {'a': 1}
+    """
+    if not isinstance(patch, dict):
+        return patch
+
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = json_merge_patch(result.get(key), value)
+
+    return result
@@ -0,0 +1,83 @@
+"""Minimal in-process ASGI client, keeps the client overhead out of the measures"""
+import asyncio
+import time
+import typing
+
+
+async def call(
+    app,
+    method: str,
+    path: str,
+    body: bytes = b''
+) -> typing.Tuple[int, bytes]:
+    """Send one HTTP request to an ASGI app, returns the status and body"""
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [
+            (b'host', b'benchmark'),
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ],
+        'client': ('127.0.0.1', 50000),
+        'server': ('benchmark', 80),
+    }
+    request_sent = False
+    status = 0
+    chunks = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # Waiting for the client to disconnect
+        await asyncio.Future()
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+        elif message['type'] == 'http.response.body':
+            chunks.append(message.get('body', b''))
+
+    await app(scope, receive, send)
+
+    return status, b''.join(chunks)
+
+
+async def throughput(
+    app,
+    make_request: typing.Callable[[int], typing.Tuple[str, str, bytes]],
+    *,
+    requests: int,
+    concurrency: int
+) -> typing.Tuple[float, typing.List[float]]:
+    """Run `requests` requests, `concurrency` at a time
+
+    `make_request(i)` returns the method, path and body of the i-th request.
+    Returns the requests per second and the latency (seconds) of each request.
+    """
+    latencies = []
+    counter = iter(range(requests))
+
+    async def worker():
+        for i in counter:
+            method, path, body = make_request(i)
+            start = time.perf_counter()
+            await call(app, method, path, body)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    return requests / elapsed, latencies
@@ -0,0 +1,77 @@
+"""Redis backend throughput with and without auto-pipelining, for concurrent gets
+and sets of session sized values
+
+    python -m benchmarks.autopipeline [--url redis://localhost:6379] [--operations N]
+        [--concurrency N]
+"""
+import asyncio
+import sys
+import time
+
+from app.store import RedisBackend
+
+
+VARIANTS = {
+    'pool': '',
+    'autopipeline': '&autopipeline=True',
+    'window 0.5ms': '&autopipeline=True&autopipeline_window=0.0005',
+}
+
+
+async def measure(backend, operation, operations, concurrency):
+    """Operations per second and p50 latency, `concurrency` clients at a time"""
+    latencies = []
+    counter = iter(range(operations))
+
+    async def client():
+        for i in counter:
+            start = time.perf_counter()
+            await operation(i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return operations / elapsed, sorted(latencies)[len(latencies) // 2]
+
+
+async def run(url, operations, concurrency):
+    value = '{"id": "579e9e7c-f8cb-4a3f-9c22-03b83c469052", "data": {"x": 1}}'
+    until = int(time.time()) + 600
+
+    print(f'{"operation":<10} {"variant":<14} {"op/s":>8} {"p50 us":>8}')
+    print('=' * 43)
+
+    for name, query in VARIANTS.items():
+        backend = RedisBackend(f'{url}?db=9{query}')
+        await backend.connect()
+        try:
+            operations_ = {
+                'set': lambda i: backend.set(f'bench.{i % 1000}', value, until=until),
+                'get': lambda i: backend.get(f'bench.{i % 1000}'),
+            }
+            for operation_name, operation in operations_.items():
+                # Warm up
+                await measure(backend, operation, 500, concurrency)
+                rate, p50 = await measure(backend, operation, operations, concurrency)
+
+                print(f'{operation_name:<10} {name:<14} {rate:>8.0f} {p50 * 1e6:>8.0f}')
+        finally:
+            await backend._connection.flushdb()
+            await backend.disconnect()
+        print('')
+
+
+if __name__ == '__main__':
+    url = 'redis://localhost:6379'
+    operations = 20000
+    concurrency = 50
+    if '--url' in sys.argv:
+        url = sys.argv[sys.argv.index('--url') + 1]
+    if '--operations' in sys.argv:
+        operations = int(sys.argv[sys.argv.index('--operations') + 1])
+    if '--concurrency' in sys.argv:
+        concurrency = int(sys.argv[sys.argv.index('--concurrency') + 1])
+
+    asyncio.run(run(url, operations, concurrency))
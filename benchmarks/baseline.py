@@ -0,0 +1,82 @@
+"""Baselines of benchmark results, to detect regressions
+
+Results are `{name: seconds}`. A result regresses when it is slower than its
+baseline by more than its threshold: the ratio of the first `pattern=ratio`
+threshold whose glob pattern matches the name, or the default ratio.
+
+    >>> thresholds = parse_thresholds(['0.1', 'store.redis.*=0.5'])
+    >>> compare({'a': 1.2, 'store.redis.get': 1.2}, {'a': 1, 'store.redis.get': 1},
+    ...         thresholds)
+    ['a: 1200.0ms (baseline 1000.0ms, +20%, threshold +10%)']
+"""
+import fnmatch
+import json
+import sys
+import typing
+
+
+DEFAULT_THRESHOLD = 0.25
+
+
+def parse_thresholds(values: typing.List[str]) -> typing.List[typing.Tuple[str, float]]:
+    """`ratio` values set the default, `pattern=ratio` values a specific one"""
+    thresholds = []
+    default = DEFAULT_THRESHOLD
+
+    for value in values:
+        pattern, _, ratio = value.rpartition('=')
+        if pattern:
+            thresholds.append((pattern, float(ratio)))
+        else:
+            default = float(ratio)
+
+    return thresholds + [('*', default)]
+
+
+def threshold_options() -> typing.List[str]:
+    """Values of every `--threshold` option"""
+    return [
+        sys.argv[i + 1] for i, arg in enumerate(sys.argv[:-1]) if arg == '--threshold']
+
+
+def compare(
+    results: typing.Dict[str, float],
+    baseline: typing.Dict[str, float],
+    thresholds: typing.List[typing.Tuple[str, float]]
+) -> typing.List[str]:
+    """Regressions found, as messages"""
+    errors = []
+
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+
+        threshold = next(
+            ratio for pattern, ratio in thresholds if fnmatch.fnmatch(name, pattern))
+        change = seconds / baseline[name] - 1
+        if change > threshold:
+            errors.append(
+                f'{name}: {duration(seconds)} (baseline {duration(baseline[name])}, '
+                f'{change:+.0%}, threshold +{threshold:.0%})')
+
+    return errors
+
+
+def duration(seconds: float) -> str:
+    """
+        >>> duration(0.0123), duration(0.0000123)
+        ('12.3ms', '12.3us')
+    """
+    if seconds < 0.001:
+        return f'{seconds * 1e6:.1f}us'
+    return f'{seconds * 1000:.1f}ms'
+
+
+def save(path: str, results: typing.Dict[str, float]) -> None:
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path: str) -> typing.Dict[str, float]:
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,66 @@
+"""Compare the store codecs: encode and decode time, and stored bytes
+
+    python -m benchmarks.codec [--number N]
+"""
+import sys
+import timeit
+
+from app.codec import AVAILABLE, Decoder, get_codec
+
+
+def make_payload(fields: int):
+    """Session like dict with `fields` entries in `data`"""
+    return {
+        'id': '579e9e7c-f8cb-4a3f-9c22-03b83c469052',
+        'created_at': 1650000000,
+        'expires_at': 1650086400,
+        'data': {
+            f'field_{i}': {
+                'name': f'value {i}',
+                'count': i,
+                'ratio': i / 7,
+                'enabled': i % 2 == 0,
+                'tags': ['a', 'b', 'c'],
+            }
+            for i in range(fields)
+        },
+    }
+
+
+PAYLOADS = {
+    'small': make_payload(2),
+    'medium': make_payload(20),
+    'large': make_payload(400),
+}
+
+
+def best_time(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def run(number=1000):
+    codecs = [get_codec(name) for name, available in AVAILABLE.items() if available]
+
+    print(f'{"payload":<8} {"codec":<8} {"bytes":>8} {"encode us":>10} {"decode us":>10}')
+    print('=' * 48)
+
+    for payload_name, payload in PAYLOADS.items():
+        for codec in codecs:
+            decoder = Decoder(codec)
+            raw = codec.dumps(payload)
+            size = len(raw.encode() if isinstance(raw, str) else raw)
+            encode = best_time(lambda: codec.dumps(payload), number)
+            decode = best_time(lambda: decoder.loads(raw), number)
+
+            print(
+                f'{payload_name:<8} {codec.name:<8} {size:>8} '
+                f'{encode * 1e6:>10.2f} {decode * 1e6:>10.2f}')
+        print('')
+
+
+if __name__ == '__main__':
+    number = 1000
+    if '--number' in sys.argv:
+        number = int(sys.argv[sys.argv.index('--number') + 1])
+
+    run(number)
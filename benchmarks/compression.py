@@ -0,0 +1,53 @@
+"""Compare the store compressions: compression ratio, and compress and decompress
+time, for each payload written by the json codec
+
+    python -m benchmarks.compression [--number N]
+"""
+import sys
+
+from app.codec import AVAILABLE_COMPRESSIONS, get_codec, get_compression
+from benchmarks.codec import PAYLOADS, best_time
+
+
+LEVELS = {
+    'zlib': [1, 6, 9],
+    'lz4': [None, 9],
+}
+
+
+def run(number=200):
+    codec = get_codec('json')
+    compressions = [
+        get_compression(name, level)
+        for name, available in AVAILABLE_COMPRESSIONS.items() if available
+        for level in LEVELS[name]
+    ]
+
+    print(
+        f'{"payload":<8} {"compression":<12} {"bytes":>8} {"ratio":>6} '
+        f'{"compress us":>12} {"decompress us":>14}')
+    print('=' * 65)
+
+    for payload_name, payload in PAYLOADS.items():
+        raw = codec.dumps(payload).encode()
+        print(f'{payload_name:<8} {"none":<12} {len(raw):>8} {1:>6.2f}')
+
+        for compression in compressions:
+            name = f'{compression.name} {compression.level or "default"}'
+            compressed = compression.compress(raw)
+            compress = best_time(lambda: compression.compress(raw), number)
+            decompress = best_time(lambda: compression.decompress(compressed), number)
+
+            print(
+                f'{payload_name:<8} {name:<12} {len(compressed):>8} '
+                f'{len(raw) / len(compressed):>6.2f} '
+                f'{compress * 1e6:>12.2f} {decompress * 1e6:>14.2f}')
+        print('')
+
+
+if __name__ == '__main__':
+    number = 200
+    if '--number' in sys.argv:
+        number = int(sys.argv[sys.argv.index('--number') + 1])
+
+    run(number)
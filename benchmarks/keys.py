@@ -0,0 +1,143 @@
+"""Redis memory and read latency of the text and binary session keys, and the
+throughput of the key migration (`Store.migrate_keys`)
+
+    python -m benchmarks.keys [--url redis://localhost:6379] [--keys N]
+
+The memory is measured with INFO and MEMORY USAGE, when the server supports them.
+"""
+import asyncio
+import sys
+import time
+import uuid
+
+import aioredis
+from aioredis.errors import ConnectionClosedError, ReplyError
+
+from app.constants import STORE_KEY
+from app.store import Store
+
+
+async def probe(url, *command):
+    """Runs a command on its own connection: `None` if the server doesn't support
+    it (some servers close the connection on unknown commands)"""
+    connection = await aioredis.create_redis(url)
+    try:
+        return await connection.execute(*command)
+    except (ReplyError, ConnectionClosedError):
+        return None
+    finally:
+        connection.close()
+        await connection.wait_closed()
+
+
+async def used_memory(url):
+    """The `used_memory` of the server, `None` if INFO is not supported"""
+    info = await probe(url, 'INFO', 'memory')
+    for line in (info or b'').decode().splitlines():
+        if line.startswith('used_memory:'):
+            return int(line.split(':')[1])
+    return None
+
+
+async def memory_usage(url, keys):
+    """Average MEMORY USAGE of some keys, `None` if not supported"""
+    usages = []
+    for key in keys[:100]:
+        usage = await probe(url, 'MEMORY', 'USAGE', key)
+        if usage is None:
+            return None
+        usages.append(usage)
+    return sum(usages) / len(usages)
+
+
+async def fill(store, names, value, until):
+    for i in range(0, len(names), 1000):
+        await store.set_many_json(
+            {name: value for name in names[i:i + 1000]}, until=until)
+
+
+async def measure(url, encoding, names, value, until):
+    async with Store(url, key_encoding=encoding) as store:
+        connection = store.backend._connection
+        await connection.flushdb()
+        before = await used_memory(url)
+        await fill(store, names, value, until)
+        after = await used_memory(url)
+
+        backend_keys = [
+            key async for key in store.backend.iter_keys(count=1000)][:1000]
+        result = {
+            'key bytes': sum(
+                len(key.encode() if isinstance(key, str) else key)
+                for key in backend_keys) / len(backend_keys),
+            'used': None if before is None else (after - before) / len(names),
+            'usage': await memory_usage(url, backend_keys),
+        }
+
+        start = time.perf_counter()
+        for name in names[:10000]:
+            await store.get_json(name)
+        result['get'] = (time.perf_counter() - start) / min(len(names), 10000)
+
+        await connection.flushdb()
+    return result
+
+
+async def migrate(url, names, value, until):
+    """Keys renamed per second by `migrate_keys`"""
+    async with Store(url) as store:
+        await store.backend._connection.flushdb()
+        await fill(store, names, value, until)
+
+    async with Store(url, key_encoding='migrate') as store:
+        start = time.perf_counter()
+        migrated = await store.migrate_keys(count=1000)
+        elapsed = time.perf_counter() - start
+        await store.backend._connection.flushdb()
+    return migrated / elapsed
+
+
+async def run(url, keys):
+    url = f'{url}?db=9'
+    value = {'id': str(uuid.uuid4()), 'data': {'x': 1}}
+    until = int(time.time()) + 600
+    names = [STORE_KEY.format(session_id=uuid.uuid4()) for _ in range(keys)]
+
+    def show(figure, format_):
+        return 'n/a' if figure is None else format(figure, format_)
+
+    print(f'{keys} sessions\n')
+    print(f'{"keys":<8} {"key B":>6} {"used B/key":>11} {"usage B":>8} {"get us":>7}')
+    print('=' * 44)
+    for encoding in ('text', 'binary'):
+        result = await measure(url, encoding, names, value, until)
+        print(
+            f'{encoding:<8} {result["key bytes"]:>6.0f} '
+            f'{show(result["used"], ".0f"):>11} {show(result["usage"], ".0f"):>8} '
+            f'{result["get"] * 1e6:>7.0f}')
+
+    # Reads of the migrate key encoding, before and after the key is renamed (a
+    # write renames it)
+    async with Store(url) as store:
+        await store.set_json(names[0], value, until=until)
+    async with Store(url, key_encoding='migrate') as store:
+        for label in ('migrate, text key', 'migrate, binary key'):
+            start = time.perf_counter()
+            for _ in range(1000):
+                await store.get_json(names[0])
+            print(f'{label:<20} {(time.perf_counter() - start) * 1e3:>23.0f}')
+            await store.set_json(names[0], value, until=until)
+        await store.backend._connection.flushdb()
+
+    print(f'\nmigration: {await migrate(url, names, value, until):.0f} keys/s')
+
+
+if __name__ == '__main__':
+    url = 'redis://localhost:6379'
+    keys = 100000
+    if '--url' in sys.argv:
+        url = sys.argv[sys.argv.index('--url') + 1]
+    if '--keys' in sys.argv:
+        keys = int(sys.argv[sys.argv.index('--keys') + 1])
+
+    asyncio.run(run(url, keys))
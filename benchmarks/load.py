@@ -0,0 +1,234 @@
+"""HTTP load benchmark of the sessions API: drives the ASGI app (with its real
+startup and shutdown) in process, against each store
+
+    python -m benchmarks.load [--stores memory,shm,sqlite,redis]
+        [--redis-url URL | --fake-redis]
+        [--scenarios get_hit,get_miss,post,batch,mix] [--mix get_hit=70,post=10,...]
+        [--requests N] [--concurrency N] [--allocations N] [--output PATH]
+        [--compare PATH]
+
+Reports requests per second, latency percentiles and, in a separate pass with
+`tracemalloc` (one request at a time), the peak memory allocated per request and
+the memory retained after the requests. `--fake-redis` runs fakeredis as the redis
+server (must be installed). Results are saved as JSON (`benchmarks/results` by
+default), `--compare` prints the change from a previous result file.
+"""
+import asyncio
+import datetime
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import tracemalloc
+import uuid
+
+from app.app import app
+from app.constants import STORE_KEY
+from app.store import store
+from benchmarks.asgi import call, throughput
+
+
+SEEDED_SESSIONS = 1000
+BATCH_SIZE = 10
+DEFAULT_MIX = {'get_hit': 70, 'get_miss': 10, 'post': 10, 'batch': 10}
+
+
+class Scenarios:
+    """Requests of each scenario, as `(method, path, body)`"""
+
+    def __init__(self, session_ids, mix, seed=0):
+        self.session_ids = session_ids
+        self.mix = mix
+        self.random = random.Random(seed)
+
+    def get_hit(self, i):
+        return 'GET', f'/sessions/{self.session_ids[i % len(self.session_ids)]}', b''
+
+    def get_miss(self, i):
+        id = uuid.UUID(int=self.random.getrandbits(128), version=4)
+        return 'GET', f'/sessions/{id}', b''
+
+    def post(self, i):
+        body = {'id': str(uuid.uuid4()), 'data': {'user': i, 'tags': ['a', 'b']}}
+        return 'POST', '/sessions/', json.dumps(body).encode()
+
+    def batch(self, i):
+        ids = self.random.sample(self.session_ids, BATCH_SIZE // 2) + [
+            str(uuid.uuid4()) for _ in range(BATCH_SIZE // 2)]
+        return 'GET', '/sessions/?' + '&'.join(f'ids={id}' for id in ids), b''
+
+    def mix_(self, i):
+        scenario = self.random.choices(list(self.mix), weights=self.mix.values())[0]
+        return getattr(self, scenario)(i)
+
+    def get(self, name):
+        return self.mix_ if name == 'mix' else getattr(self, name)
+
+
+def percentile(latencies, ratio):
+    return sorted(latencies)[min(len(latencies) - 1, int(len(latencies) * ratio))]
+
+
+async def measure_allocations(make_request, requests):
+    """Peak bytes allocated per request (average) and bytes retained per request"""
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        peaks = []
+        for i in range(requests):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await call(app, *make_request(i))
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+        end, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return statistics.mean(peaks), (end - start) / requests
+
+
+async def run_store(url, scenarios, mix, *, requests, concurrency, allocations):
+    store.url = url
+    store._backend_class = store.get_backend_class(url)
+    await app.router.startup()
+    results = []
+
+    try:
+        session_ids = [str(uuid.uuid4()) for _ in range(SEEDED_SESSIONS)]
+        await store.set_many_json({
+            STORE_KEY.format(session_id=id): {
+                'id': id, 'data': {'user': i}, 'created_at': 1, 'expires_at': 2}
+            for i, id in enumerate(session_ids)
+        })
+
+        for name in scenarios:
+            make_request = Scenarios(session_ids, mix).get(name)
+            # Warm up
+            await throughput(app, make_request, requests=200, concurrency=concurrency)
+
+            rps, latencies = await throughput(
+                app, make_request, requests=requests, concurrency=concurrency)
+            peak, retained = await measure_allocations(
+                Scenarios(session_ids, mix, seed=1).get(name), allocations)
+
+            results.append({
+                'store': url.split(':')[0],
+                'scenario': name,
+                'requests': requests,
+                'concurrency': concurrency,
+                'rps': rps,
+                'p50_ms': percentile(latencies, .5) * 1000,
+                'p95_ms': percentile(latencies, .95) * 1000,
+                'p99_ms': percentile(latencies, .99) * 1000,
+                'alloc_peak_kib': peak / 1024,
+                'retained_b': retained,
+            })
+            print_result(results[-1])
+    finally:
+        if url.startswith('redis'):
+            await store.backend._connection.flushdb()
+        await app.router.shutdown()
+
+    return results
+
+
+def print_header():
+    print(
+        f'{"store":<8} {"scenario":<10} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} '
+        f'{"p99 ms":>8} {"peak KiB":>9} {"kept B":>8}')
+    print('=' * 76)
+
+
+def print_result(result, previous=None):
+    line = (
+        f'{result["store"]:<8} {result["scenario"]:<10} {result["rps"]:>8.0f} '
+        f'{result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+        f'{result["alloc_peak_kib"]:>9.1f} {result["retained_b"]:>8.0f}')
+    if previous:
+        line += f'   req/s {(result["rps"] / previous["rps"] - 1) * 100:+.1f}%'
+        line += f', p99 {(result["p99_ms"] / previous["p99_ms"] - 1) * 100:+.1f}%'
+    print(line)
+
+
+def start_fake_redis():
+    """fakeredis server in a thread, returns its url"""
+    from fakeredis import TcpFakeServer
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'redis://127.0.0.1:{port}'
+
+
+def option(name, default):
+    if name in sys.argv:
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+
+async def main():
+    stores = option('--stores', 'memory').split(',')
+    scenarios = option('--scenarios', 'get_hit,get_miss,post,batch,mix').split(',')
+    mix = DEFAULT_MIX
+    if '--mix' in sys.argv:
+        mix = {
+            name: int(weight) for name, weight in
+            (item.split('=') for item in option('--mix', '').split(','))
+        }
+    requests = int(option('--requests', 5000))
+    concurrency = int(option('--concurrency', 20))
+    allocations = int(option('--allocations', 100))
+
+    redis_url = option('--redis-url', 'redis://localhost:6379')
+    if '--fake-redis' in sys.argv:
+        redis_url = start_fake_redis()
+
+    directory = tempfile.mkdtemp()
+    urls = {
+        'memory': 'memory://',
+        'shm': f'shm://{directory}/load.shm',
+        'sqlite': f'sqlite://{directory}/load.db',
+        'redis': f'{redis_url}?db=9&encoding=utf-8&maxsize={concurrency}',
+    }
+
+    print_header()
+    results = []
+    try:
+        for name in stores:
+            results += await run_store(
+                urls[name], scenarios, mix, requests=requests, concurrency=concurrency,
+                allocations=allocations)
+    finally:
+        shutil.rmtree(directory)
+
+    output = option('--output', None)
+    if output is None:
+        os.makedirs('benchmarks/results', exist_ok=True)
+        now = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = f'benchmarks/results/load-{now}.json'
+    with open(output, 'w') as f:
+        json.dump({'mix': mix, 'results': results}, f, indent=2)
+    print(f'\nResults saved to {output}')
+
+    if '--compare' in sys.argv:
+        with open(option('--compare', None)) as f:
+            previous = {
+                (r['store'], r['scenario']): r for r in json.load(f)['results']}
+
+        print('\nCompared with', option('--compare', None))
+        print_header()
+        for result in results:
+            print_result(result, previous.get((result['store'], result['scenario'])))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""Memory used per session by the memory store, with the default and the compact
+layouts: measured by tracemalloc, and reported by the backend `memory()`. Also times
+the writes and reads
+
+    python -m benchmarks.memory [--keys N]
+"""
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+import uuid
+
+from app.constants import STORE_KEY
+from app.store import Store
+from benchmarks.codec import PAYLOADS
+
+URLS = {'default': 'memory://', 'compact': 'memory://?compact=true'}
+
+
+async def fill(backend, names, values, until):
+    start = time.perf_counter()
+    for name, value in zip(names, values):
+        await backend.set(name, value, until=until)
+    return time.perf_counter() - start
+
+
+async def measure(url, keys, raw):
+    until = int(time.time()) + 3600
+    names = [STORE_KEY.format(session_id=uuid.uuid4()) for _ in range(keys)]
+    values = [raw.replace('"id": 1', f'"id": {i}') for i in range(keys)]
+    result = {}
+
+    async with Store(url) as store:
+        tracemalloc.start()
+        await fill(store.backend, names, values, until)
+        traced = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        result['memory'] = store.backend.memory()
+
+    # The default layout keeps the key and value objects created above
+    if url == URLS['default']:
+        traced += sum(map(sys.getsizeof, names)) + sum(map(sys.getsizeof, values))
+    result['traced'] = traced
+
+    # Timed without tracemalloc
+    async with Store(url) as store:
+        result['write'] = await fill(store.backend, names, values, until)
+        start = time.perf_counter()
+        for name in names:
+            await store.backend.get(name)
+        result['read'] = time.perf_counter() - start
+
+    return result
+
+
+async def run(keys):
+    raw = json.dumps(PAYLOADS['small'])
+
+    print(f'{keys} sessions of {len(raw)} bytes\n')
+    print(f'{"layout":<8} {"B/key":>7} {"bytes":>7} {"overhead":>9} '
+          f'{"set us":>7} {"get us":>7}')
+    print('=' * 51)
+    for name, url in URLS.items():
+        result = await measure(url, keys, raw)
+        memory = result['memory']
+        print(
+            f'{name:<8} {result["traced"] / keys:>7.0f} {memory["bytes"] / keys:>7.0f} '
+            f'{memory["overhead"] / keys:>9.0f} {result["write"] / keys * 1e6:>7.2f} '
+            f'{result["read"] / keys * 1e6:>7.2f}')
+
+
+if __name__ == '__main__':
+    keys = 100000
+    if '--keys' in sys.argv:
+        keys = int(sys.argv[sys.argv.index('--keys') + 1])
+
+    asyncio.run(run(keys))
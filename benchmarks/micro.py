@@ -0,0 +1,158 @@
+"""Micro-benchmarks of the hot paths: JSON helpers, store reads and writes, and the
+validation of the session schemas
+
+    python -m benchmarks.micro [--number N] [--stores memory,shm,sqlite,redis]
+        [--url redis://localhost:6379] [--only PATTERN] [--save PATH]
+        [--check PATH] [--threshold RATIO] [--threshold PATTERN=RATIO ...]
+
+Times are the best per call time of 5 repeats of `number` calls. The redis store
+uses db 9 of the `--url` server. `--only` runs the benchmarks matching a glob
+pattern (e.g. `'schema.*'`).
+
+`--save` writes the results as a baseline, `--check` compares the results with a
+baseline and exits with an error when a benchmark is slower than its threshold:
+`--threshold 0.1` sets the default (0.25), `--threshold 'store.redis.*=0.5'` the
+one of the matching benchmarks (the first matching pattern is used).
+"""
+import asyncio
+import datetime
+import fnmatch
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+from app.api.schemas.base import Timestamp
+from app.api.schemas.session import Session, SessionBody
+from app.store import Store
+from app.util import safe_dict_json_dumps, safe_dict_json_loads
+from benchmarks import baseline
+from benchmarks.codec import PAYLOADS, best_time
+
+
+SESSION_ID = '579e9e7c-f8cb-4a3f-9c22-03b83c469052'
+# Seconds before the keys written expire
+KEY_TTL = 60
+NOW = datetime.datetime(2022, 4, 15, 12, 30)
+
+
+def json_benchmarks():
+    for name, payload in PAYLOADS.items():
+        raw = safe_dict_json_dumps(payload)
+        yield f'json.dumps.{name}', lambda payload=payload: safe_dict_json_dumps(payload)
+        yield f'json.loads.{name}', lambda raw=raw: safe_dict_json_loads(raw)
+
+
+def schema_benchmarks():
+    data = PAYLOADS['medium']['data']
+    body = {'id': SESSION_ID, 'data': data}
+    timestamps = {
+        'int': 1650000000,
+        'float': 1650000000.5,
+        'datetime': NOW,
+        'date': NOW.date(),
+    }
+
+    yield 'schema.session_body', lambda: SessionBody.parse_obj(body)
+    for name, value in timestamps.items():
+        session = {**body, 'created_at': value, 'expires_at': value}
+        yield f'schema.session.{name}', lambda session=session: Session.parse_obj(session)
+        yield f'schema.timestamp.{name}', lambda value=value: Timestamp.validate(value)
+
+
+async def store_times(url, number, selected):
+    """Best per call time of the store benchmarks selected"""
+    store = Store(url)
+    await store.connect()
+    results = {}
+
+    try:
+        for name, payload in PAYLOADS.items():
+            key = f'benchmark:{uuid.uuid4()}'
+            # The store has no delete, the keys expire instead
+            until = int(time.time()) + KEY_TTL
+            await store.set_json(key, payload, until=until)
+            backend = url.split(':')[0]
+
+            operations = {
+                f'store.{backend}.set_json.{name}':
+                    lambda: store.set_json(key, payload, until=until),
+                f'store.{backend}.get_json.{name}': lambda: store.get_json(key),
+            }
+            for benchmark, operation in operations.items():
+                if not selected(benchmark):
+                    continue
+
+                times = []
+                for _ in range(5):
+                    start = time.perf_counter()
+                    for _ in range(number):
+                        await operation()
+                    times.append((time.perf_counter() - start) / number)
+                results[benchmark] = min(times)
+    finally:
+        await store.disconnect()
+
+    return results
+
+
+def run(number, urls, only):
+    def selected(name):
+        return fnmatch.fnmatch(name, only)
+
+    results = {}
+    for name, func in [*json_benchmarks(), *schema_benchmarks()]:
+        if selected(name):
+            results[name] = best_time(func, number)
+
+    for url in urls:
+        results.update(asyncio.run(store_times(url, number, selected)))
+
+    print(f'{"benchmark":<36} {"us":>10}')
+    print('=' * 47)
+    for name, seconds in results.items():
+        print(f'{name:<36} {seconds * 1e6:>10.2f}')
+
+    return results
+
+
+if __name__ == '__main__':
+    number = 1000
+    stores = ['memory']
+    url = 'redis://localhost:6379'
+    only = '*'
+    if '--number' in sys.argv:
+        number = int(sys.argv[sys.argv.index('--number') + 1])
+    if '--stores' in sys.argv:
+        stores = sys.argv[sys.argv.index('--stores') + 1].split(',')
+    if '--url' in sys.argv:
+        url = sys.argv[sys.argv.index('--url') + 1]
+    if '--only' in sys.argv:
+        only = sys.argv[sys.argv.index('--only') + 1]
+
+    directory = tempfile.mkdtemp()
+    urls = {
+        'memory': 'memory://',
+        # Slots large enough for the large payload
+        'shm': f'shm://{directory}/benchmarks.shm?slots=64&partitions=4&slot_size=65536',
+        'sqlite': f'sqlite://{directory}/benchmarks.db',
+        'redis': f'{url}?db=9',
+    }
+    try:
+        results = run(number, [urls[name] for name in stores], only)
+    finally:
+        shutil.rmtree(directory)
+
+    if '--save' in sys.argv:
+        baseline.save(sys.argv[sys.argv.index('--save') + 1], results)
+
+    if '--check' in sys.argv:
+        errors = baseline.compare(
+            results,
+            baseline.load(sys.argv[sys.argv.index('--check') + 1]),
+            baseline.parse_thresholds(baseline.threshold_options()))
+
+        for error in errors:
+            print(f'REGRESSION {error}')
+        sys.exit(1 if errors else 0)
@@ -0,0 +1,94 @@
+"""Throughput of the app with the previous `BaseHTTPMiddleware` request logging and
+with the pure ASGI `RequestLoggingMiddleware`
+
+    python -m benchmarks.middleware [--requests N] [--concurrency N]
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.app import app
+from app.constants import STORE_KEY
+from app.middleware import RequestLoggingMiddleware
+from app.store import store
+from benchmarks.asgi import throughput
+
+
+SESSION_ID = '579e9e7c-f8cb-4a3f-9c22-03b83c469052'
+
+
+class BaseHTTPRequestLoggingMiddleware(BaseHTTPMiddleware):
+    """Request logging as it was implemented before"""
+
+    async def dispatch(self, request, call_next):
+        start_time = time.time()
+        url = request.url.path
+        if request.url.query:
+            url = f'{url}?{request.url.query}'
+
+        response = await call_next(request)
+
+        elapsed = round(round(time.time() - start_time, 4) * 1000)
+        logging.info(
+            f'{request.method} {url} {response.status_code} (elapsed {elapsed}ms)')
+
+        return response
+
+
+VARIANTS = {
+    'basehttp': Middleware(BaseHTTPRequestLoggingMiddleware),
+    'asgi': Middleware(RequestLoggingMiddleware),
+    'asgi 1/10': Middleware(RequestLoggingMiddleware, sample_rate=10),
+}
+
+ROUTES = {
+    '/healthz': '/healthz',
+    '/sessions/{id}': f'/sessions/{SESSION_ID}',
+}
+
+
+async def run(requests, concurrency):
+    # Log lines are written (formatted) but discarded
+    logging.basicConfig(
+        level=logging.INFO, stream=open(os.devnull, 'w'),
+        format='%(asctime)s [%(levelname)s] %(message)s')
+
+    async with store:
+        await store.set_json(
+            STORE_KEY.format(session_id=SESSION_ID),
+            {'id': SESSION_ID, 'data': {}, 'created_at': 1, 'expires_at': 2})
+
+        print(f'{"route":<16} {"middleware":<10} {"req/s":>8} {"p50 us":>8}')
+        print('=' * 45)
+
+        for route, path in ROUTES.items():
+            for name, middleware in VARIANTS.items():
+                app.user_middleware = [middleware]
+                app.middleware_stack = app.build_middleware_stack()
+
+                # Warm up
+                await throughput(
+                    app, lambda i: ('GET', path, b''), requests=200, concurrency=concurrency)
+                rps, latencies = await throughput(
+                    app, lambda i: ('GET', path, b''),
+                    requests=requests, concurrency=concurrency)
+                p50 = sorted(latencies)[len(latencies) // 2]
+
+                print(f'{route:<16} {name:<10} {rps:>8.0f} {p50 * 1e6:>8.0f}')
+            print('')
+
+
+if __name__ == '__main__':
+    requests = 5000
+    concurrency = 10
+    if '--requests' in sys.argv:
+        requests = int(sys.argv[sys.argv.index('--requests') + 1])
+    if '--concurrency' in sys.argv:
+        concurrency = int(sys.argv[sys.argv.index('--concurrency') + 1])
+
+    asyncio.run(run(requests, concurrency))
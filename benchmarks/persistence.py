@@ -0,0 +1,76 @@
+"""Persistence of the memory store: cost of logging the writes, snapshot time and
+time to load the keys back (from the snapshot, then from the log only)
+
+    python -m benchmarks.persistence [--keys N]
+"""
+import asyncio
+import json
+import shutil
+import sys
+import tempfile
+import time
+
+from app.store import MemoryBackend
+from benchmarks.codec import PAYLOADS
+
+
+async def write(backend, keys, raw):
+    until = int(time.time()) + 3600
+    start = time.perf_counter()
+    for i in range(keys):
+        await backend.set(f'session.id.{i}', raw, until=until)
+    return time.perf_counter() - start
+
+
+async def load(url):
+    start = time.perf_counter()
+    backend = MemoryBackend(url)
+    await backend.connect()
+    elapsed = time.perf_counter() - start
+    await backend.disconnect()
+    return elapsed
+
+
+async def run(keys):
+    raw = json.dumps(PAYLOADS['small'])
+    directory = tempfile.mkdtemp()
+    url = f'memory://?persist_dir={directory}&snapshot_interval=1e9'
+    results = {}
+
+    try:
+        backend = MemoryBackend()
+        await backend.connect()
+        results['write, in memory only'] = await write(backend, keys, raw)
+        await backend.disconnect()
+
+        backend = MemoryBackend(url)
+        await backend.connect()
+        results['write, logged'] = await write(backend, keys, raw)
+        await backend.disconnect()
+
+        results['load from the log'] = await load(url)
+
+        backend = MemoryBackend(url)
+        await backend.connect()
+        start = time.perf_counter()
+        await backend._persistence.snapshot(lambda: list(backend._dict), backend._entry)
+        results['snapshot'] = time.perf_counter() - start
+        await backend.disconnect()
+
+        results['load from the snapshot'] = await load(url)
+    finally:
+        shutil.rmtree(directory)
+
+    print(f'{keys} keys of {len(raw)} bytes\n')
+    print(f'{"measure":<24} {"s":>8} {"us/key":>8}')
+    print('=' * 42)
+    for name, seconds in results.items():
+        print(f'{name:<24} {seconds:>8.2f} {seconds / keys * 1e6:>8.2f}')
+
+
+if __name__ == '__main__':
+    keys = 100000
+    if '--keys' in sys.argv:
+        keys = int(sys.argv[sys.argv.index('--keys') + 1])
+
+    asyncio.run(run(keys))
@@ -0,0 +1,131 @@
+"""Startup time: import time of the main modules (each in a fresh interpreter) and
+time from launching the server to its first response
+
+    python -m benchmarks.startup [--runs N] [--save PATH] [--check PATH]
+        [--tolerance RATIO] [--threshold PATTERN=RATIO ...]
+
+`--save` writes the results as a baseline, `--check` compares the results with a
+baseline and exits with an error when a time is more than `tolerance` (default
+0.25) slower, or than the threshold of the first `--threshold` pattern matching it
+(see `benchmarks.baseline`). Baselines depend on the machine, save them where they
+are checked.
+The check also fails when importing the app loads the redis client.
+"""
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from benchmarks import baseline
+
+
+MODULES = ['app.settings', 'app.store', 'app.main']
+
+IMPORT_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start, 'aioredis' in sys.modules)
+'''
+
+
+def measure_import(module):
+    """Seconds to import `module` and whether aioredis was loaded"""
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT.format(module=module)],
+        capture_output=True, text=True, check=True, env=env()).stdout
+    seconds, aioredis = output.split()
+    return float(seconds), aioredis == 'True'
+
+
+def measure_first_response(timeout=30):
+    """Seconds from launching the server to its first `/healthz` response"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'app.server'],
+        env={**env(), 'APP_PORT': str(port), 'SERVER_CONCURRENCY': '1'},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/healthz', timeout=1)
+                return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+        raise TimeoutError('Server not started')
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+
+
+def env():
+    # Memory store, the startup doesn't depend on a redis server
+    return {
+        key: value for key, value in os.environ.items()
+        if not key.startswith(('REDIS_', 'STORE_'))
+    }
+
+
+def run(runs):
+    results = {}
+    loads_aioredis = False
+
+    for module in MODULES:
+        times = []
+        for _ in range(runs):
+            seconds, aioredis = measure_import(module)
+            times.append(seconds)
+            loads_aioredis |= aioredis
+        results[f'import {module}'] = statistics.median(times)
+
+    results['first response'] = statistics.median(
+        measure_first_response() for _ in range(runs))
+
+    print(f'{"measure":<24} {"ms":>8}')
+    print('=' * 33)
+    for name, seconds in results.items():
+        print(f'{name:<24} {seconds * 1000:>8.1f}')
+    print(f'\naioredis loaded by the imports: {loads_aioredis}')
+
+    return results, loads_aioredis
+
+
+def check(results, loads_aioredis, previous, thresholds):
+    errors = []
+    if loads_aioredis:
+        errors.append('aioredis is imported without using redis')
+
+    return errors + baseline.compare(results, previous, thresholds)
+
+
+if __name__ == '__main__':
+    runs = 5
+    tolerance = 0.25
+    if '--runs' in sys.argv:
+        runs = int(sys.argv[sys.argv.index('--runs') + 1])
+    if '--tolerance' in sys.argv:
+        tolerance = float(sys.argv[sys.argv.index('--tolerance') + 1])
+
+    results, loads_aioredis = run(runs)
+
+    if '--save' in sys.argv:
+        baseline.save(sys.argv[sys.argv.index('--save') + 1], results)
+
+    if '--check' in sys.argv:
+        errors = check(
+            results,
+            loads_aioredis,
+            baseline.load(sys.argv[sys.argv.index('--check') + 1]),
+            baseline.parse_thresholds([str(tolerance), *baseline.threshold_options()]))
+
+        for error in errors:
+            print(f'REGRESSION {error}')
+        sys.exit(1 if errors else 0)
@@ -1,10 +1,12 @@
 if [[ "$APP_DEV_MODE" =~ ^(True|true|1)$ ]]; then
-    EXTRA_ARGS="--reload --reload-dir=app"
     echo "Server: Using reloader"
+    uvicorn \
+        --host 0.0.0.0 \
+        --port ${APP_PORT:-80} \
+        --log-level info \
+        --reload --reload-dir=app app.main:app
+else
+    # Pre-forks SERVER_CONCURRENCY workers (SIGHUP restarts them one at a time),
+    # see app/server.py
+    python -m app.server
 fi
-
-uvicorn \
-    --host 0.0.0.0 \
-    --port ${APP_PORT:-80} \
-    --log-level info \
-    ${EXTRA_ARGS} app.main:app
@@ -0,0 +1,51 @@
+from uuid import uuid4
+import json
+import pytest
+
+from app.constants import STORE_KEY
+from app.settings import settings
+
+
+@pytest.fixture
+def export_enabled(monkeypatch):
+    monkeypatch.setattr(settings.admin, 'export_enabled', True)
+
+
+@pytest.mark.asyncio
+async def test_export_sessions(client, store, export_enabled, monkeypatch):
+    monkeypatch.setattr('app.api.routes.admin.SCAN_BATCH_SIZE', 2)
+    sessions = [
+        {'id': str(uuid4()), 'data': {'i': i}, 'created_at': 1, 'expires_at': 2}
+        for i in range(5)
+    ]
+    for session in sessions:
+        await store.set_json(STORE_KEY.format(session_id=session['id']), session)
+    await store.set_json('other', {'x': 1})
+
+    res = await client.get('/admin/sessions/export')
+    lines = res.text.splitlines()
+
+    assert res.status_code == 200
+    assert res.headers['content-type'] == 'application/x-ndjson'
+    assert sorted(lines, key=lambda line: json.loads(line)['data']['i']) == [
+        json.dumps(session) for session in sessions]
+
+
+@pytest.mark.asyncio
+async def test_export_sessions_disabled(client):
+    res = await client.get('/admin/sessions/export')
+
+    assert res.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_admin_token(client, export_enabled, monkeypatch):
+    monkeypatch.setattr(settings.admin, 'token', 'secret')
+
+    assert (await client.get('/admin/sessions/export')).status_code == 403
+    assert (await client.get(
+        '/admin/sessions/export', headers={'Authorization': 'Bearer other'}
+    )).status_code == 403
+    assert (await client.get(
+        '/admin/sessions/export', headers={'Authorization': 'Bearer secret'}
+    )).status_code == 200
@@ -8,3 +8,17 @@ async def test_read_health(client):
 
     assert res.status_code == 200
     assert data == {'message': 'ok'}
+
+
+@pytest.mark.asyncio
+async def test_read_readiness(client, store, monkeypatch):
+    res = await client.get('/readyz')
+
+    assert res.status_code == 200
+    assert res.json() == {'message': 'ok'}
+
+    monkeypatch.setattr(store.backend, 'is_ready', lambda: False)
+    res = await client.get('/readyz')
+
+    assert res.status_code == 503
+    assert res.json() == {'message': 'not ready'}
@@ -0,0 +1,26 @@
+from uuid import uuid4
+import pytest
+
+from app.store import MemoryBackend, store
+
+
+@pytest.mark.asyncio
+async def test_metrics(client):
+    await client.get(f'/sessions/{uuid4()}')
+    await client.get('/healthz')
+
+    res = await client.get('/metrics')
+    lines = res.text.splitlines()
+
+    assert res.status_code == 200
+    assert any(
+        line.startswith('http_requests_total{method="GET",route="/sessions/{id}",status="404"}')
+        for line in lines)
+    assert any(
+        line.startswith('http_request_duration_seconds_count{method="GET",route="/healthz"}')
+        for line in lines)
+    assert any(
+        line.startswith('store_operation_duration_seconds_count{operation="get"}')
+        for line in lines)
+    if isinstance(store.backend, MemoryBackend):
+        assert any(line.startswith('store_memory_overhead_bytes ') for line in lines)
@@ -1,8 +1,14 @@
 from datetime import datetime
 from uuid import uuid4
+import json
+import time
 import pytest
+from pydantic import ValidationError
 
 from app.constants import SESSION_MAX_AGE, STORE_KEY
+from app.expiration import sliding_expiration
+from app.settings import settings
+from app.store import ValueTooLarge
 
 
 @pytest.fixture
@@ -59,3 +65,200 @@ async def test_post_session(client, store, dummy_session, mocker):
     assert data['created_at'] == int(mock_now.timestamp())
     assert data['expires_at'] == int((mock_now + SESSION_MAX_AGE).timestamp())
     assert await store.exists(STORE_KEY.format(session_id=dummy_session['id']))
+
+    stored = await store.get_json(STORE_KEY.format(session_id=dummy_session['id']))
+    assert stored['id'] == dummy_session['id']
+    assert stored['expires_at'] == data['expires_at']
+
+
+@pytest.mark.asyncio
+async def test_post_session_conflict(client, store, dummy_session):
+    await store.set_json(STORE_KEY.format(session_id=dummy_session['id']), dummy_session)
+
+    res = await client.post('/sessions/', json={**dummy_session, 'data': {'other': 1}})
+
+    assert res.status_code == 409
+    stored = await store.get_json(STORE_KEY.format(session_id=dummy_session['id']))
+    assert stored['data'] == {'test': True}
+
+
+@pytest.mark.asyncio
+async def test_post_session_too_large(client, store, dummy_session, mocker):
+    # E.g. larger than the slots of the shared memory store
+    mocker.patch.object(store.backend, 'create', side_effect=ValueTooLarge('large'))
+
+    res = await client.post('/sessions/', json=dummy_session)
+
+    assert res.status_code == 413
+    assert res.json() == {'message': 'Session too large'}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('path', ['/sessions', '/sessions/'])
+async def test_get_sessions(client, store, dummy_session, path):
+    await store.set_json(STORE_KEY.format(session_id=dummy_session['id']), dummy_session)
+    missing_id = str(uuid4())
+
+    res = await client.get(path, params={'ids': [dummy_session['id'], missing_id]})
+    data = res.json()
+
+    assert res.status_code == 200
+    assert [s['id'] for s in data['sessions']] == [dummy_session['id']]
+    assert data['missing'] == [missing_id]
+
+
+@pytest.mark.asyncio
+async def test_post_sessions(client, store, dummy_session):
+    await store.set_json(STORE_KEY.format(session_id=dummy_session['id']), dummy_session)
+    new_id = str(uuid4())
+
+    res = await client.post('/sessions/batch', json={'sessions': [
+        {'id': dummy_session['id'], 'data': {}},
+        {'id': new_id, 'data': {'new': True}}
+    ]})
+    data = res.json()
+
+    assert res.status_code == 200
+    assert [s['id'] for s in data['sessions']] == [new_id]
+    assert data['conflicts'] == [dummy_session['id']]
+    stored = await store.get_json(STORE_KEY.format(session_id=new_id))
+    assert stored['data'] == {'new': True}
+
+
+@pytest.mark.asyncio
+async def test_get_session_returns_stored_json(client, store, dummy_session):
+    raw = json.dumps(dummy_session)
+    await store.backend.set(STORE_KEY.format(session_id=dummy_session['id']), raw)
+
+    res = await client.get(f'/sessions/{dummy_session["id"]}')
+
+    assert res.status_code == 200
+    assert res.headers['content-type'] == 'application/json'
+    assert res.text == raw
+
+
+@pytest.mark.asyncio
+async def test_get_session_verify(client, store, dummy_session, monkeypatch):
+    monkeypatch.setattr(settings.app, 'verify_sessions', True)
+    key = STORE_KEY.format(session_id=dummy_session['id'])
+
+    await store.set_json(key, dummy_session)
+    res = await client.get(f'/sessions/{dummy_session["id"]}')
+
+    assert res.status_code == 200
+    assert res.json()['data'] == {'test': True}
+
+    await store.set_json(key, {'id': dummy_session['id']})
+    with pytest.raises(ValidationError):
+        await client.get(f'/sessions/{dummy_session["id"]}')
+
+
+@pytest.fixture(params=['json', 'hash'])
+def session_layout(request, monkeypatch):
+    monkeypatch.setattr(settings.app, 'session_layout', request.param)
+    return request.param
+
+
+@pytest.mark.asyncio
+async def test_patch_session(client, store, session_layout):
+    res = await client.post('/sessions/', json={'id': str(uuid4()), 'data': {
+        'name': 'x', 'prefs': {'color': 'red', 'size': 1}, 'old': True}})
+    session = res.json()
+
+    res = await client.patch(f'/sessions/{session["id"]}', json={'data': {
+        'prefs': {'size': None, 'lang': 'en'}, 'old': None, 'new': [1]}})
+    data = res.json()
+
+    assert res.status_code == 200
+    assert data == {**session, 'data': {
+        'name': 'x', 'prefs': {'color': 'red', 'lang': 'en'}, 'new': [1]}}
+
+    res = await client.get(f'/sessions/{session["id"]}')
+    assert res.json() == data
+
+    res = await client.get('/sessions/', params={'ids': [session['id']]})
+    assert res.json()['sessions'] == [data]
+
+
+@pytest.mark.asyncio
+async def test_patch_session_keeps_expiry(client, store, session_layout):
+    session_id = str(uuid4())
+    key = STORE_KEY.format(session_id=session_id)
+    res = await client.post('/sessions/', json={'id': session_id, 'data': {}})
+    expires_at = res.json()['expires_at']
+
+    await client.patch(f'/sessions/{session_id}', json={'data': {'x': 1}})
+
+    if hasattr(store.backend, '_until'):
+        assert store.backend._until(key) == expires_at
+    else:
+        ttl = await store.backend._connection.ttl(key)
+        assert 0 < ttl <= SESSION_MAX_AGE.total_seconds()
+
+
+@pytest.mark.asyncio
+async def test_patch_session_not_found(client, session_layout):
+    res = await client.patch(f'/sessions/{uuid4()}', json={'data': {'x': 1}})
+
+    assert res.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_hash_layout_sessions(client, store, monkeypatch):
+    monkeypatch.setattr(settings.app, 'session_layout', 'hash')
+    session_id = str(uuid4())
+    key = STORE_KEY.format(session_id=session_id)
+
+    res = await client.post('/sessions/', json={'id': session_id, 'data': {'x': 1}})
+    assert res.status_code == 200
+    res = await client.post('/sessions/', json={'id': session_id, 'data': {}})
+    assert res.status_code == 409
+
+    items = await store.get_collection_json(key)
+    assert items['data.x'] == {'value': 1}
+    assert items['session']['id'] == session_id
+
+    new_id = str(uuid4())
+    res = await client.post('/sessions/batch', json={'sessions': [
+        {'id': session_id, 'data': {}}, {'id': new_id, 'data': {'y': 2}}]})
+    assert [s['id'] for s in res.json()['sessions']] == [new_id]
+    assert res.json()['conflicts'] == [session_id]
+
+    missing_id = str(uuid4())
+    res = await client.get(
+        '/sessions', params={'ids': [session_id, new_id, missing_id]})
+    assert {s['id']: s['data'] for s in res.json()['sessions']} == {
+        session_id: {'x': 1}, new_id: {'y': 2}}
+    assert res.json()['missing'] == [missing_id]
+
+    monkeypatch.setattr(settings.admin, 'export_enabled', True)
+    res = await client.get('/admin/sessions/export')
+    exported = {s['id']: s['data'] for s in map(json.loads, res.text.splitlines())}
+    assert exported == {session_id: {'x': 1}, new_id: {'y': 2}}
+
+
+@pytest.mark.asyncio
+async def test_get_session_sliding_expiration(
+    client, store, session_layout, monkeypatch, mocker
+):
+    monkeypatch.setattr(settings.app, 'sliding_expiration', True)
+    mock_datetime = mocker.patch('app.api.routes.sessions.datetime')
+    mock_datetime.now.return_value = datetime.now() - SESSION_MAX_AGE / 2
+    session_id = str(uuid4())
+    key = STORE_KEY.format(session_id=session_id)
+
+    res = await client.post('/sessions/', json={'id': session_id, 'data': {}})
+    created = res.json()
+
+    res = await client.get(f'/sessions/{session_id}')
+    expires_at = res.json()['expires_at']
+
+    assert expires_at >= time.time() + SESSION_MAX_AGE.total_seconds() - 1
+    assert expires_at > created['expires_at']
+
+    await sliding_expiration.flush()
+    if hasattr(store.backend, '_until'):
+        assert store.backend._until(key) == expires_at
+    else:
+        ttl = await store.backend._connection.ttl(key)
+        assert ttl > created['expires_at'] - time.time()
@@ -0,0 +1,116 @@
+import time
+import uuid
+
+import pytest
+
+from app.backends.compact import CompactMemoryBackend
+from app.store import Store
+
+
+@pytest.fixture
+async def backend():
+    backend = CompactMemoryBackend()
+    await backend.connect()
+    yield backend
+    await backend.disconnect()
+
+
+def session_key():
+    return f'session.id.{uuid.uuid4()}'
+
+
+@pytest.mark.asyncio
+async def test_compact_session_keys(backend):
+    key, other = session_key(), 'session.id.' + str(uuid.uuid4()).upper()
+    await backend.set_many({key: '{"x": 1}', other: b'\x01', 'other': '{}'})
+
+    assert await backend.get(key) == '{"x": 1}'
+    assert await backend.get(other) == b'\x01'
+    assert uuid.UUID(key[11:]).bytes in backend._dict
+    assert other in backend._dict
+    assert sorted(await backend.keys('session.id.*')) == sorted([key, other])
+    assert sorted(await backend.keys()) == sorted([key, other, 'other'])
+
+
+@pytest.mark.asyncio
+async def test_compact_expiry(backend, monkeypatch):
+    now = time.time()
+    keys = [session_key() for _ in range(3)]
+    await backend.set(keys[0], 'a', until=now + 10.5)
+    await backend.set(keys[1], 'b', until=now + 10.5)
+    await backend.create_items(keys[2], {'a': '1'}, until=now + 10.5)
+    await backend.expire_many({keys[1]: now + 20, 'missing': now + 20})
+    await backend.set_item(keys[2], 'b', '2')
+
+    monkeypatch.setattr(time, 'time', lambda: now + 10.6)
+    # Expired, although the keys of that second are not swept yet
+    assert await backend.get(keys[0]) == ''
+    assert await backend.get_collection(keys[2]) == {}
+    assert backend.size['entries'] == 1
+
+    monkeypatch.setattr(time, 'time', lambda: now + 12)
+    backend._expire()
+    assert await backend.get(keys[1]) == 'b'
+    assert backend._until(keys[1]) == now + 20
+    assert len(backend._seconds) == 1
+
+    monkeypatch.setattr(time, 'time', lambda: now + 21)
+    backend._expire()
+    assert backend._dict == {} and backend._buckets == {}
+
+
+@pytest.mark.asyncio
+async def test_compact_evicts_the_key_expiring_first():
+    now = time.time()
+    async with Store('memory://?compact=true&max_entries=3') as store:
+        for i in range(3):
+            await store.set_json(f'key.{i}', {}, until=now + 100 - i)
+        await store.set_json('key.1', {}, until=now + 200)
+        await store.set_json('new', {})
+
+        assert sorted(await store.keys()) == ['key.0', 'key.1', 'new']
+
+
+@pytest.mark.asyncio
+async def test_compact_memory_store_is_restored(tmp_path):
+    url = f'memory://?compact=true&persist_dir={tmp_path}&fsync_interval=0.01'
+    key = session_key()
+    now = time.time()
+    async with Store(url) as store:
+        await store.set_json(key, {'x': 1}, until=now + 60)
+        await store.set_items_json('deleted', {'a': {}})
+        await store.delete_items('deleted', ['a'])
+        await store.set_items_json('items', {'a': {}, 'b': {'b': 2}})
+        await store.set_item_json('items', 'c', {'c': 3})
+        await store.delete_items('items', ['a'])
+        await store.expire_many({'items': now + 120})
+
+    async with Store(url) as store:
+        backend = store.backend
+        await backend._persistence.snapshot(lambda: list(backend._dict), backend._entry)
+
+    async with Store(url) as store:
+        assert sorted(await store.keys()) == ['items', key]
+        assert await store.get_json(key) == {'x': 1}
+        assert await store.get_collection_json('items') == {
+            'b': {'b': 2}, 'c': {'c': 3}}
+        assert store.backend._until(key) == now + 60
+        assert store.backend._until('items') == now + 120
+
+
+@pytest.mark.asyncio
+async def test_compact_uses_less_memory(backend):
+    default = Store('memory://')
+    await default.connect()
+    until = time.time() + 60
+    values = {session_key(): '{"data": {"x": %d}}' % i for i in range(1000)}
+    try:
+        await backend.set_many(values, until=until)
+        await default.backend.set_many(values, until=until)
+
+        compact, memory = backend.memory(), default.backend.memory()
+        assert compact['entries'] == memory['entries'] == 1000
+        assert compact['bytes'] + compact['overhead'] < (
+            memory['bytes'] + memory['overhead']) / 2
+    finally:
+        await default.disconnect()
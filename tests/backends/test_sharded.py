@@ -0,0 +1,128 @@
+import time
+
+import pytest
+
+from app.backends.sharded import HashRing
+from app.store import Store
+
+
+KEYS = [f'session.id.{i}' for i in range(10000)]
+
+
+def test_ring_distribution():
+    ring = HashRing(['a', 'b', 'c', 'd'])
+    counts = {node: 0 for node in ring.nodes}
+    for key in KEYS:
+        counts[ring.node(key)] += 1
+
+    assert all(0.15 < count / len(KEYS) < 0.35 for count in counts.values())
+
+
+def test_ring_adding_a_node_moves_its_share_only():
+    before = HashRing(['a', 'b', 'c', 'd'])
+    after = HashRing(['a', 'b', 'c', 'd', 'e'])
+
+    moved = [key for key in KEYS if before.node(key) != after.node(key)]
+
+    assert 0.1 < len(moved) / len(KEYS) < 0.3
+    assert all(after.node(key) == 'e' for key in moved)
+
+
+@pytest.fixture
+async def store():
+    async with Store('memory+sharded://a,b,c') as st:
+        yield st
+
+
+@pytest.mark.asyncio
+async def test_sharded_store(store):
+    values = {f'test.{i}': {'i': i} for i in range(30)}
+    await store.set_many_json(values)
+    await store.set_json('other', {})
+
+    assert await store.get_many_json([*values, 'missing']) == values
+    assert await store.get_json('test.1') == {'i': 1}
+    assert sorted([key async for key in store.iter_keys('test.*', count=5)]) == \
+        sorted(values)
+    assert sorted(await store.keys('test.*')) == sorted(values)
+    assert all(
+        node.size['entries'] > 0 for node in store.backend.nodes.values())
+
+
+@pytest.mark.asyncio
+async def test_sharded_store_reads_previous_owner():
+    async with Store('memory+sharded://a,b,c?previous=a,b') as store:
+        backend = store.backend
+        key = next(key for key in KEYS if backend.ring.node(key) == 'c')
+        await backend.nodes[backend.previous_ring.node(key)].set(key, '{"x": 1}')
+
+        assert await store.exists(key)
+        assert await store.get_json(key) == {'x': 1}
+        assert await store.get_many_json([key]) == {key: {'x': 1}}
+        assert not await store.create_json(key, {'x': 2})
+        assert await store.create_many_json({key: {'x': 2}, 'new': {}}) == [False, True]
+        assert await store.get_json(key) == {'x': 1}
+
+
+@pytest.mark.asyncio
+async def test_sharded_store_moves_written_keys():
+    async with Store('memory+sharded://a,b,c?previous=a,b') as store:
+        backend = store.backend
+        moved = [key for key in KEYS if backend.ring.node(key) == 'c']
+        until = int(time.time()) + 60
+        for key in moved[:3]:
+            await backend.nodes[backend.previous_ring.node(key)].set_items(
+                key, {'session': '{}', 'data.x': '1'}, until=until)
+
+        # A partial write (PATCH of a hash session) keeps the other items
+        await store.set_items_json(moved[0], {'data.y': {'y': 2}})
+        await store.delete_items(moved[1], ['data.x'])
+        await store.expire_many({moved[2]: until + 60})
+
+        node = backend.nodes['c']
+        assert await node.get_collection(moved[0]) == {
+            'session': '{}', 'data.x': '1', 'data.y': '{"y": 2}'}
+        assert await node.get_collection(moved[1]) == {'session': '{}'}
+        assert node._until(moved[0]) == until
+        assert node._until(moved[2]) == until + 60
+        assert await store.get_collection_json(moved[0]) == {
+            'session': {}, 'data.x': 1, 'data.y': {'y': 2}}
+        await backend.nodes[backend.previous_ring.node(moved[3])].set_items(
+            moved[3], {'session': '{}'}, until=until)
+        assert await store.get_collections_json([*moved[:2], moved[3], 'missing']) == [
+            {'session': {}, 'data.x': 1, 'data.y': {'y': 2}}, {'session': {}},
+            {'session': {}}, {}]
+
+
+@pytest.mark.asyncio
+async def test_sharded_store_moved_keys_are_not_read_again():
+    async with Store('memory+sharded://a,b,c?previous=a,b') as store:
+        backend = store.backend
+        keys = [key for key in KEYS if backend.ring.node(key) == 'c'][:2]
+        for key in keys:
+            await backend.nodes[backend.previous_ring.node(key)].set_items(
+                key, {'session': '{}'})
+
+        await store.delete_items(keys[0], ['session'])
+        await store.set_json(keys[1], {'x': 1})
+        await backend.nodes[backend.previous_ring.node(keys[1])].set(keys[1], '{}')
+
+        assert not await store.exists(keys[0])
+        assert await store.get_collection_json(keys[0]) == {}
+        # A copy left on the previous node is listed once
+        assert await store.keys('session.*') == [keys[1]]
+
+
+@pytest.mark.asyncio
+async def test_sharded_store_reads_removed_nodes():
+    async with Store('memory+sharded://a,b?previous=a,b,c') as store:
+        backend = store.backend
+        key = next(key for key in KEYS if backend.previous_ring.node(key) == 'c')
+        await backend.previous_nodes['c'].set(key, '{"x": 1}')
+
+        assert await store.get_json(key) == {'x': 1}
+        assert await store.keys('session.*') == [key]
+
+        await store.expire_many({key: int(time.time()) + 60})
+        assert await backend.nodes[backend.ring.node(key)].get(key) == '{"x": 1}'
+        assert not await backend.previous_nodes['c'].exists(key)
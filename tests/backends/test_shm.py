@@ -0,0 +1,226 @@
+import asyncio
+import errno
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app.backends.shm import ShmBackend
+from app.store import Store, ValueTooLarge
+
+
+@pytest.fixture
+def url(tmp_path):
+    return f'shm://{tmp_path}/sessions?slots=64&partitions=4&slot_size=256'
+
+
+@pytest.fixture
+async def backend(url):
+    backend = ShmBackend(url)
+    await backend.connect()
+    yield backend
+    await backend.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_shm_store(url):
+    async with Store(url) as store:
+        values = {f'test.{i}': {'i': i} for i in range(20)}
+        await store.set_many_json(values)
+
+        assert await store.get_json('test.1') == {'i': 1}
+        assert await store.get_many_json([*values, 'missing']) == values
+        assert await store.exists('test.2')
+        assert not await store.exists('missing')
+        assert not await store.create_json('test.1', {'i': 2})
+        assert await store.create_json('other', {})
+        assert await store.create_many_json({'other': {}, 'new': {}}) == [False, True]
+        assert sorted(await store.keys('test.*')) == sorted(values)
+
+        await store.set_json('test.1', {'i': 3})
+        assert await store.get_json('test.1') == {'i': 3}
+
+
+@pytest.mark.asyncio
+async def test_shm_collections(backend):
+    assert await backend.create_items('c', {'a': '1', 'b': '2'}, until=time.time() + 60)
+    assert not await backend.create_items('c', {'a': '3'})
+
+    await backend.set_items('c', {'b': '3'})
+    await backend.set_item('c', 'd', '4')
+    assert await backend.get_collection('c') == {'a': '1', 'b': '3', 'd': '4'}
+    assert await backend.get_item('c', 'b') == '3'
+    assert await backend.get_collections(['c', 'missing']) == [
+        {'a': '1', 'b': '3', 'd': '4'}, {}]
+
+    await backend.delete_items('c', ['a', 'b', 'd'])
+    assert not await backend.exists('c')
+    assert await backend.get_collection('c') == {}
+
+
+@pytest.mark.asyncio
+async def test_shm_keys_are_shared(url, backend):
+    other = ShmBackend(url)
+    await other.connect()
+    try:
+        await backend.set('key', '{"x": 1}')
+        assert await other.get('key') == '{"x": 1}'
+
+        # Another process
+        script = (
+            'import asyncio, sys\n'
+            'from app.backends.shm import ShmBackend\n'
+            'async def main():\n'
+            '    backend = ShmBackend(sys.argv[1])\n'
+            '    await backend.connect()\n'
+            '    print(await backend.get("key"))\n'
+            '    await backend.set("child", b"\\x01")\n'
+            '    await backend.disconnect()\n'
+            'asyncio.run(main())\n')
+        output = subprocess.run(
+            [sys.executable, '-c', script, url], capture_output=True, text=True,
+            check=True).stdout
+
+        assert output.strip() == '{"x": 1}'
+        assert await backend.get('child') == b'\x01'
+    finally:
+        await other.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_shm_expiry(backend):
+    now = time.time()
+    await backend.set_many({f'old.{i}': 'x' for i in range(30)}, until=now - 1)
+    await backend.set('new', 'x', until=now + 60)
+    await backend.expire_many({'new': now + 120, 'missing': now + 120})
+
+    assert await backend.get('old.1') == ''
+    assert await backend.keys() == ['new']
+
+    for partition in range(backend.partitions):
+        backend._sweep_partition(partition)
+
+    assert backend.size['entries'] == 1
+    assert await backend.get('new') == 'x'
+    assert backend._read('new')[2] == now + 120
+
+
+@pytest.mark.asyncio
+async def test_shm_full_partition_evicts_the_key_expiring_first(tmp_path):
+    now = time.time()
+    async with Store(f'shm://{tmp_path}/sessions?slots=4&partitions=1') as store:
+        for i in range(4):
+            await store.set_json(f'key.{i}', {}, until=now + 100 - i)
+        await store.set_json('new', {}, until=now + 200)
+
+        assert sorted(await store.keys()) == ['key.0', 'key.1', 'key.2', 'new']
+        assert store.backend.evictions == 1
+
+
+def test_shm_slots_hold_the_sessions_of_the_max_age():
+    # 0.01 sessions per second during 24 hours, 3/4 of the slots used
+    assert ShmBackend('shm://sessions?session_rate=0.01&partitions=4').slots == 288
+    assert ShmBackend('shm://sessions?slots=64&partitions=4').slots == 16
+
+
+@pytest.mark.asyncio
+async def test_shm_sweeper_survives_errors(url, caplog, monkeypatch):
+    backend = ShmBackend(url + '&sweep_interval=0.01')
+    errors = [OSError(errno.EIO, 'I/O error'), PermissionError(errno.EACCES, 'Locked')]
+
+    def sweep_partition(partition):
+        if errors:
+            raise errors.pop()
+
+    monkeypatch.setattr(backend, '_sweep_partition', sweep_partition)
+    await backend.connect()
+    try:
+        await asyncio.sleep(0.05)
+        assert not backend._sweeper.done()
+        assert [record.levelname for record in caplog.records] == ['ERROR']
+    finally:
+        await backend.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_shm_compaction_leaves_unused_slots_unallocated(tmp_path):
+    backend = ShmBackend(
+        f'shm://{tmp_path}/sessions?slots=512&partitions=1&slot_size=65536')
+    await backend.connect()
+    try:
+        for i in range(192):
+            await backend.set_items(f'key.{i}', {'a': '1'})
+        for i in range(176):
+            await backend.delete_items(f'key.{i}', ['a'])
+        blocks = os.stat(backend.path).st_blocks
+
+        backend._sweep_partition(0)
+
+        assert backend.size['entries'] == 16
+        assert await backend.get_collection('key.191') == {'a': '1'}
+        assert os.stat(backend.path).st_blocks <= blocks
+    finally:
+        await backend.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_shm_file_larger_than_its_filesystem(tmp_path):
+    backend = ShmBackend(f'shm://{tmp_path}/sessions?slots=10000000&slot_size=1000000')
+
+    with pytest.raises(RuntimeError):
+        await backend.connect()
+    assert not os.path.exists(backend.path)
+
+
+@pytest.mark.asyncio
+async def test_shm_too_large_value(backend):
+    with pytest.raises(ValueTooLarge):
+        await backend.set('key', 'x' * 300)
+
+
+@pytest.mark.asyncio
+async def test_shm_pubsub(url, backend):
+    other = ShmBackend(url + '&poll_interval=0.01')
+    await other.connect()
+    try:
+        messages = []
+
+        async def listen():
+            async for message in other.subscribe('channel'):
+                messages.append(message)
+                if len(messages) == 2:
+                    return
+
+        task = asyncio.create_task(listen())
+        await asyncio.sleep(0.02)
+        await backend.publish('channel', 'a')
+        await backend.publish('other', 'b')
+        await backend.publish('channel', 'c\nd')
+        await asyncio.wait_for(task, 1)
+
+        assert messages == ['a', 'c\nd']
+    finally:
+        await other.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_shm_file_with_other_options_is_reset(tmp_path):
+    url = f'shm://{tmp_path}/sessions?slots=64&partitions=4'
+    async with Store(url) as store:
+        await store.set_json('key', {})
+
+    async with Store(url.replace('partitions=4', 'partitions=2')) as store:
+        assert not await store.exists('key')
+
+
+@pytest.mark.asyncio
+async def test_shm_file_in_use_with_other_options(tmp_path):
+    url = f'shm://{tmp_path}/sessions?slots=64&partitions=4'
+    async with Store(url) as store:
+        await store.set_json('key', {})
+
+        with pytest.raises(RuntimeError):
+            await ShmBackend(url.replace('partitions=4', 'partitions=2')).connect()
+        assert await store.get_json('key') == {}
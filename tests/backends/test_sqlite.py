@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+import pytest
+
+from app.backends.sqlite import SqliteBackend
+from app.store import Store
+
+
+@pytest.fixture
+def url(tmp_path):
+    return f'sqlite://{tmp_path}/sessions.db?sweep_interval=0.01&poll_interval=0.01'
+
+
+@pytest.fixture
+async def backend(url):
+    backend = SqliteBackend(url)
+    await backend.connect()
+    yield backend
+    await backend.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store(url):
+    async with Store(url) as store:
+        values = {f'test.{i}': {'i': i} for i in range(250)}
+        await store.set_many_json(values)
+
+        assert await store.get_json('test.1') == {'i': 1}
+        assert await store.get_many_json([*values, 'missing']) == values
+        assert await store.exists('test.2')
+        assert not await store.exists('missing')
+        assert not await store.create_json('test.1', {'i': 2})
+        assert await store.create_json('other', {})
+        assert await store.create_many_json({'other': {}, 'new': {}}) == [False, True]
+        assert sorted(await store.keys('test.*')) == sorted(values)
+        assert len([key async for key in store.iter_keys(count=7)]) == 252
+
+    # Durable
+    async with Store(url) as store:
+        assert await store.get_json('test.1') == {'i': 1}
+
+
+@pytest.mark.asyncio
+async def test_sqlite_collections(backend):
+    assert await backend.create_items('c', {'a': '1', 'b': '2'}, until=time.time() + 60)
+    assert not await backend.create_items('c', {'a': '3'})
+
+    await backend.set_items('c', {'b': '3'})
+    await backend.set_item('c', 'd', '4')
+    assert await backend.get_collection('c') == {'a': '1', 'b': '3', 'd': '4'}
+    assert await backend.get_item('c', 'b') == '3'
+    assert await backend.get_collections(['c', 'missing']) == [
+        {'a': '1', 'b': '3', 'd': '4'}, {}]
+
+    await backend.delete_items('c', ['a', 'b', 'd'])
+    assert not await backend.exists('c')
+    assert await backend.get_collection('c') == {}
+
+
+@pytest.mark.asyncio
+async def test_sqlite_expiry(backend):
+    now = time.time()
+    await backend.set('old', 'x', until=now - 1)
+    await backend.set('new', b'x', until=now + 60)
+    await backend.expire_many({'new': now + 120, 'old': now + 120})
+
+    assert await backend.get('old') == ''
+    assert await backend.get('new') == b'x'
+    assert await backend.keys() == ['new']
+    assert await backend.create('old', 'y')
+
+    await backend.set('old', 'x', until=now - 1)
+    await asyncio.sleep(0.05)
+    rows = await backend._read(
+        lambda connection: connection.execute('SELECT key FROM keys').fetchall())
+    assert rows == [('new',)]
+
+
+@pytest.mark.asyncio
+async def test_sqlite_group_commit(backend, mocker):
+    commit = mocker.spy(backend, '_commit')
+
+    await asyncio.gather(*(backend.set(f'key.{i}', 'x') for i in range(50)))
+
+    assert len(await backend.keys()) == 50
+    assert commit.call_count < 50
+
+
+@pytest.mark.asyncio
+async def test_sqlite_failed_write_does_not_fail_the_others(backend):
+    def fail(connection):
+        connection.execute('INSERT INTO missing VALUES (1)')
+
+    results = await asyncio.gather(
+        backend.set('a', 'x'), backend._write(fail), backend.set('b', 'x'),
+        return_exceptions=True)
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], Exception)
+    assert await backend.keys() == ['a', 'b']
+
+
+@pytest.mark.asyncio
+async def test_sqlite_pubsub(url, backend):
+    other = SqliteBackend(url)
+    await other.connect()
+    try:
+        messages = []
+
+        async def listen():
+            async for message in other.subscribe('channel'):
+                messages.append(message)
+                if len(messages) == 2:
+                    return
+
+        task = asyncio.create_task(listen())
+        await asyncio.sleep(0.05)
+        await backend.publish('channel', 'a')
+        await backend.publish('other', 'b')
+        await backend.publish('channel', 'c')
+        await asyncio.wait_for(task, 1)
+
+        assert messages == ['a', 'c']
+    finally:
+        await other.disconnect()
@@ -0,0 +1,67 @@
+import time
+
+from app.cache import LocalCache
+
+
+def test_cache_lru_eviction():
+    cache = LocalCache(maxsize=2, ttl=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_cache_ttl(monkeypatch):
+    cache = LocalCache(maxsize=10, ttl=5)
+    cache.put('a', 1)
+    now = time.monotonic()
+
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 6)
+
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_cache_until_caps_ttl():
+    cache = LocalCache(maxsize=10, ttl=60)
+    cache.put('a', 1, until=time.time() - 1)
+    cache.put('b', 2, until=time.time() + 60)
+
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+
+
+def test_cache_stats():
+    cache = LocalCache(maxsize=10, ttl=60)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('b')
+    cache.invalidate('a')
+
+    assert cache.stats() == {'size': 0, 'maxsize': 10, 'hits': 1, 'misses': 1}
+
+
+def test_cache_skips_values_read_before_an_invalidation():
+    cache = LocalCache(maxsize=2, ttl=60)
+    since = cache.generation
+    cache.invalidate('a')
+    cache.put('a', 1, since=since)
+    cache.put('b', 2, since=since)
+
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+
+    # Invalidations of more than `maxsize` keys are not told apart
+    since = cache.generation
+    for key in 'cde':
+        cache.invalidate(key)
+    cache.put('a', 1, since=since)
+    cache.put('e', 5, since=cache.generation)
+
+    assert cache.get('a') is None
+    assert cache.get('e') == 5
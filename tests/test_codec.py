@@ -0,0 +1,78 @@
+import subprocess
+import sys
+
+import pytest
+
+from app.codec import (
+    AVAILABLE, AVAILABLE_COMPRESSIONS, Compressor, Decoder, get_codec, get_compression)
+
+
+CODECS = [name for name, available in AVAILABLE.items() if available]
+COMPRESSIONS = [name for name, available in AVAILABLE_COMPRESSIONS.items() if available]
+
+
+@pytest.mark.parametrize('name', CODECS)
+def test_codec_round_trip(name):
+    codec = get_codec(name)
+    data = {'x': 1, 'y': [1.5, 'z', None], 'nested': {'ok': True}}
+
+    assert codec.loads(codec.dumps(data)) == data
+
+
+@pytest.mark.parametrize('name', CODECS)
+def test_codec_is_safe(name):
+    codec = get_codec(name)
+
+    assert codec.loads(codec.dumps('not a dict')) == {}
+    assert codec.loads(codec.dumps({'x': object()})) == {}
+    assert codec.loads('') == {}
+    assert codec.loads(None) == {}
+
+
+@pytest.mark.parametrize('name', CODECS)
+def test_decoder_reads_every_format(name):
+    decoder = Decoder(get_codec(name))
+
+    for other in CODECS:
+        assert decoder.loads(get_codec(other).dumps({'x': 1})) == {'x': 1}
+
+
+def test_unknown_codec():
+    with pytest.raises(NameError):
+        get_codec('xml')
+
+
+@pytest.mark.parametrize('compression', COMPRESSIONS)
+@pytest.mark.parametrize('name', CODECS)
+def test_decoder_reads_compressed_values(name, compression):
+    codec = get_codec(name)
+    compressor = Compressor(get_compression(compression), threshold=64)
+    decoder = Decoder(get_codec('json'))
+    small = {'x': 1}
+    large = {'x': 'a' * 1000}
+
+    assert compressor.compress(codec.dumps(small)) == codec.dumps(small)
+    compressed = compressor.compress(codec.dumps(large))
+    assert compressed[:1] == get_compression(compression).marker
+    assert len(compressed) < 100
+    assert decoder.loads(compressed) == large
+    # Corrupted values are read as empty
+    assert decoder.loads(compressed[:20]) == {}
+
+
+def test_unknown_compression():
+    with pytest.raises(NameError):
+        get_compression('rar')
+
+
+def test_codec_libraries_are_imported_lazily():
+    # fastapi imports orjson itself when installed
+    script = (
+        'import sys, app.codec; print(*("orjson" in sys.modules, "msgpack" in '
+        'sys.modules, "lz4" in sys.modules)); import app.main; '
+        'print(*("msgpack" in sys.modules, "lz4" in sys.modules))')
+    output = subprocess.run(
+        [sys.executable, '-c', script], capture_output=True, text=True,
+        check=True).stdout
+
+    assert output.split() == ['False'] * 5
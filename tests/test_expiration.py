@@ -0,0 +1,74 @@
+import time
+import pytest
+
+from app.expiration import SlidingExpiration
+from app.store import Store
+
+
+@pytest.fixture
+async def store():
+    async with Store('memory://') as st:
+        yield st
+
+
+@pytest.mark.asyncio
+async def test_sliding_expiration_batches_refreshes(store):
+    expiration = SlidingExpiration(store, max_age=60, interval=30)
+    await store.set_json('a', {}, until=int(time.time()) + 5)
+    await store.set_json('b', {}, until=int(time.time()) + 5)
+    calls = []
+    expire_many = store.backend.expire_many
+
+    async def counted_expire_many(expiries):
+        calls.append(expiries)
+        await expire_many(expiries)
+
+    store.backend.expire_many = counted_expire_many
+
+    until = expiration.touch('a')
+    assert expiration.touch('a') == until
+    expiration.touch('b')
+    expiration.touch('missing')
+    await expiration.flush()
+
+    assert calls == [{'a': until, 'b': until, 'missing': until}]
+    assert store.backend._expiry['a'] == until
+    assert 'missing' not in store.backend._dict
+
+    # Refreshed keys are not refreshed again during the interval
+    expiration.touch('a')
+    await expiration.flush()
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_sliding_expiration_refreshes_after_interval(store, mocker):
+    expiration = SlidingExpiration(store, max_age=60, interval=30)
+    now = time.time()
+    clock = mocker.patch('app.expiration.time')
+    clock.time.return_value = now
+
+    assert expiration.touch('a') == int(now + 60)
+    clock.time.return_value = now + 31
+    await expiration.flush()
+
+    assert expiration.touch('a') == int(now + 91)
+    assert expiration._pending == {'a': int(now + 91)}
+
+
+@pytest.mark.asyncio
+async def test_sliding_expiration_keeps_refreshes_on_errors(store, mocker):
+    expiration = SlidingExpiration(store, max_age=60, interval=30)
+    await store.set_json('a', {}, until=int(time.time()) + 5)
+    expire_many = mocker.patch.object(
+        store.backend, 'expire_many', side_effect=ConnectionError('blip'))
+
+    until = expiration.touch('a')
+    with pytest.raises(ConnectionError):
+        await expiration.flush()
+
+    expire_many.side_effect = None
+    await expiration.flush()
+    assert expire_many.call_count == 2
+    expire_many.assert_called_with({'a': until})
+    assert expiration._pending == {}
@@ -0,0 +1,57 @@
+import json
+import os
+
+from app.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_metrics_render():
+    registry = Registry()
+    counter = registry.register(Counter('requests_total', 'Requests', ['route']))
+    gauge = registry.register(Gauge('in_flight', 'In flight'))
+    histogram = registry.register(Histogram(
+        'latency_seconds', 'Latency', ['route'], buckets=(0.1, 1)))
+
+    counter.inc('/a')
+    counter.inc('/a')
+    gauge.inc()
+    histogram.observe(0.05, '/a')
+    histogram.observe(0.5, '/a')
+    histogram.observe(5, '/a')
+
+    assert registry.render().splitlines() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{route="/a"} 2.0',
+        '# HELP in_flight In flight',
+        '# TYPE in_flight gauge',
+        'in_flight 1.0',
+        '# HELP latency_seconds Latency',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 5.55',
+        'latency_seconds_count{route="/a"} 3',
+    ]
+
+
+def test_metrics_merge_worker_snapshots(tmp_path):
+    registry = Registry()
+    counter = registry.register(Counter('requests_total', 'Requests'))
+    gauge = registry.register(Gauge('in_flight', 'In flight'))
+    histogram = registry.register(Histogram('latency_seconds', 'Latency', buckets=(1,)))
+    counter.inc(amount=2)
+    gauge.inc()
+    histogram.observe(0.5)
+    snapshot = registry.snapshot()
+
+    # A running worker (the parent process) and an exited one
+    for pid in (os.getppid(), 999999999):
+        (tmp_path / f'{pid}.json').write_text(json.dumps(snapshot))
+
+    lines = registry.render(str(tmp_path)).splitlines()
+
+    assert 'requests_total 6.0' in lines
+    assert 'in_flight 2.0' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_count 3' in lines
@@ -0,0 +1,49 @@
+import logging
+
+import pytest
+from httpx import AsyncClient
+from starlette.responses import PlainTextResponse
+
+from app.middleware import RequestLoggingMiddleware
+
+
+async def endpoint(scope, receive, send):
+    status_code = 500 if scope['path'] == '/error' else 200
+    await PlainTextResponse('ok', status_code=status_code)(scope, receive, send)
+
+
+async def get(middleware, *paths):
+    async with AsyncClient(app=middleware, base_url='http://test') as client:
+        for path in paths:
+            await client.get(path)
+
+
+@pytest.mark.asyncio
+async def test_request_logging(caplog):
+    caplog.set_level(logging.INFO)
+
+    await get(RequestLoggingMiddleware(endpoint), '/path?x=1')
+
+    assert len(caplog.records) == 1
+    assert caplog.records[0].getMessage().startswith('GET /path?x=1 200 (elapsed ')
+
+
+@pytest.mark.asyncio
+async def test_request_logging_sample_rate(caplog):
+    caplog.set_level(logging.INFO)
+
+    await get(
+        RequestLoggingMiddleware(endpoint, sample_rate=3),
+        '/1', '/2', '/3', '/error', '/5', '/6')
+
+    assert [r.getMessage().split()[1] for r in caplog.records] == ['/3', '/error', '/6']
+    assert caplog.records[1].levelno == logging.WARNING
+
+
+@pytest.mark.asyncio
+async def test_request_logging_slow_requests(caplog):
+    caplog.set_level(logging.WARNING)
+
+    await get(RequestLoggingMiddleware(endpoint, slow_ms=0.0001), '/slow')
+
+    assert caplog.records[0].getMessage().startswith('GET /slow 200')
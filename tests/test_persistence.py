@@ -0,0 +1,98 @@
+import os
+import time
+import uuid
+
+import pytest
+
+from app.persistence import SET, encode
+from app.store import MemoryBackend, Store
+
+
+@pytest.fixture
+def url(tmp_path):
+    return f'memory://?persist_dir={tmp_path}&fsync_interval=0.01'
+
+
+@pytest.mark.asyncio
+async def test_memory_store_is_restored(url):
+    now = time.time()
+    async with Store(url) as store:
+        await store.set_json('a', {'x': 1})
+        await store.set_json('b', {'x': 2}, until=now + 60)
+        await store.set_json('expired', {'x': 3}, until=now + 0.05)
+        assert await store.create_json('c', {'x': 4})
+        await store.expire_many({'c': now + 120})
+        await store.set_items_json('items', {'a': {}, 'b': {'b': 2}, 'c': {}})
+        await store.set_item_json('items', 'd', {'d': 4})
+        await store.delete_items('items', ['a'])
+        await store.set_items_json('empty', {'a': {}})
+        await store.delete_items('empty', ['a'])
+
+    time.sleep(0.05)
+
+    async with Store(url) as store:
+        assert await store.keys() == ['a', 'b', 'c', 'items']
+        assert await store.get_json('a') == {'x': 1}
+        assert await store.get_collection_json('items') == {
+            'b': {'b': 2}, 'c': {}, 'd': {'d': 4}}
+        assert store.backend._expiry == {'b': now + 60, 'c': now + 120}
+
+
+@pytest.mark.asyncio
+async def test_memory_store_snapshot(url, tmp_path):
+    async with Store(url) as store:
+        await store.set_many_json({f'key.{i}': {'i': i} for i in range(2500)})
+        await store.set_json('key.0', {'i': -1})
+
+        backend = store.backend
+        await backend._persistence.snapshot(lambda: list(backend._dict), backend._entry)
+        await store.set_json('key.1', {'i': -2})
+        await store.set_json('new', {})
+
+    assert sorted(os.listdir(tmp_path)) == ['lock', 'log.1', 'snapshot']
+
+    async with Store(url) as store:
+        assert len(await store.keys()) == 2501
+        assert await store.get_json('key.0') == {'i': -1}
+        assert await store.get_json('key.1') == {'i': -2}
+        assert await store.get_json('key.2') == {'i': 2}
+
+
+@pytest.mark.asyncio
+async def test_memory_store_ignores_incomplete_log_records(url, tmp_path):
+    async with Store(url) as store:
+        await store.set_json('a', {})
+
+    log = os.path.join(tmp_path, 'log.0')
+    size = os.path.getsize(log)
+    with open(log, 'ab') as f:
+        f.write(encode(SET, 'b', '{}')[:-1])
+
+    async with Store(url) as store:
+        assert await store.keys() == ['a']
+    assert os.path.getsize(log) == size
+
+
+@pytest.mark.asyncio
+async def test_memory_persist_dir_is_locked(url):
+    async with Store(url):
+        with pytest.raises(RuntimeError):
+            await MemoryBackend(url).connect()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('layout', ['', '&compact=true'])
+async def test_memory_store_restores_extended_expiry(url, layout):
+    key = f'session.id.{uuid.uuid4()}'
+    now = time.time()
+    async with Store(url + layout) as store:
+        await store.set_json(key, {'x': 1}, until=now + 0.05)
+        await store.set_json('other', {}, until=now + 0.05)
+        await store.expire_many({key: now + 3600})
+
+    time.sleep(0.1)
+
+    async with Store(url + layout) as store:
+        assert await store.keys() == [key]
+        assert await store.get_json(key) == {'x': 1}
+        assert store.backend._until(key) == now + 3600
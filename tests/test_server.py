@@ -0,0 +1,84 @@
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def workers(log):
+    return re.findall(r'Worker (\d+) started', log.read_text())
+
+
+@pytest.fixture
+def env():
+    return {}
+
+
+@pytest.fixture
+def server(tmp_path, env):
+    port = free_port()
+    log = tmp_path / 'server.log'
+    env = {**os.environ, 'APP_PORT': str(port), 'SERVER_CONCURRENCY': '2', **env}
+    with open(log, 'w') as output:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'app.server'], env=env,
+            stdout=output, stderr=subprocess.STDOUT)
+    yield process, f'http://127.0.0.1:{port}', log
+
+    if process.poll() is None:
+        process.kill()
+        process.wait()
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except OSError:
+        return None
+
+
+def test_server_rolling_restart_and_stop(server):
+    process, url, log = server
+
+    assert wait_for(lambda: get(f'{url}/healthz') == 200)
+    assert len(workers(log)) == 2
+
+    process.send_signal(signal.SIGHUP)
+    assert wait_for(lambda: log.read_text().count('Finished server process') == 2)
+    assert len(workers(log)) == 4
+    assert get(f'{url}/healthz') == 200
+
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(timeout=15) == 0
+    assert 'Server stopped' in log.read_text()
+
+
+@pytest.mark.parametrize('env', [{'STORE_URL': 'unsupported://'}])
+def test_server_exits_when_workers_keep_crashing(server):
+    process, _, log = server
+
+    assert process.wait(timeout=30) == 1
+    delays = re.findall(r'replacing it in ([\d.]+)s', log.read_text())
+    assert [float(delay) for delay in delays] == [0.2, 0.4, 0.8, 1.6, 3.2]
+    assert 'workers crashed in a row' in log.read_text()
@@ -1,11 +1,20 @@
+import asyncio
+import functools
+import os
 import pytest
 import json
+import subprocess
+import sys
+import time
+import uuid
 
+from app.codec import AVAILABLE, get_codec
+from app.constants import STORE_KEY, STORE_KEY_BINARY_PREFIX
 from app.settings import settings
-from app.store import Store
+from app.store import MemoryBackend, Store
 
 
-@pytest.fixture(params=['memory://', settings.redis.url])
+@pytest.fixture(params=['memory://', 'memory://?compact=true', settings.redis.url])
 async def store(request):
     async with Store(request.param) as st:
         yield st
@@ -42,6 +51,26 @@ async def test_store_get_collection_json(store):
         'item1': {'x': 1, 'y': 2}, 'item2': {'u': 3, 'v': 4}}
 
     assert await store.get_collection_json('other') == {}
+    assert await store.get_collections_json(['other', 'test']) == [
+        {}, {'item1': {'x': 1, 'y': 2}, 'item2': {'u': 3, 'v': 4}}]
+
+
+@pytest.mark.asyncio
+async def test_store_backend_dump_restore(store):
+    until = int(time.time()) + 60
+    await store.backend.set('test', '{"x": 1}', until=until)
+    await store.backend.set_items('coll', {'a': '1', 'b': '2'})
+
+    dumped, coll = await store.backend.dump('test'), await store.backend.dump('coll')
+    assert dumped[1] == pytest.approx(until, abs=1) and coll[1] is None
+    assert await store.backend.dump('missing') is None
+
+    assert await store.backend.restore('copy', *dumped)
+    assert await store.backend.restore('coll.copy', *coll)
+    assert not await store.backend.restore('test', *coll)
+    assert await store.backend.get('copy') == '{"x": 1}'
+    assert await store.backend.get_collection('coll.copy') == {'a': '1', 'b': '2'}
+    assert await store.backend.get('test') == '{"x": 1}'
 
 
 @pytest.mark.asyncio
@@ -63,3 +92,557 @@ async def test_store_set_item_json(store):
 
     assert await store.backend.get_item('test', 'item1') == json.dumps({'x': 1, 'y': 2})
     assert await store.backend.get_item('test', 'item2') == json.dumps({'u': 3, 'v': 4})
+
+
+@pytest.mark.asyncio
+async def test_store_create_json(store):
+    assert await store.create_json('test', {'x': 1}, until=time.time() + 60)
+    assert not await store.create_json('test', {'x': 2})
+
+    assert await store.get_json('test') == {'x': 1}
+
+
+@pytest.mark.asyncio
+async def test_store_create_many_json(store):
+    await store.set_json('test1', {'x': 1})
+
+    assert await store.create_many_json(
+        {'test1': {'x': 2}, 'test2': {'y': 2}}, until=time.time() + 60) == [False, True]
+    assert await store.get_many_json(['test1', 'test2']) == {
+        'test1': {'x': 1}, 'test2': {'y': 2}}
+
+
+@pytest.mark.asyncio
+async def test_store_get_many_json(store):
+    await store.set_json('test1', {'x': 1})
+    await store.set_json('test2', {'y': 2})
+
+    assert await store.get_many_json(['test1', 'other', 'test2']) == {
+        'test1': {'x': 1}, 'test2': {'y': 2}}
+    assert await store.get_many_json([]) == {}
+
+
+@pytest.mark.asyncio
+async def test_store_set_many_json(store):
+    await store.set_many_json({'test1': {'x': 1}, 'test2': {'y': 2}}, until=time.time() + 60)
+
+    assert await store.get_json('test1') == {'x': 1}
+    assert await store.get_json('test2') == {'y': 2}
+
+
+@pytest.fixture(params=['memory://', settings.redis.url])
+async def cached_store(request):
+    async with Store(request.param, cache_size=10, cache_ttl=60) as st:
+        yield st
+
+
+@pytest.mark.asyncio
+async def test_store_cache_read_through(cached_store):
+    await cached_store.set_json('test', {'x': 1})
+
+    assert await cached_store.get_json('test') == {'x': 1}
+    await cached_store.backend.set('test', json.dumps({'x': 2}))
+    assert await cached_store.get_json('test') == {'x': 1}
+    assert await cached_store.get_many_json(['test']) == {'test': {'x': 1}}
+    assert cached_store.cache.hits == 2
+
+    await cached_store.set_json('test', {'x': 3})
+    assert await cached_store.get_json('test') == {'x': 3}
+
+
+@pytest.mark.asyncio
+async def test_store_cache_is_invalidated_by_other_stores(cached_store):
+    if isinstance(cached_store.backend, MemoryBackend):
+        pytest.skip('Memory backend is not shared between stores')
+
+    async with Store(settings.redis.url, cache_size=10) as other:
+        await cached_store.set_json('test', {'x': 1})
+        await cached_store.get_json('test')
+        await other.set_json('test', {'x': 2})
+        await asyncio.sleep(0.05)
+
+        assert await cached_store.get_json('test') == {'x': 2}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('read', [
+    lambda store: store.get_json('test'),
+    lambda store: store.get_many_json(['test']),
+], ids=['get_json', 'get_many_json'])
+async def test_store_cache_is_not_filled_by_stale_reads(cached_store, read):
+    await cached_store.set_json('test', {'x': 1})
+    fetched = asyncio.Event()
+    release = asyncio.Event()
+    backend = cached_store.backend
+    get, get_many = backend.get, backend.get_many
+
+    async def slow(call, *args):
+        raw = await call(*args)
+        fetched.set()
+        await release.wait()
+        return raw
+
+    backend.get = functools.partial(slow, get)
+    backend.get_many = functools.partial(slow, get_many)
+    stale = asyncio.create_task(read(cached_store))
+    await fetched.wait()
+    # Written meanwhile, by this process or another one
+    await backend.set('test', json.dumps({'x': 2}))
+    cached_store.cache.invalidate('test')
+    release.set()
+    await stale
+
+    assert cached_store.cache.get('test') is None
+    assert await cached_store.get_json('test') == {'x': 2}
+    assert await cached_store.get_json('test') == {'x': 2}
+    assert cached_store.cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_memory_store_expiry(monkeypatch):
+    async with Store('memory://') as store:
+        now = time.time()
+        await store.set_json('test1', {'x': 1}, until=now + 10)
+        await store.set_json('test2', {'x': 2}, until=now + 20)
+
+        monkeypatch.setattr(time, 'time', lambda: now + 15)
+
+        assert not await store.exists('test1')
+        assert await store.get_json('test1') == {}
+        assert await store.get_json('test2') == {'x': 2}
+        assert store.backend.size['entries'] == 1
+
+        monkeypatch.setattr(time, 'time', lambda: now + 25)
+
+        assert await store.get_json('test2') == {}
+        assert store.backend.size == {'entries': 0, 'bytes': 0}
+
+
+@pytest.mark.asyncio
+async def test_memory_store_overwrite_clears_expiry(monkeypatch):
+    async with Store('memory://') as store:
+        now = time.time()
+        await store.set_json('test', {'x': 1}, until=now + 10)
+        await store.set_json('test', {'x': 2})
+
+        monkeypatch.setattr(time, 'time', lambda: now + 15)
+
+        assert await store.get_json('test') == {'x': 2}
+
+
+@pytest.mark.asyncio
+async def test_memory_store_max_entries():
+    async with Store('memory://?max_entries=2') as store:
+        await store.set_json('test1', {'x': 1})
+        await store.set_json('test2', {'x': 2})
+        await store.get_json('test1')
+        await store.set_json('test3', {'x': 3})
+
+        assert await store.get_many_json(['test1', 'test2', 'test3']) == {
+            'test1': {'x': 1}, 'test3': {'x': 3}}
+
+
+@pytest.mark.asyncio
+async def test_memory_store_max_bytes():
+    async with Store('memory://?max_bytes=30') as store:
+        await store.set_json('test1', {'x': 1})
+        await store.set_json('test2', {'x': 2})
+        await store.set_json('test3', {'x': 3})
+
+        assert store.backend.size['bytes'] <= 30
+        assert not await store.exists('test1')
+        assert await store.exists('test3')
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('url', ['memory://', 'memory://?compact=true'])
+async def test_memory_store_memory(url):
+    async with Store(url) as store:
+        empty = store.backend.memory()
+        await store.set_json('test', {'x': 1}, until=time.time() + 60)
+        await store.set_items_json('coll', {'a': {'x': 1}, 'b': {}})
+        await store.set_item_json('coll', 'c', {'y': 2})
+
+        memory = store.backend.memory()
+        assert memory['entries'] == 2
+        assert memory['bytes'] == store.backend.size['bytes'] > 0
+        assert memory['overhead'] > empty['overhead']
+
+        await store.delete_items('coll', ['a', 'b', 'c'])
+        store.backend._remove('test')
+        assert store.backend._allocated == 0
+        assert store.backend.memory()['bytes'] == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('url', ['memory://', 'memory://?compact=true'])
+async def test_memory_store_refreshes_keep_memory_flat(url):
+    now = time.time()
+    keys = [f'key.{i}' for i in range(10)]
+    async with Store(url) as store:
+        await store.backend.set_many({key: '{}' for key in keys}, until=now + 60)
+        # Sliding expiration: each refresh supersedes the previous deadline
+        for i in range(6000):
+            await store.backend.expire_many({key: now + 60 + i for key in keys})
+
+        assert store.backend.memory()['overhead'] < 200_000
+        assert await store.backend.get('key.1') == '{}'
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('codec', [
+    name for name, available in AVAILABLE.items() if available])
+async def test_store_codec(store, codec):
+    writer = Store('memory://', codec=codec)
+    writer.backend = store.backend
+    writer.is_connected = True
+
+    await writer.set_json('test', {'x': 1})
+    await writer.set_item_json('coll', 'item', {'y': 2})
+
+    assert await store.get_json('test') == {'x': 1}
+    assert await store.get_many_json(['test']) == {'test': {'x': 1}}
+    assert await store.get_collection_json('coll') == {'item': {'y': 2}}
+
+
+@pytest.mark.asyncio
+async def test_store_get_json_raw(store):
+    await store.backend.set('test', '{"x":  1}')
+    assert await store.get_json_raw('test') == '{"x":  1}'
+    assert await store.get_json_raw('other') == ''
+
+    if AVAILABLE['msgpack']:
+        await store.backend.set('test', get_codec('msgpack').dumps({'x': 1}))
+        assert json.loads(await store.get_json_raw('test')) == {'x': 1}
+
+
+@pytest.mark.asyncio
+async def test_store_compression(store):
+    writer = Store('memory://', compress_threshold=100)
+    writer.backend = store.backend
+    writer.is_connected = True
+    large = {'data': {'text': 'a' * 1000}}
+
+    await writer.set_json('small', {'x': 1})
+    await writer.set_many_json({'large': large})
+
+    assert await store.backend.get('small') == '{"x": 1}'
+    assert (await store.backend.get('large'))[:1] == b'\x02'
+    assert await store.get_json('large') == large
+    assert json.loads(await store.get_json_raw('large')) == large
+    assert [json.loads(raw) for raw in await store.get_many_json_raw(['large'])] == [
+        large]
+
+
+@pytest.mark.asyncio
+async def test_store_iter_keys(store):
+    for i in range(25):
+        await store.set_json(f'test.{i}', {'x': i})
+    await store.set_json('other', {})
+
+    keys = [key async for key in store.iter_keys('test.*', count=10)]
+
+    assert sorted(keys) == sorted(f'test.{i}' for i in range(25))
+    assert sorted(await store.keys('test.1*')) == sorted(
+        ['test.1'] + [f'test.{i}' for i in range(10, 20)])
+
+
+@pytest.mark.asyncio
+async def test_store_is_ready(store):
+    assert store.is_ready()
+
+    if isinstance(store.backend, MemoryBackend):
+        return
+
+    pool = store.backend._connection.connection
+    store.backend.max_pool_usage = 1 / pool.maxsize
+    connection = await pool.acquire()
+    try:
+        assert not store.is_ready()
+    finally:
+        pool.release(connection)
+
+
+@pytest.mark.asyncio
+async def test_redis_health_check_replaces_dead_connections(store):
+    if isinstance(store.backend, MemoryBackend):
+        pytest.skip('Redis only')
+
+    pool = store.backend._connection.connection
+    connection = await pool.acquire()
+    pool.release(connection)
+    connection.close()
+    await connection.wait_closed()
+
+    await store.backend._check_connections()
+
+    assert store.is_ready()
+    assert pool.freesize >= pool.minsize
+    assert await store.backend._connection.ping() == 'PONG'
+
+
+@pytest.fixture
+async def pipelined_store():
+    if not settings.redis.url.startswith('redis://'):
+        pytest.skip('Redis only')
+
+    async with Store(settings.redis.url + '&autopipeline=True') as st:
+        yield st
+
+
+@pytest.mark.asyncio
+async def test_redis_autopipeline(pipelined_store):
+    backend = pipelined_store.backend
+    until = int(time.time()) + 60
+
+    await asyncio.gather(*(
+        pipelined_store.set_json(f'test.{i}', {'i': i}, until=until) for i in range(50)))
+    results = await asyncio.gather(*(
+        pipelined_store.get_json(f'test.{i}') for i in range(50)))
+
+    assert results == [{'i': i} for i in range(50)]
+    assert await backend._connection.ttl('test.0') > 0
+    assert not await backend.create('test.0', '{}')
+    assert await backend.exists('test.0')
+    assert backend._pipeline == []
+
+
+@pytest.mark.asyncio
+async def test_redis_autopipeline_errors(pipelined_store):
+    backend = pipelined_store.backend
+    await backend.set_item('test.hash', 'x', '1')
+
+    # The error of a command does not affect the others in the same pipeline
+    results = await asyncio.gather(
+        backend.get_item('test.hash', 'x'), backend.get('test.hash'),
+        return_exceptions=True)
+
+    assert results[0] == '1'
+    assert 'WRONGTYPE' in str(results[1])
+
+
+@pytest.mark.asyncio
+async def test_redis_autopipeline_cancelled(pipelined_store):
+    backend = pipelined_store.backend
+    await backend.set('test', '{}')
+
+    task = asyncio.create_task(backend.get('test'))
+    await asyncio.sleep(0)
+    task.cancel()
+
+    assert await backend.get('test') == '{}'
+
+
+def session_key():
+    return STORE_KEY.format(session_id=uuid.uuid4())
+
+
+@pytest.fixture
+async def text_store():
+    if not settings.redis.url.startswith('redis://'):
+        pytest.skip('Redis only')
+
+    async with Store(settings.redis.url) as st:
+        yield st
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('key_encoding', ['binary', 'migrate'])
+async def test_store_binary_keys(text_store, key_encoding):
+    key, other = session_key(), session_key()
+    binary_key = STORE_KEY_BINARY_PREFIX + uuid.UUID(key[-36:]).bytes
+
+    async with Store(settings.redis.url, key_encoding=key_encoding) as store:
+        assert await store.create_json(key, {'x': 1}, until=time.time() + 60)
+        assert not await store.create_json(key, {'x': 2})
+        await store.set_items_json(other, {'a': {'x': 1}})
+        await store.set_item_json(other, 'b', {'x': 2})
+        await store.set_json('test', {'x': 3})
+
+        assert await text_store.backend.get(binary_key) == '{"x": 1}'
+        assert not await text_store.exists(key)
+        assert await store.get_json(key) == {'x': 1}
+        assert await store.get_many_json([key, 'test', 'missing']) == {
+            key: {'x': 1}, 'test': {'x': 3}}
+        assert await store.exists(other)
+        assert await store.get_item_json(other, 'b') == {'x': 2}
+        assert sorted(await store.keys()) == sorted([key, other, 'test'])
+        assert sorted(await store.keys('session.id.*')) == sorted([key, other])
+
+
+@pytest.mark.asyncio
+async def test_store_migrate_key_encoding(text_store):
+    keys = [session_key() for _ in range(5)]
+    for i, key in enumerate(keys[:4]):
+        await text_store.set_json(key, {'i': i}, until=time.time() + 60)
+    await text_store.set_items_json(keys[4], {'a': {}})
+    await text_store.set_json('test', {})
+
+    async with Store(settings.redis.url, key_encoding='migrate') as store:
+        # Text keys are read when there is no binary key
+        assert await store.get_json(keys[0]) == {'i': 0}
+        assert await store.get_many_json(keys[:2]) == {
+            keys[0]: {'i': 0}, keys[1]: {'i': 1}}
+        assert await store.exists(keys[2])
+        assert await store.get_collection_json(keys[4]) == {'a': {}}
+        assert await store.get_collections_json([keys[4], session_key()]) == [
+            {'a': {}}, {}]
+        assert not await store.create_json(keys[0], {})
+        assert await store.create_many_json({keys[0]: {}}) == [False]
+
+        # Written keys are renamed first
+        await store.set_item_json(keys[4], 'b', {})
+        await store.expire_many({keys[1]: int(time.time()) + 120})
+        await store.set_json(keys[2], {'i': 2}, until=time.time() + 60)
+        assert not await text_store.exists(keys[4])
+        assert not await text_store.exists(keys[2])
+        assert await store.get_collection_json(keys[4]) == {'a': {}, 'b': {}}
+        assert sorted(await store.keys()) == sorted([*keys, 'test'])
+
+        # A text key written by a process not migrated yet is outdated
+        await text_store.set_json(keys[1], {'i': -1})
+        assert await store.get_json(keys[1]) == {'i': 1}
+        assert sorted([key async for key in store.iter_keys(count=2)]) == sorted(
+            [*keys, 'test'])
+
+        assert await store.migrate_keys(count=2) == 1
+        assert await text_store.keys() == ['test']
+
+        # Stores disconnected in test mode flush the db
+        async with Store(settings.redis.url, key_encoding='binary') as binary_store:
+            assert await binary_store.get_many_json(keys[:4]) == {
+                key: {'i': i} for i, key in enumerate(keys[:4])}
+            assert 60 < await binary_store.backend._connection.ttl(
+                STORE_KEY_BINARY_PREFIX + uuid.UUID(keys[1][-36:]).bytes) <= 120
+
+
+@pytest.mark.asyncio
+async def test_store_key_encoding_errors():
+    with pytest.raises(NameError):
+        Store('memory://', key_encoding='base64')
+
+    with pytest.raises(ValueError):
+        await Store('memory://', key_encoding='binary').connect()
+
+
+@pytest.mark.asyncio
+async def test_store_coalesces_concurrent_reads(store):
+    await store.set_json('test', {'x': 1})
+    calls = []
+    get = store.backend.get
+
+    async def counted_get(key):
+        calls.append(key)
+        return await get(key)
+
+    store.backend.get = counted_get
+
+    values = await asyncio.gather(*(store.get_json('test') for _ in range(10)))
+    raws = await asyncio.gather(*(store.get_json_raw('test') for _ in range(2)))
+
+    assert values == [{'x': 1}] * 10
+    assert raws[0] == raws[1]
+    assert calls == ['test', 'test']
+    assert store.coalesced == 10
+    # Every caller gets its own dict
+    values[0]['x'] = 2
+    assert values[1] == {'x': 1}
+    assert store._in_flight == {}
+
+
+@pytest.mark.asyncio
+async def test_store_coalesced_errors_and_cancellation(store):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def failing_exists(key):
+        started.set()
+        await release.wait()
+        raise ConnectionError('down')
+
+    store.backend.exists = failing_exists
+
+    first = asyncio.create_task(store.exists('test'))
+    second = asyncio.create_task(store.exists('test'))
+    await started.wait()
+
+    # Cancelling a caller doesn't cancel the call shared with the others
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    with pytest.raises(ConnectionError):
+        await second
+    assert first.cancelled()
+    assert store._in_flight == {}
+
+
+@pytest.mark.asyncio
+async def test_store_write_is_not_joined_by_stale_reads(store):
+    await store.set_json('test', {'x': 1})
+    fetched = asyncio.Event()
+    release = asyncio.Event()
+    get = store.backend.get
+
+    async def slow_get(key):
+        raw = await get(key)
+        fetched.set()
+        await release.wait()
+        return raw
+
+    store.backend.get = slow_get
+    stale = asyncio.create_task(store.get_json('test'))
+    await fetched.wait()
+    fetched.clear()
+
+    await store.set_json('test', {'x': 2})
+    fresh = asyncio.create_task(store.get_json('test'))
+    await fetched.wait()
+    release.set()
+
+    assert await stale == {'x': 1}
+    assert await fresh == {'x': 2}
+    assert store.coalesced == 0
+
+
+@pytest.mark.asyncio
+async def test_store_collection_items(store):
+    until = int(time.time()) + 60
+
+    assert await store.create_items_json(
+        'coll', {'a': {'x': 1}, 'b': {'x': 2}}, until=until)
+    assert not await store.create_items_json('coll', {'a': {}})
+
+    await store.set_items_json('coll', {'b': {'x': 3}, 'c': {'x': 4}})
+    await store.delete_items('coll', ['a', 'missing'])
+
+    assert await store.get_collection_json('coll') == {'b': {'x': 3}, 'c': {'x': 4}}
+    if not isinstance(store.backend, MemoryBackend):
+        # Changing items keeps the expiry of the collection
+        assert 0 < await store.backend._connection.ttl('coll') <= 60
+    else:
+        assert store.backend._until('coll') == until
+
+    await store.delete_items('coll', ['b', 'c'])
+    assert not await store.exists('coll')
+
+
+@pytest.mark.asyncio
+async def test_store_backend_is_created_when_connecting():
+    store = Store('memory://')
+    assert store.backend is None
+
+    async with store:
+        assert isinstance(store.backend, MemoryBackend)
+
+    with pytest.raises(NameError):
+        Store('xxx://')
+
+
+def test_redis_client_is_imported_lazily():
+    env = {k: v for k, v in os.environ.items() if not k.startswith('REDIS_')}
+    output = subprocess.run(
+        [sys.executable, '-c', 'import sys, app.main; print("aioredis" in sys.modules)'],
+        capture_output=True, text=True, check=True, env=env).stdout
+
+    assert output.strip() == 'False'